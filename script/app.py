@@ -1,38 +1,88 @@
-from fastapi import FastAPI, HTTPException, Depends
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
-from datetime import datetime, date as cdate, timedelta
-from passlib.context import CryptContext
-import jwt as PyJWT
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-
-from db import get_connection 
-from db import fetch_tasks, log_stress_entry, fetch_user_prefs, store_schedule
-from scheduler import generate_schedule
+import asyncio
+import contextvars
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from fastapi import FastAPI, HTTPException, Depends, Request, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, EmailStr, ValidationError
+from typing import Optional, List, Literal
+from datetime import datetime, date as cdate, time as ctime, timedelta
+
+from db import PoolTimeout, TASK_COLUMNS
+from repository import get_repository, STORAGE_BACKEND, SQLITE_PATH
+from migrations import AUTO_MIGRATE
+import metrics
+from scheduler import (
+    generate_schedule, MAX_HORIZON_DAYS, PLAN_ROLLOUTS, MAX_ROLLOUTS, fixed_task_interval, fixed_block_index,
+)
+from reschedule import reschedule_task_change
+from entries import schedule_to_json
+from intervals import IntervalIndex
+from pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, STREAM_PREFETCH, decode_cursor, page, ndjson_response, csv_response,
+)
+from ingest import ndjson_records, csv_records
+from auth import (
+    hash_password_async, verify_password_async, create_access_token, get_current_user_id,
+    require_admin, auth_stats, shutdown_auth,
+)
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
+repo = get_repository()
+
+# Schedule generation and rescheduling are CPU-bound; they run on their own
+# bounded pool so they cannot starve the threads serving sync routes
+SCHEDULE_WORKERS = int(os.environ.get("FIKA_SCHEDULE_WORKERS", "4"))
+schedule_executor = ThreadPoolExecutor(max_workers=SCHEDULE_WORKERS, thread_name_prefix="schedule")
+
+# POST /tasks/bulk: rows validated and written per chunk, the most rows one
+# import may hold, and how many row errors the response lists
+BULK_CHUNK_SIZE = int(os.environ.get("FIKA_BULK_CHUNK_SIZE", "500"))
+BULK_MAX_ROWS = int(os.environ.get("FIKA_BULK_MAX_ROWS", "10000"))
+BULK_MAX_ERRORS = 100
+
+# POST /admin/schedule/generate queues batch.py as a child process, one job
+# at a time, so planning never runs (or forks its pool) in an API worker.
+# The last BATCH_JOB_HISTORY jobs are kept in memory for status polls.
+BATCH_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "batch.py")
+BATCH_JOB_HISTORY = 20
+batch_jobs = {}
+_batch_job_ids = itertools.count(1)
+_batch_job_tasks = set()
+
+async def run_scheduling(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Carry the request context over so its database queries are counted
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(schedule_executor, partial(context.run, func, *args, **kwargs))
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Latency and database queries per route template (not per raw path)."""
+    started = time.perf_counter()
+    with metrics.track_request_queries() as queries:
+        response = await call_next(request)
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - started, method=request.method, route=route, status=response.status_code
+    )
+    metrics.HTTP_REQUEST_DB_QUERIES.observe(queries[0], method=request.method, route=route)
+    metrics.HTTP_REQUEST_DB_SECONDS.observe(queries[1], method=request.method, route=route)
+    return response
 
-# JWT Configuration
-SECRET_KEY = "your-secret-key-here"  # Change this to a secure secret key
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
-
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
-
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
-
-def create_access_token(data: dict):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = PyJWT.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+@app.exception_handler(PoolTimeout)
+def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
 
 # Login Models
 class LoginRequest(BaseModel):
@@ -104,6 +154,9 @@ class Task(BaseModel):
     stress_entry: Optional[int] = None
     user_id: int
 
+class BulkTask(Task):
+    user_id: Optional[int] = None  # the token's user; must match when given
+
 class Entry(BaseModel):
     user_id: int
     task_id: Optional[int] = None
@@ -118,6 +171,12 @@ class UserPreferences(BaseModel):
     occupation: str
     stressBaseLevel: int
 
+class BatchScheduleRequest(BaseModel):
+    user_ids: Optional[List[int]] = None  # None schedules every user
+    workers: Optional[int] = None
+    horizon_days: int = 1
+    solver: Literal["rl", "heuristic"] = "rl"
+
 class ScheduleItem(BaseModel):
     task_id: Optional[int]
     task: str
@@ -125,83 +184,86 @@ class ScheduleItem(BaseModel):
     end: str
     type: str  # "Fixed", "Flexible", or "Break"
 
+def task_values(task: Task):
+    """Column values for a task row. Stored timestamps are naive, so keep wall-clock times."""
+    return {k: v.replace(tzinfo=None) if isinstance(v, datetime) else v
+            for k, v in task.dict(include=set(TASK_COLUMNS)).items()}
+
+async def check_fixed_task_conflicts(user_id: int, task: Task, task_id: Optional[int] = None):
+    """Reject a fixed task that overlaps another active fixed task of the user."""
+    if not task.fixed_time or task.archived or task.start_time is None:
+        return
+    start, end = fixed_task_interval(task_values(task))
+    if not start < end:
+        raise HTTPException(status_code=400, detail="Fixed task must end after it starts")
+    others = [
+        (*fixed_task_interval(t), t)
+        for t in await repo.afetch_fixed_tasks(user_id) if t["id"] != task_id
+    ]
+    conflicts = fixed_block_index(others).overlapping(start, end)
+    if conflicts:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Fixed task overlaps existing fixed tasks", "conflicting_task_ids": conflicts},
+        )
+
 # --- ROUTES ---
 
 # User Routes
 @app.post("/users/")
-def create_user(user: User):
-    conn = get_connection()
-    cur = conn.cursor()
+async def create_user(user: User):
     # Check for existing email or username
-    cur.execute("SELECT id FROM users WHERE email = %s", (user.email,))
-    if cur.fetchone():
+    conflict = await repo.afind_user_conflict(user.email, user.username)
+    if conflict == "email":
         raise HTTPException(status_code=400, detail="Email already registered")
-    cur.execute("SELECT id FROM users WHERE username = %s", (user.username,))
-    if cur.fetchone():
+    if conflict == "username":
         raise HTTPException(status_code=400, detail="Username already taken")
     # Hash the password before storing
-    hashed_pw = hash_password(user.password)
-    cur.execute("""
-        INSERT INTO users (
-            username, password, email, name, lname, gender, time_pref, stress_base, work_pref, sleep_pref, sleep_goal, occupation, birthday, created_at
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-        RETURNING id, username, email, name, lname, gender, time_pref, stress_base, work_pref, sleep_pref, sleep_goal, occupation, birthday, created_at
-    """, (
-        user.username, hashed_pw, user.email, user.name, user.lname, user.gender, user.time_pref, user.stress_base, user.work_pref, user.sleep_pref, user.sleep_goal, user.occupation, user.birthday
-    ))
-    new_user = cur.fetchone()
-    conn.commit()
-    conn.close()
+    values = user.dict()
+    values["password"] = await hash_password_async(user.password)
+    new_user = await repo.ainsert_user(values)
     return {"message": "User created successfully!", "user": new_user}
 
 # Updated User Routes
 @app.post("/signup/initial", response_model=SignupResponse)
-def initial_signup(signup_data: InitialSignupRequest):
-    conn = get_connection()
-    cur = conn.cursor()
-    
+async def initial_signup(signup_data: InitialSignupRequest):
     # Check for existing email or username
-    cur.execute("SELECT id FROM users WHERE email = %s", (signup_data.email,))
-    if cur.fetchone():
+    conflict = await repo.afind_user_conflict(signup_data.email, signup_data.username)
+    if conflict == "email":
         raise HTTPException(status_code=400, detail="Email already registered")
-    
-    cur.execute("SELECT id FROM users WHERE username = %s", (signup_data.username,))
-    if cur.fetchone():
+    if conflict == "username":
         raise HTTPException(status_code=400, detail="Username already taken")
-    
+
     # Hash the password before storing
-    hashed_pw = hash_password(signup_data.password)
-    
+    hashed_pw = await hash_password_async(signup_data.password)
+
     # Set default values for required fields
     default_sleep_pref = 8  # Default 8 hours of sleep
-    default_sleep_goal = "22:00"  # Default sleep time
+    default_sleep_goal = ctime(22)  # Default sleep time
     default_occupation = "Student"  # Default occupation
-    
+
     # Insert the initial user data with default values for required fields
-    cur.execute("""
-        INSERT INTO users (
-            username, password, email, name, lname, gender, birthday, time_pref, stress_base, 
-            work_pref, sleep_pref, sleep_goal, occupation, created_at
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s::time, %s, CURRENT_TIMESTAMP)
-        RETURNING id, username, email
-    """, (
-        signup_data.username, hashed_pw, signup_data.email,
-        signup_data.firstName, signup_data.lastName,
-        signup_data.gender, signup_data.birthday, signup_data.time_pref, 
-        signup_data.stress_base, signup_data.work_pref, default_sleep_pref, default_sleep_goal,
-        default_occupation
-    ))
-    
-    new_user = cur.fetchone()
-    conn.commit()
-    
+    new_user = await repo.ainsert_user({
+        "username": signup_data.username,
+        "password": hashed_pw,
+        "email": signup_data.email,
+        "name": signup_data.firstName,
+        "lname": signup_data.lastName,
+        "gender": signup_data.gender,
+        "birthday": signup_data.birthday,
+        "time_pref": signup_data.time_pref,
+        "stress_base": signup_data.stress_base,
+        "work_pref": signup_data.work_pref,
+        "sleep_pref": default_sleep_pref,
+        "sleep_goal": default_sleep_goal,
+        "occupation": default_occupation,
+    })
+
     # Create access token
     access_token = create_access_token(
         data={"sub": str(new_user["id"]), "username": new_user["username"]}
     )
-    
-    conn.close()
-    
+
     return {
         "user_id": new_user["id"],
         "username": new_user["username"],
@@ -212,300 +274,450 @@ def initial_signup(signup_data: InitialSignupRequest):
 
 @app.post("/signup/preferences/{user_id}")
 def complete_signup(user_id: int, preferences: UserPreferences):
-    conn = get_connection()
-    cur = conn.cursor()
-    
     try:
-        # Verify user exists
-        cur.execute("SELECT id FROM users WHERE id = %s", (user_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="User not found")
-        
         # Map work time preference to integer
         time_pref_map = {"Morning": 0, "Afternoon": 1, "Night": 2}
         time_pref = time_pref_map.get(preferences.workTimePreference, 0)
-        
+
         # Map work style preference to string
         work_style_map = {"long_chunks": "Long Focused Blocks", "short_sprints": "Short Sprints"}
         work_pref = work_style_map.get(preferences.workStylePreference, "Long Focused Blocks")
-        
-        # Ensure sleep_goal is in HH:00 format
+
+        # Ensure sleep_goal is on the hour
         try:
             # Try to parse the time string
             if ":" in preferences.goalSleepTime:
-                hour = preferences.goalSleepTime.split(":")[0]
-                sleep_goal = f"{hour}:00"
+                sleep_goal = ctime(int(preferences.goalSleepTime.split(":")[0]))
             else:
                 # If it's not in the correct format, use a default
-                sleep_goal = "22:00"
+                sleep_goal = ctime(22)
         except Exception:
-            sleep_goal = "22:00"
-        
+            sleep_goal = ctime(22)
+
         # Update user preferences
-        cur.execute("""
-            UPDATE users 
-            SET work_pref = %s,
-                sleep_pref = %s,
-                sleep_goal = %s::time,
-                occupation = %s,
-                stress_base = %s
-            WHERE id = %s
-        """, (
-            work_pref,
-            preferences.goalSleepHours,
-            sleep_goal,
-            preferences.occupation,
-            preferences.stressBaseLevel,
-            user_id
-        ))
-        
-        conn.commit()
+        updated = repo.update_user_settings(user_id, {
+            "work_pref": work_pref,
+            "sleep_pref": preferences.goalSleepHours,
+            "sleep_goal": sleep_goal,
+            "occupation": preferences.occupation,
+            "stress_base": preferences.stressBaseLevel,
+        })
+        if not updated:
+            raise HTTPException(status_code=404, detail="User not found")
+
         return {"message": "Preferences updated successfully"}
-        
+
     except Exception as e:
-        conn.rollback()
-        print(f"Error in complete_signup: {str(e)}")  # Add debug logging
+        logger.exception("Error in complete_signup")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
 
 # Task Routes
+async def _reschedule_response(user_id, task_id, task=None):
+    mode, schedule = await run_scheduling(reschedule_task_change, user_id, task_id, task)
+    return {"mode": mode, "schedule": schedule_to_json(schedule)}
+
 @app.post("/tasks/")
-def create_task(task: Task, token: str = Depends(oauth2_scheme)):
-    try:
-        # Decode the JWT token to get the user ID
-        payload = PyJWT.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = int(payload["sub"])
-        
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        # Verify user exists
-        cur.execute("SELECT id FROM users WHERE id = %s", (user_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        # Create task with the authenticated user's ID
-        cur.execute("""
-            INSERT INTO tasks (
-                name, category, estimated_time, deadline, fixed_time, priority,
-                start_time, end_time, description, divided, archived, stress_entry, user_id
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            task.name, task.category, task.estimated_time, task.deadline,
-            task.fixed_time, task.priority, task.start_time, task.end_time,
-            task.description, task.divided, task.archived, task.stress_entry, user_id
-        ))
-        conn.commit()
-        conn.close()
-        return {"message": "Task added!"}
-    except PyJWT.PyJWTError:
-        raise HTTPException(status_code=401, detail="Invalid authentication token")
+async def create_task(task: Task, user_id: int = Depends(get_current_user_id), reschedule: bool = False):
+    await check_fixed_task_conflicts(user_id, task)
+
+    # Create task with the authenticated user's ID
+    new_task = await repo.ainsert_task(user_id, task_values(task))
+    response = {"message": "Task added!", "task_id": new_task["id"]}
+    if reschedule:
+        response["reschedule"] = await _reschedule_response(user_id, new_task["id"], new_task)
+    return response
 
 @app.get("/tasks/")
-def get_all_tasks(user_id: int):
-    tasks = fetch_tasks(user_id)
-    return {"tasks": tasks}
+async def get_all_tasks(
+    user_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json",
+):
+    """
+    Without limit/cursor, every active task in planning order (the shape the
+    iOS app decodes). With them, pages in id order plus a next_cursor;
+    format=ndjson streams the rows instead.
+    """
+    after_id = decode_cursor(cursor)
+    if format == "ndjson":
+        return ndjson_response(repo.astream_tasks(user_id, after_id, prefetch=STREAM_PREFETCH))
+    if limit is None and after_id is None:
+        tasks = await repo.afetch_tasks(user_id)
+        return {"tasks": tasks}
+    limit = limit or DEFAULT_PAGE_SIZE
+    tasks, next_cursor = page(await repo.afetch_tasks_page(user_id, after_id, limit + 1), limit)
+    return {"tasks": tasks, "next_cursor": next_cursor}
+
+class BulkImportRejected(Exception):
+    pass
+
+class BulkImport:
+    """
+    Validates the records of one bulk upload and hands them over in chunks
+    of task values. Fixed tasks are checked against the user's existing
+    fixed tasks and against the ones earlier in the upload.
+    """
+
+    def __init__(self, user_id, records, fixed_tasks, atomic):
+        self.user_id = user_id
+        self.records = records
+        self.atomic = atomic
+        self.rows = 0
+        self.errors = []
+        self.error_count = 0
+        self.fixed_index = IntervalIndex()
+        for t in fixed_tasks:
+            start, end = fixed_task_interval(t)
+            if start < end:
+                self.fixed_index.add(start, end, ("task", t["id"]))
+
+    def error(self, line, message, **details):
+        self.error_count += 1
+        if len(self.errors) < BULK_MAX_ERRORS:
+            self.errors.append({"line": line, "error": message, **details})
+
+    def validate(self, line, record):
+        """The task values of a record, or None after reporting why it was rejected."""
+        try:
+            task = BulkTask(**record)
+        except ValidationError as e:
+            fields = [{"field": ".".join(map(str, err["loc"])), "message": err["msg"]} for err in e.errors()]
+            self.error(line, "Invalid task", fields=fields)
+            return None
+        if task.user_id is not None and task.user_id != self.user_id:
+            self.error(line, "user_id does not match the authenticated user")
+            return None
+        values = task_values(task)
+        if task.fixed_time and not task.archived and task.start_time is not None:
+            start, end = fixed_task_interval(values)
+            if not start < end:
+                self.error(line, "Fixed task must end after it starts")
+                return None
+            conflicts = self.fixed_index.overlapping(start, end)
+            if conflicts:
+                self.error(
+                    line, "Fixed task overlaps other fixed tasks",
+                    conflicting_task_ids=[key for kind, key in conflicts if kind == "task"],
+                    conflicting_lines=[key for kind, key in conflicts if kind == "line"],
+                )
+                return None
+            self.fixed_index.add(start, end, ("line", line))
+        return values
+
+    async def chunks(self):
+        chunk = []
+        async for line, record, error in self.records:
+            self.rows += 1
+            if self.rows > BULK_MAX_ROWS:
+                raise HTTPException(status_code=413, detail="An import holds at most %d rows" % BULK_MAX_ROWS)
+            if error is not None:
+                self.error(line, error)
+                continue
+            values = self.validate(line, record)
+            if values is not None:
+                chunk.append(values)
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        # Raised inside the write, so an atomic import rolls back everything
+        if self.atomic and self.error_count:
+            raise BulkImportRejected()
+        if chunk:
+            yield chunk
+
+    def summary(self, imported):
+        return {
+            "rows": self.rows, "imported": imported, "failed": self.error_count,
+            "errors": self.errors, "errors_truncated": self.error_count > len(self.errors),
+        }
+
+@app.post("/tasks/bulk")
+async def import_tasks(
+    request: Request,
+    user_id: int = Depends(get_current_user_id),
+    format: Optional[Literal["ndjson", "csv"]] = None,
+    atomic: bool = False,
+):
+    """
+    Import tasks from a streamed NDJSON or CSV (header row first) body of
+    Task records; format defaults from the Content-Type. Rows are validated
+    and written in chunks of BULK_CHUNK_SIZE within one transaction. Invalid
+    rows are skipped and reported by line, or with atomic=true reject the
+    whole import (422) and nothing is written.
+    """
+    if format is None:
+        format = "csv" if request.headers.get("content-type", "").startswith("text/csv") else "ndjson"
+    records = (csv_records if format == "csv" else ndjson_records)(request.stream())
+    bulk = BulkImport(user_id, records, await repo.afetch_fixed_tasks(user_id), atomic)
+    try:
+        imported = await repo.ainsert_tasks(user_id, bulk.chunks())
+    except BulkImportRejected:
+        raise HTTPException(status_code=422, detail=bulk.summary(0))
+    return bulk.summary(imported)
+
+EXPORT_COLUMNS = ("id",) + TASK_COLUMNS
+
+@app.get("/tasks/export")
+async def export_tasks(user_id: int = Depends(get_current_user_id), format: Literal["ndjson", "csv"] = "ndjson"):
+    """Stream every task of the user, archived ones included, in a shape POST /tasks/bulk accepts."""
+    rows = repo.astream_task_export(user_id, prefetch=STREAM_PREFETCH)
+    if format == "csv":
+        return csv_response(rows, EXPORT_COLUMNS, filename="tasks.csv")
+    return ndjson_response(rows)
 
 @app.get("/tasks/{task_id}")
-def get_task(task_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM tasks WHERE id = %s", (task_id,))
-    task = cur.fetchone()
-    conn.close()
+async def get_task(task_id: int):
+    task = await repo.afetch_task(task_id)
     if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     return {"task": task}
 
 @app.put("/tasks/{task_id}")
-def update_task(task_id: int, task: Task):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE tasks SET
-            name = %s, category = %s, estimated_time = %s, deadline = %s,
-            fixed_time = %s, priority = %s, start_time = %s, end_time = %s,
-            description = %s, divided = %s, archived = %s, stress_entry = %s
-        WHERE id = %s
-        RETURNING *
-    """, (
-        task.name, task.category, task.estimated_time, task.deadline,
-        task.fixed_time, task.priority, task.start_time, task.end_time,
-        task.description, task.divided, task.archived, task.stress_entry, task_id
-    ))
-    updated_task = cur.fetchone()
-    conn.commit()
-    conn.close()
+async def update_task(task_id: int, task: Task, reschedule: bool = False):
+    await check_fixed_task_conflicts(task.user_id, task, task_id=task_id)
+    updated_task = await repo.aupdate_task(task_id, task_values(task))
     if updated_task is None:
         raise HTTPException(status_code=404, detail="Task not found")
-    return {"message": "Task updated!", "task": updated_task}
+    response = {"message": "Task updated!", "task": updated_task}
+    if reschedule:
+        response["reschedule"] = await _reschedule_response(updated_task["user_id"], task_id, updated_task)
+    return response
 
 @app.delete("/tasks/{task_id}")
-def delete_task(task_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM tasks WHERE id = %s RETURNING *", (task_id,))
-    deleted_task = cur.fetchone()
-    conn.commit()
-    conn.close()
+async def delete_task(task_id: int, reschedule: bool = False):
+    deleted_task = await repo.adelete_task(task_id)
     if deleted_task is None:
         raise HTTPException(status_code=404, detail="Task not found")
-    return {"message": "Task deleted!", "task": deleted_task}
+    response = {"message": "Task deleted!", "task": deleted_task}
+    if reschedule:
+        response["reschedule"] = await _reschedule_response(deleted_task["user_id"], task_id)
+    return response
 
 @app.get("/tasks/archived_count/")
-def get_archived_count(user_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) as count FROM tasks WHERE user_id = %s AND archived = TRUE", (user_id,))
-    row = cur.fetchone()
-    count = row["count"] if row and "count" in row else 0
-    conn.close()
-    return {"archived_count": count}
+async def get_archived_count(user_id: int):
+    return {"archived_count": await repo.afetch_archived_count(user_id)}
 
 # User Preferences Routes
 @app.post("/preferences/")
 def create_preferences(prefs: UserPreferences):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO user_preferences (
-            user_id, work_style, focus_period, stress_level,
-            break_preference, work_block_preference
-        ) VALUES (%s, %s, %s, %s, %s, %s)
-        ON CONFLICT (user_id) DO UPDATE SET
-            work_style = EXCLUDED.work_style,
-            focus_period = EXCLUDED.focus_period,
-            stress_level = EXCLUDED.stress_level,
-            break_preference = EXCLUDED.break_preference,
-            work_block_preference = EXCLUDED.work_block_preference
-        RETURNING *
-    """, (
-        prefs.user_id, prefs.work_style, prefs.focus_period,
-        prefs.stress_level, prefs.break_preference, prefs.work_block_preference
-    ))
-    preferences = cur.fetchone()
-    conn.commit()
-    conn.close()
+    preferences = repo.save_user_preferences({
+        "user_id": prefs.user_id, "work_style": prefs.work_style, "focus_period": prefs.focus_period,
+        "stress_level": prefs.stress_level, "break_preference": prefs.break_preference,
+        "work_block_preference": prefs.work_block_preference,
+    })
     return {"message": "Preferences saved!", "preferences": preferences}
 
 @app.get("/preferences/{user_id}")
 def get_preferences(user_id: int):
-    preferences = fetch_user_prefs(user_id)
+    preferences = repo.fetch_user_prefs(user_id)
     if preferences is None:
         raise HTTPException(status_code=404, detail="Preferences not found")
     return {"preferences": preferences}
 
 # Schedule Routes
+def schedule_etag(version):
+    return '"%d"' % version
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match holds "*" or a comma-separated list of (possibly weak) tags."""
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
 @app.post("/schedule/generate/{user_id}")
-def create_schedule(user_id: int):
+async def create_schedule(
+    user_id: int,
+    horizon_days: int = Query(1, ge=1, le=MAX_HORIZON_DAYS),
+    solver: Literal["rl", "heuristic"] = "rl",
+    force: bool = False,
+    rollouts: int = Query(PLAN_ROLLOUTS, ge=1, le=MAX_ROLLOUTS),
+):
     try:
-        # First, clear existing scheduled tasks for this user
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM scheduled_tasks WHERE user_id = %s", (user_id,))
-        conn.commit()
-        conn.close()
-        
-        # Generate and store new schedule
-        schedule = generate_schedule(user_id)
-        return {"message": "Schedule generated!", "schedule": schedule}
+        # Generate the new schedule; it atomically replaces the stored one.
+        # Unchanged inputs return the stored schedule unless `force` is set.
+        # rollouts > 1 keeps the best of that many RL episodes.
+        schedule, unscheduled = await run_scheduling(
+            generate_schedule, user_id, horizon_days=horizon_days, solver=solver, force=force,
+            rollouts=rollouts,
+        )
+        return {
+            "message": "Schedule generated!",
+            "schedule": schedule_to_json(schedule),
+            "unscheduled": [{"task_id": t["id"], "task": t["name"]} for t in unscheduled],
+        }
     except Exception as e:
-        print("Error in create_schedule:", e)
-        import traceback; traceback.print_exc()
+        logger.exception("Error in create_schedule for user %s", user_id)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/schedule/{user_id}")
-def get_schedule(user_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT * FROM scheduled_tasks 
-        WHERE user_id = %s 
-        ORDER BY start_time ASC
-    """, (user_id,))
-    schedule = cur.fetchall()
-    conn.close()
-    return {"schedule": schedule if schedule else []}
+async def get_schedule(user_id: int, request: Request):
+    """
+    Supports conditional requests: the ETag is the schedule's write version,
+    so a poll with a current If-None-Match gets a 304 after one key lookup.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        etag = schedule_etag(await repo.afetch_schedule_version(user_id))
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+    version, schedule = await repo.afetch_schedule_with_version(user_id)
+    return JSONResponse(
+        jsonable_encoder({"schedule": schedule if schedule else []}),
+        headers={"ETag": schedule_etag(version)},
+    )
+
+# Admin Routes
+async def run_batch_job(job, argv):
+    job["status"] = "running"
+    job["started_at"] = datetime.utcnow()
+    process = None
+    try:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, BATCH_SCRIPT, *argv,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        out, err = await process.communicate()
+        if process.returncode == 0:
+            job["status"], job["report"] = "finished", json.loads(out)
+        else:
+            job["status"] = "failed"
+            job["error"] = err.decode(errors="replace").strip()[-2000:] or "exit status %d" % process.returncode
+    except asyncio.CancelledError:
+        job["status"], job["error"] = "failed", "Cancelled at shutdown"
+        raise
+    except Exception as e:
+        logger.exception("Batch job %s failed", job["id"])
+        job["status"], job["error"] = "failed", "%s: %s" % (type(e).__name__, e)
+    finally:
+        if process is not None and process.returncode is None:
+            process.kill()
+        job["finished_at"] = datetime.utcnow()
+
+@app.post("/admin/schedule/generate", status_code=202)
+async def create_schedules_batch(request: BatchScheduleRequest, admin_id: int = Depends(require_admin)):
+    """Queue a batch run; poll the returned Location for its report."""
+    running = next((job for job in batch_jobs.values() if job["status"] in ("queued", "running")), None)
+    if running is not None:
+        raise HTTPException(
+            status_code=409, detail={"message": "A batch job is already running", "job_id": running["id"]}
+        )
+    if request.user_ids == []:
+        raise HTTPException(status_code=400, detail="user_ids is empty; omit it to schedule every user")
+    if STORAGE_BACKEND == "sqlite" and SQLITE_PATH == ":memory:":
+        # The job's child process would open an empty database of its own
+        raise HTTPException(
+            status_code=503, detail="Batch jobs need a database file; FIKA_SQLITE_PATH is :memory:"
+        )
+    argv = ["--horizon-days", str(request.horizon_days), "--solver", request.solver]
+    if request.workers is not None:
+        argv += ["--workers", str(request.workers)]
+    argv += ["--"] + [str(user_id) for user_id in request.user_ids or []]
+
+    job = {
+        "id": next(_batch_job_ids), "status": "queued", "requested_by": admin_id,
+        "created_at": datetime.utcnow(), "started_at": None, "finished_at": None,
+        "report": None, "error": None,
+    }
+    batch_jobs[job["id"]] = job
+    for job_id in list(batch_jobs)[:-BATCH_JOB_HISTORY]:
+        del batch_jobs[job_id]
+    task = asyncio.create_task(run_batch_job(job, argv))
+    _batch_job_tasks.add(task)
+    task.add_done_callback(_batch_job_tasks.discard)
+    return JSONResponse(
+        status_code=202,
+        content=jsonable_encoder({"message": "Batch schedule generation queued", "job": job}),
+        headers={"Location": "/admin/schedule/jobs/%d" % job["id"]},
+    )
+
+@app.get("/admin/schedule/jobs/{job_id}")
+async def get_schedules_batch(job_id: int, admin_id: int = Depends(require_admin)):
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return {"job": job}
+
+@app.post("/admin/mood/rollups/rebuild")
+def rebuild_rollups(admin_id: int = Depends(require_admin)):
+    rows = repo.rebuild_mood_rollups()
+    return {"message": "Mood rollups rebuilt", "rows": rows}
 
 # Mood Tracking Routes
 @app.post("/mood/")
-def log_mood(mood_entry: Entry):
-    conn = get_connection()
-    cur = conn.cursor()
-
-    if mood_entry.task_id:
-        cur.execute("SELECT id FROM tasks WHERE id = %s", (mood_entry.task_id,))
-        if cur.fetchone() is None:
-            raise HTTPException(status_code=404, detail="Task ID not found")
-
-    cur.execute("""
-        INSERT INTO mood_tracking (user_id, task_id, stress_level, date)
-        VALUES (%s, %s, %s, COALESCE(%s, CURRENT_DATE))
-        RETURNING id
-    """, (mood_entry.user_id, mood_entry.task_id, mood_entry.stress_level, mood_entry.date))
-    mood_id = cur.fetchone()["id"]
-
-    conn.commit()
-    conn.close()
+async def log_mood(mood_entry: Entry):
+    mood_id = await repo.ainsert_mood(
+        mood_entry.user_id, mood_entry.task_id, mood_entry.stress_level, mood_entry.date
+    )
+    if mood_id is None:
+        raise HTTPException(status_code=404, detail="Task ID not found")
     return {"message": "Mood logged!", "mood_id": mood_id}
 
 @app.get("/mood/")
-def get_all_moods():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM mood_tracking")
-    moods = cur.fetchall()
-    conn.close()
-    return {"moods": moods}
+async def get_all_moods(
+    user_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json",
+):
+    """
+    Mood entries newest first, optionally for one user. Without limit/cursor,
+    every entry under "moods" alone (the original response); with them,
+    keyset pages plus a next_cursor. format=ndjson streams the rows instead.
+    """
+    after_id = decode_cursor(cursor)
+    if format == "ndjson":
+        return ndjson_response(repo.astream_moods(user_id, after_id, prefetch=STREAM_PREFETCH))
+    if limit is None and after_id is None:
+        return {"moods": [row async for row in repo.astream_moods(user_id, prefetch=STREAM_PREFETCH)]}
+    limit = limit or DEFAULT_PAGE_SIZE
+    moods, next_cursor = page(await repo.afetch_moods_page(user_id, after_id, limit + 1), limit)
+    return {"moods": moods, "next_cursor": next_cursor}
 
 @app.get("/mood/{task_id}")
-def get_mood_for_task(task_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id, stress_level, date, timestamp
-        FROM mood_tracking
-        WHERE task_id = %s
-    """, (task_id,))
-    logs = cur.fetchall()
-    conn.close()
+async def get_mood_for_task(task_id: int):
+    logs = await repo.afetch_moods_for_task(task_id)
     return {"task_id": task_id, "mood_logs": logs}
 
+# Analytics Routes
+@app.get("/analytics/stress/daily")
+async def get_daily_stress(user_id: int, days: int = Query(30, ge=1, le=366)):
+    since = cdate.today() - timedelta(days=days - 1)
+    return {"user_id": user_id, "days": await repo.afetch_daily_stress(user_id, since)}
+
+@app.get("/analytics/stress/categories")
+async def get_category_stress(user_id: int, days: int = Query(30, ge=1, le=366)):
+    since = cdate.today() - timedelta(days=days - 1)
+    return {"user_id": user_id, "categories": await repo.afetch_category_stress(user_id, since)}
+
 # Login Route
 @app.post("/login", response_model=Token)
-def login(login_data: LoginRequest):
-    conn = get_connection()
-    cur = conn.cursor()
-    
+async def login(login_data: LoginRequest):
     try:
         # Try to find user by username or email
-        cur.execute("""
-            SELECT id, username, email, password 
-            FROM users 
-            WHERE username = %s OR email = %s
-        """, (login_data.username_or_email, login_data.username_or_email))
-        
-        user = cur.fetchone()
-        
+        user = await repo.afetch_login_user(login_data.username_or_email)
+
         if not user:
             raise HTTPException(
                 status_code=401,
                 detail="Invalid username or email"
             )
-        
-        if not verify_password(login_data.password, user["password"]):
+
+        # bcrypt is deliberately slow; it runs on its own bounded executor
+        verified, new_hash = await verify_password_async(login_data.password, user["password"])
+        if not verified:
             raise HTTPException(
                 status_code=401,
                 detail="Invalid password"
             )
-        
+        if new_hash:
+            # Stored hash used an old cost factor
+            await repo.aupdate_password(user["id"], new_hash)
+
         # Create access token
         access_token = create_access_token(
             data={"sub": str(user["id"]), "username": user["username"]}
         )
-        
+
         return {
             "user_id": user["id"],
             "username": user["username"],
@@ -513,14 +725,38 @@ def login(login_data: LoginRequest):
             "token": access_token,
             "token_type": "bearer"
         }
-        
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
 
-# Health Check Route
+# Health Check Routes
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
+
+@app.get("/health/db")
+def db_pool_health():
+    return {
+        **repo.stats(),
+        "auth": auth_stats(),
+        "prefs_cache": repo.prefs_cache_stats(),
+    }
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.on_event("startup")
+async def migrate_schema():
+    if AUTO_MIGRATE:
+        applied = await asyncio.to_thread(repo.migrate)
+        if applied:
+            logger.info("Applied schema migrations %s", applied)
+
+@app.on_event("shutdown")
+async def shutdown_pool():
+    await repo.aclose()
+    schedule_executor.shutdown(wait=False)
+    for task in list(_batch_job_tasks):
+        task.cancel()
+    shutdown_auth()
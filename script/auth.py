@@ -0,0 +1,110 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import jwt as PyJWT
+from fastapi import Depends, HTTPException
+from fastapi.security import OAuth2PasswordBearer
+
+from cache import TTLCache
+from repository import get_repository
+
+# JWT Configuration
+SECRET_KEY = "your-secret-key-here"  # Change this to a secure secret key
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+
+# bcrypt cost factor. Hashes made with any other cost are rehashed on the
+# next successful login, so raising or lowering it migrates users gradually.
+BCRYPT_ROUNDS = int(os.environ.get("FIKA_BCRYPT_ROUNDS", "12"))
+# bcrypt is CPU-bound; at most this many hashes run at once, the rest queue
+HASH_WORKERS = int(os.environ.get("FIKA_HASH_WORKERS", "4"))
+# How long a verified token is trusted without decoding it again
+TOKEN_CACHE_TTL = float(os.environ.get("FIKA_TOKEN_CACHE_TTL", "60"))
+TOKEN_CACHE_SIZE = int(os.environ.get("FIKA_TOKEN_CACHE_SIZE", "10000"))
+# Comma-separated ids of the users allowed on /admin routes (none by default)
+ADMIN_USER_IDS = frozenset(
+    int(user_id) for user_id in os.environ.get("FIKA_ADMIN_USER_IDS", "").split(",") if user_id.strip()
+)
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+
+hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+token_cache = TTLCache(TOKEN_CACHE_TTL, max_entries=TOKEN_CACHE_SIZE)
+
+# ----------- PASSWORDS -----------
+
+_pwd_context = None
+_pwd_context_lock = threading.Lock()
+
+def get_pwd_context():
+    """Password hashing context, built on first use (passlib is slow to import)."""
+    global _pwd_context
+    if _pwd_context is None:
+        with _pwd_context_lock:
+            if _pwd_context is None:
+                from passlib.context import CryptContext
+
+                _pwd_context = CryptContext(
+                    schemes=["bcrypt"], deprecated="auto",
+                    bcrypt__default_rounds=BCRYPT_ROUNDS,
+                    bcrypt__min_rounds=BCRYPT_ROUNDS,
+                    bcrypt__max_rounds=BCRYPT_ROUNDS,
+                )
+    return _pwd_context
+
+async def hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(hash_executor, get_pwd_context().hash, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str):
+    """
+    Returns (ok, new_hash). new_hash is set when the stored hash used a
+    different cost factor and should replace it.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        hash_executor, get_pwd_context().verify_and_update, plain_password, hashed_password
+    )
+
+# ----------- TOKENS -----------
+
+def create_access_token(data: dict):
+    to_encode = data.copy()
+    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire})
+    encoded_jwt = PyJWT.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
+    """
+    Dependency resolving a bearer token to an existing user's id. Verified
+    tokens are cached for TOKEN_CACHE_TTL (never past their expiry), so
+    repeat calls skip the JWT decode and the user lookup.
+    """
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
+    try:
+        payload = PyJWT.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id = int(payload["sub"])
+    except (PyJWT.PyJWTError, KeyError, ValueError):
+        raise HTTPException(status_code=401, detail="Invalid authentication token")
+    # Verify user exists
+    if not await get_repository().auser_exists(user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    token_cache.set(token, user_id, ttl=payload["exp"] - time.time() if "exp" in payload else None)
+    return user_id
+
+async def require_admin(user_id: int = Depends(get_current_user_id)) -> int:
+    """Dependency for /admin routes: an authenticated user listed in FIKA_ADMIN_USER_IDS."""
+    if user_id not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user_id
+
+def auth_stats():
+    return {"token_cache": token_cache.stats(), "bcrypt_rounds": BCRYPT_ROUNDS, "hash_workers": HASH_WORKERS}
+
+def shutdown_auth():
+    hash_executor.shutdown(wait=False)
@@ -0,0 +1,134 @@
+import argparse
+import datetime
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from migrations import AUTO_MIGRATE
+from qtable_store import get_qtable_store, get_trained_qtable
+from repository import get_repository
+from scheduler import plan_schedule, schedule_fingerprint, SOLVERS
+
+# Users whose inputs are loaded, planned and written back together
+BATCH_CHUNK_SIZE = int(os.environ.get("FIKA_BATCH_CHUNK_SIZE", "200"))
+
+def _plan_user(user_id, user_prefs, tasks, q_table, start_date, horizon_days, solver):
+    """Worker entry point; returns plain data so results pickle cheaply."""
+    started = time.perf_counter()
+    try:
+        schedule, agent, unscheduled = plan_schedule(
+            user_prefs, tasks, q_table, start_date=start_date, horizon_days=horizon_days, solver=solver
+        )
+        q_table = agent.dump_q_table() if solver == "rl" else None
+        unscheduled_ids = [t["id"] for t in unscheduled]
+        return user_id, schedule, unscheduled_ids, q_table, None, time.perf_counter() - started
+    except Exception as e:
+        return user_id, None, None, None, "%s: %s" % (type(e).__name__, e), time.perf_counter() - started
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def generate_schedules(user_ids=None, workers=None, chunk_size=BATCH_CHUNK_SIZE,
+                       horizon_days=1, solver="rl"):
+    """
+    Generate and store schedules for `user_ids` (every user when None).
+
+    Inputs are loaded with one prefs, one tasks and one recent-stress query
+    per chunk, planning runs on a process pool and each chunk's schedules are
+    written back in a single transaction, with the same input fingerprint
+    generate_schedule records, so later single-user requests can reuse them.
+    Returns a report with throughput, the error for every user that failed
+    and the ids of the tasks left unscheduled per user.
+    """
+    started = time.perf_counter()
+    repo = get_repository()
+    if user_ids is None:
+        user_ids = repo.fetch_all_user_ids()
+    user_ids = list(dict.fromkeys(user_ids))
+    qtable_store = get_qtable_store()
+    failures = {}
+    unscheduled = {}
+    plan_seconds = []
+    start_date = datetime.date.today()
+    succeeded = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk in _chunks(user_ids, chunk_size):
+            prefs = repo.fetch_user_prefs_bulk(chunk)
+            tasks = repo.fetch_tasks_bulk(chunk)
+            recent_stress = repo.fetch_recent_stress_bulk(chunk)
+            # Copies: the bulk prefs may be the cached dicts themselves
+            prefs = {
+                user_id: dict(user_prefs, recent_stress=recent_stress.get(user_id))
+                for user_id, user_prefs in prefs.items()
+            }
+            futures = []
+            fingerprints = {}
+            for user_id in chunk:
+                if user_id not in prefs:
+                    failures[user_id] = "User not found"
+                    continue
+                fingerprints[user_id] = schedule_fingerprint(
+                    prefs[user_id], tasks[user_id], start_date, horizon_days, solver
+                )
+                futures.append(pool.submit(
+                    _plan_user, user_id, prefs[user_id], tasks[user_id],
+                    qtable_store.get(user_id) or get_trained_qtable(), start_date, horizon_days, solver,
+                ))
+
+            schedules, unscheduled_ids, q_tables = {}, {}, {}
+            for future in as_completed(futures):
+                user_id, schedule, task_ids, q_table, error, elapsed = future.result()
+                plan_seconds.append(elapsed)
+                if error is not None:
+                    failures[user_id] = error
+                else:
+                    schedules[user_id] = schedule
+                    unscheduled_ids[user_id] = task_ids
+                    if q_table is not None:
+                        q_tables[user_id] = q_table
+
+            try:
+                repo.replace_schedules(schedules, fingerprints, unscheduled_ids, solver, horizon_days)
+            except Exception as e:
+                for user_id in schedules:
+                    failures[user_id] = "Store failed: %s: %s" % (type(e).__name__, e)
+                continue
+            succeeded += len(schedules)
+            unscheduled.update((user_id, task_ids) for user_id, task_ids in unscheduled_ids.items() if task_ids)
+            for user_id, q_table in q_tables.items():
+                qtable_store.put(user_id, q_table)
+
+    elapsed = time.perf_counter() - started
+    plan_seconds.sort()
+    return {
+        "requested": len(user_ids),
+        "succeeded": succeeded,
+        "failed": len(failures),
+        "failures": {str(user_id): error for user_id, error in sorted(failures.items())},
+        "unscheduled": {str(user_id): task_ids for user_id, task_ids in sorted(unscheduled.items())},
+        "elapsed_seconds": round(elapsed, 3),
+        "users_per_second": round(succeeded / elapsed, 2) if elapsed > 0 else None,
+        "plan_seconds_p50": round(plan_seconds[len(plan_seconds) // 2], 4) if plan_seconds else None,
+        "plan_seconds_max": round(plan_seconds[-1], 4) if plan_seconds else None,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate schedules for many users at once.")
+    parser.add_argument("user_ids", nargs="*", type=int, help="users to schedule (default: all)")
+    parser.add_argument("--workers", type=int, default=None, help="planner processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE)
+    parser.add_argument("--horizon-days", type=int, default=1)
+    parser.add_argument("--solver", choices=SOLVERS, default="rl")
+    args = parser.parse_args()
+
+    if AUTO_MIGRATE:
+        get_repository().migrate()
+    report = generate_schedules(
+        args.user_ids or None, workers=args.workers, chunk_size=args.chunk_size,
+        horizon_days=args.horizon_days, solver=args.solver,
+    )
+    get_qtable_store().flush()
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,198 @@
+"""
+Micro-benchmarks for generate_schedule, SchedulerAgent and evaluate_schedule
+on synthetic users, without a database.
+
+    python bench_scheduler.py                          # run every scenario
+    python bench_scheduler.py --save baseline.json     # record a baseline
+    python bench_scheduler.py --compare baseline.json --threshold 0.25
+
+With --compare the exit status is 1 when any p50 latency (plan, evaluate or
+agent steps) of a scenario grew by more than the threshold (a fraction)
+against the baseline.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from bench_solvers import synthetic_tasks
+from helpers import evaluate_schedule
+from rl_agent import SchedulerAgent
+from scheduler import generate_schedule, build_state
+
+SCENARIOS = [
+    # name, tasks, fixed share, work style, stress, solver
+    ("small-sprints-calm", 10, 0.2, "short_sprints", 2, "rl"),
+    ("small-chunks-stressed", 10, 0.2, "long_chunks", 9, "rl"),
+    ("medium-sprints", 50, 0.2, "short_sprints", 5, "rl"),
+    ("medium-mostly-fixed", 50, 0.6, "long_chunks", 5, "rl"),
+    ("medium-heuristic", 50, 0.2, "short_sprints", 5, "heuristic"),
+    ("large-sprints", 200, 0.1, "short_sprints", 7, "rl"),
+    ("large-heuristic", 200, 0.1, "long_chunks", 7, "heuristic"),
+]
+
+class InMemoryIO:
+    """ScheduleIO over dicts: one synthetic user per id, nothing persisted."""
+
+    def __init__(self):
+        self.prefs = {}
+        self.tasks = {}
+        self.schedules = {}
+        self.q_tables = {}
+
+    def add_user(self, user_id, prefs, tasks):
+        self.prefs[user_id] = prefs
+        self.tasks[user_id] = tasks
+
+    def fetch_prefs(self, user_id):
+        return dict(self.prefs[user_id])
+
+    def fetch_tasks(self, user_id):
+        return [dict(t) for t in self.tasks[user_id]]
+
+    def fetch_memoized(self, user_id, fingerprint):
+        return None
+
+    def store(self, user_id, schedule, fingerprint, unscheduled_ids, solver, horizon_days):
+        self.schedules[user_id] = schedule
+
+    def load_q_table(self, user_id):
+        return self.q_tables.get(user_id)
+
+    def store_q_table(self, user_id, blob):
+        self.q_tables[user_id] = blob
+
+def synthetic_prefs(work_style, stress, seed):
+    rng = random.Random(seed)
+    return {
+        "focus_period": rng.choice(["morning", "afternoon", "evening"]),
+        "stress_level": stress,
+        "work_style": work_style,
+        "sleep_goal": datetime.time(rng.choice([22, 23, 0])),
+        "sleep_pref": rng.choice([7, 8, 9]),
+        "recent_stress": None,
+    }
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+def _timed(func, runs):
+    latencies = []
+    for seed in range(runs):
+        started = time.perf_counter()
+        func(seed)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+def _allocations(func):
+    """Peak traced memory (KiB) and number of allocated blocks for one call."""
+    tracemalloc.start()
+    try:
+        func(0)
+        blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024, blocks
+
+def run_scenario(name, n_tasks, fixed_share, work_style, stress, solver, runs, horizon_days=3):
+    start_date = datetime.date(2030, 1, 7)  # fixed so runs are comparable
+    store = InMemoryIO()
+    for seed in range(runs):
+        store.add_user(
+            seed, synthetic_prefs(work_style, stress, seed),
+            synthetic_tasks(n_tasks, start_date, horizon_days, fixed_share=fixed_share, seed=seed),
+        )
+
+    def plan(seed):
+        np.random.seed(seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            generate_schedule(seed, horizon_days=horizon_days, start_date=start_date,
+                              solver=solver, force=True, io=store)
+
+    plan_ms = _timed(plan, runs)
+    peak_kib, blocks = _allocations(plan)
+
+    schedules = [store.schedules[seed] for seed in range(runs)]
+    rewards = [evaluate_schedule(schedules[seed], store.prefs[seed]) for seed in range(runs)]
+    evaluate_ms = _timed(lambda seed: evaluate_schedule(schedules[seed], store.prefs[seed]), runs)
+
+    def agent_steps(seed, steps=200):
+        agent = SchedulerAgent(list(range(n_tasks)) + ["break"])
+        prefs = store.prefs[seed]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for step in range(steps):
+                state = build_state(step * 15, range(n_tasks - step % n_tasks), prefs)
+                next_state = build_state(step * 15 + 15, range(n_tasks - step % n_tasks), prefs)
+                agent.update(state, agent.select_action(state), 1.0, next_state)
+    agent_ms = _timed(agent_steps, runs)
+
+    return {
+        "scenario": name,
+        "tasks": n_tasks,
+        "solver": solver,
+        "plan_p50_ms": percentile(plan_ms, 0.5),
+        "plan_p95_ms": percentile(plan_ms, 0.95),
+        "plan_p99_ms": percentile(plan_ms, 0.99),
+        "plan_peak_kib": round(peak_kib, 1),
+        "plan_alloc_blocks": blocks,
+        "evaluate_p50_ms": percentile(evaluate_ms, 0.5),
+        "agent_200_steps_p50_ms": percentile(agent_ms, 0.5),
+        "reward": sum(rewards) / len(rewards),
+    }
+
+def compare(results, baseline, threshold):
+    """(scenario, metric, before, after) for every p50 that grew by more than `threshold`."""
+    previous = {row["scenario"]: row for row in baseline}
+    regressions = []
+    for row in results:
+        before = previous.get(row["scenario"])
+        if before is None:
+            continue
+        for key in ("plan_p50_ms", "evaluate_p50_ms", "agent_200_steps_p50_ms"):
+            if before[key] > 0 and row[key] > before[key] * (1 + threshold):
+                regressions.append((row["scenario"], key, before[key], row[key]))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--scenario", action="append", help="run only these scenarios (repeatable)")
+    parser.add_argument("--save", metavar="PATH", help="write results as JSON (e.g. a baseline)")
+    parser.add_argument("--compare", metavar="PATH", help="baseline JSON to check against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown as a fraction of the baseline (default 0.25)")
+    args = parser.parse_args()
+
+    scenarios = [s for s in SCENARIOS if not args.scenario or s[0] in args.scenario]
+    results = []
+    print("%-24s %6s %9s %9s %9s %9s %8s %8s %8s" % (
+        "scenario", "tasks", "p50 ms", "p95 ms", "p99 ms", "peak KiB", "eval ms", "agent ms", "reward"))
+    for scenario in scenarios:
+        row = run_scenario(*scenario, runs=args.runs)
+        results.append(row)
+        print("%-24s %6d %9.2f %9.2f %9.2f %9.1f %8.3f %8.2f %8.2f" % (
+            row["scenario"], row["tasks"], row["plan_p50_ms"], row["plan_p95_ms"], row["plan_p99_ms"],
+            row["plan_peak_kib"], row["evaluate_p50_ms"], row["agent_200_steps_p50_ms"], row["reward"]))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for scenario, key, before, after in regressions:
+            print("REGRESSION %s %s: %.3f -> %.3f ms (+%.0f%%)" % (
+                scenario, key, before, after, (after / before - 1) * 100))
+        if regressions:
+            sys.exit(1)
+        print("No regressions above %.0f%%" % (args.threshold * 100))
@@ -0,0 +1,134 @@
+"""
+Compare the RL and heuristic solvers on synthetic task sets.
+
+    python bench_solvers.py --tasks 10 50 200 --runs 20
+    python bench_solvers.py --rollouts 1 2 4 8 16 --budget 0.5
+
+With --rollouts, the RL multi-rollout search is reported for each count
+instead: latency and the reward of the schedule kept, to tune the count
+against FIKA_PLAN_TIME_BUDGET (or --budget). Set FIKA_ROLLOUT_WORKERS to
+run rollouts on a process pool.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import random
+import statistics
+import sys
+import time
+
+from helpers import evaluate_schedule
+from scheduler import plan_schedule, SOLVERS, PLAN_TIME_BUDGET
+
+PRIORITIES = ["Low", "Medium", "High", "Extra High"]
+
+def synthetic_tasks(n_tasks, start_date, horizon_days, fixed_share=0.2, seed=0):
+    rng = random.Random(seed)
+    tasks = []
+    for task_id in range(n_tasks):
+        day = start_date + datetime.timedelta(days=rng.randrange(horizon_days))
+        start = datetime.datetime.combine(day, datetime.time(rng.randrange(8, 20), rng.choice([0, 30])))
+        fixed = rng.random() < fixed_share
+        duration = rng.choice([15, 30, 45, 60, 90])
+        tasks.append({
+            "id": task_id,
+            "name": "task-%d" % task_id,
+            "category": "bench",
+            "estimated_time": duration,
+            "deadline": start + datetime.timedelta(days=rng.randrange(1, 4)),
+            "fixed_time": fixed,
+            "start_time": start if fixed else None,
+            "end_time": start + datetime.timedelta(minutes=duration) if fixed else None,
+            "priority": rng.choice(PRIORITIES),
+            "description": None,
+            "stress_entry": None,
+        })
+    return tasks
+
+def run(n_tasks, runs, horizon_days, user_prefs):
+    start_date = datetime.date.today()
+    rows = []
+    for solver in SOLVERS:
+        latencies, rewards, placed = [], [], []
+        for seed in range(runs):
+            tasks = synthetic_tasks(n_tasks, start_date, horizon_days, seed=seed)
+            n_flexible = sum(not t["fixed_time"] for t in tasks)
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                schedule, _, unscheduled = plan_schedule(
+                    user_prefs, tasks, start_date=start_date, horizon_days=horizon_days, solver=solver
+                )
+            latencies.append((time.perf_counter() - started) * 1000)
+            rewards.append(evaluate_schedule(schedule, user_prefs))
+            placed.append(1 - len(unscheduled) / n_flexible if n_flexible else 1.0)
+        latencies.sort()
+        rows.append({
+            "solver": solver,
+            "tasks": n_tasks,
+            "p50_ms": latencies[len(latencies) // 2],
+            "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "reward": statistics.mean(rewards),
+            "placed": statistics.mean(placed),
+        })
+    return rows
+
+def run_rollouts(n_tasks, runs, horizon_days, user_prefs, rollout_counts, time_budget):
+    """One row per rollout count, all on the same task sets."""
+    start_date = datetime.date.today()
+    rows = []
+    for rollouts in rollout_counts:
+        latencies, rewards, placed = [], [], []
+        for seed in range(runs):
+            tasks = synthetic_tasks(n_tasks, start_date, horizon_days, seed=seed)
+            n_flexible = sum(not t["fixed_time"] for t in tasks)
+            started = time.perf_counter()
+            schedule, _, unscheduled = plan_schedule(
+                user_prefs, tasks, start_date=start_date, horizon_days=horizon_days,
+                rollouts=rollouts, time_budget=time_budget,
+            )
+            latencies.append((time.perf_counter() - started) * 1000)
+            rewards.append(evaluate_schedule(schedule, user_prefs))
+            placed.append(1 - len(unscheduled) / n_flexible if n_flexible else 1.0)
+        latencies.sort()
+        rows.append({
+            "rollouts": rollouts,
+            "tasks": n_tasks,
+            "p50_ms": latencies[len(latencies) // 2],
+            "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "reward": statistics.mean(rewards),
+            "placed": statistics.mean(placed),
+        })
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tasks", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--horizon-days", type=int, default=7)
+    parser.add_argument("--work-style", choices=["long_chunks", "short_sprints"], default="short_sprints")
+    parser.add_argument("--rollouts", type=int, nargs="+", help="report the RL search for these rollout counts")
+    parser.add_argument("--budget", type=float, default=PLAN_TIME_BUDGET, help="seconds per plan with --rollouts")
+    args = parser.parse_args()
+
+    prefs = {
+        "focus_period": "morning",
+        "stress_level": 5,
+        "work_style": args.work_style,
+        "sleep_goal": datetime.time(22, 0),
+        "sleep_pref": 8,
+    }
+    if args.rollouts:
+        print("%-10s %6s %9s %9s %9s %7s" % ("rollouts", "tasks", "p50 ms", "p95 ms", "reward", "placed"))
+        for n_tasks in args.tasks:
+            for row in run_rollouts(n_tasks, args.runs, args.horizon_days, prefs, args.rollouts, args.budget):
+                print("%-10d %6d %9.2f %9.2f %9.2f %6.0f%%" % (
+                    row["rollouts"], row["tasks"], row["p50_ms"], row["p95_ms"], row["reward"], row["placed"] * 100
+                ))
+        sys.exit(0)
+    print("%-10s %6s %9s %9s %9s %7s" % ("solver", "tasks", "p50 ms", "p95 ms", "reward", "placed"))
+    for n_tasks in args.tasks:
+        for row in run(n_tasks, args.runs, args.horizon_days, prefs):
+            print("%-10s %6d %9.2f %9.2f %9.2f %6.0f%%" % (
+                row["solver"], row["tasks"], row["p50_ms"], row["p95_ms"], row["reward"], row["placed"] * 100
+            ))
@@ -0,0 +1,154 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    Thread-safe in-process cache with a per-entry time to live and LRU
+    eviction once `max_entries` is reached. Expired entries are dropped
+    lazily when they are looked up or pushed out by newer ones.
+    """
+
+    def __init__(self, ttl, max_entries=10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key, default=None):
+        now = self._clock()
+        with self._lock:
+            item = self._entries.get(key, _MISSING)
+            if item is not _MISSING:
+                expires_at, value = item
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._entries[key]
+                self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Store `value`; `ttl` overrides the cache default for this entry."""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (self._clock() + ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "ttl": self.ttl, **self._stats}
+
+# ----------- SHARED BACKENDS -----------
+
+class LocalSharedCache:
+    """
+    Stand-in for a shared cache when none is configured: the same
+    get/set/delete interface as RedisCache, backed by a process-local
+    TTLCache.
+    """
+
+    def __init__(self, ttl, max_entries=10000):
+        self._cache = TTLCache(ttl, max_entries=max_entries)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def delete(self, key):
+        self._cache.delete(key)
+
+class RedisCache:
+    """Shared cache in Redis, so every worker sees the same entries and invalidations."""
+
+    def __init__(self, url, ttl, prefix="fika:"):
+        import redis  # optional dependency, only needed for this backend
+
+        self._client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self._client.get(self.prefix + str(key))
+        return None if raw is None else pickle.loads(raw)
+
+    def set(self, key, value):
+        self._client.set(self.prefix + str(key), pickle.dumps(value), ex=max(int(self.ttl), 1))
+
+    def delete(self, key):
+        self._client.delete(self.prefix + str(key))
+
+class ReadThroughCache:
+    """
+    Two-level read-through cache: a small in-process TTLCache in front of a
+    shared backend. Values are copied on the way out so callers can mutate
+    what they get back.
+    """
+
+    def __init__(self, local, shared=None, copy=dict):
+        self.local = local
+        self.shared = shared
+        self._copy = copy
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "shared_hits": 0, "misses": 0, "invalidations": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self._count("hits")
+            return self._copy(value)
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self._count("shared_hits")
+                self.local.set(key, value)
+                return self._copy(value)
+        self._count("misses")
+        return None
+
+    def set(self, key, value):
+        self.local.set(key, self._copy(value))
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def invalidate(self, key):
+        self._count("invalidations")
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["local"] = self.local.stats()
+        stats["shared"] = type(self.shared).__name__ if self.shared is not None else None
+        return stats
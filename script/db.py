@@ -1,27 +1,433 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor, execute_values
+
+import metrics
+from cache import TTLCache, LocalSharedCache, RedisCache, ReadThroughCache
+from entries import ScheduleEntry, from_minutes
+
+DB_CONFIG = {
+    "dbname": os.environ.get("FIKA_DB_NAME", "user_schedule"),
+    "user": os.environ.get("FIKA_DB_USER", "postgres"),
+    "password": os.environ.get("FIKA_DB_PASSWORD", "postgres"),
+    "host": os.environ.get("FIKA_DB_HOST", "localhost"),
+}
+
+POOL_MIN_SIZE = int(os.environ.get("FIKA_DB_POOL_MIN", "2"))
+POOL_MAX_SIZE = int(os.environ.get("FIKA_DB_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.environ.get("FIKA_DB_POOL_TIMEOUT", "5"))
+# Idle connections older than this are pinged before being handed out again
+POOL_HEALTHCHECK_AFTER = float(os.environ.get("FIKA_DB_POOL_HEALTHCHECK_AFTER", "30"))
+
+class TimedCursor(RealDictCursor):
+    """RealDictCursor that reports every statement to metrics.record_query."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            metrics.record_query("postgres", time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            metrics.record_query("postgres", time.perf_counter() - started)
 
 def get_connection():
-    return psycopg2.connect(
-        dbname="user_schedule",
-        user="postgres",
-        password="postgres",
-        host="localhost",
-        cursor_factory=RealDictCursor
-    )
+    """Open a new, unpooled connection. Prefer db_connection() in request paths."""
+    return psycopg2.connect(cursor_factory=TimedCursor, **DB_CONFIG)
+
+# ----------- CONNECTION POOL -----------
+
+class PoolError(Exception):
+    pass
+
+class PoolTimeout(PoolError):
+    pass
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections with a bounded size, a checkout
+    timeout and a liveness check on connections that sat idle for a while.
+    """
+
+    def __init__(self, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 timeout=POOL_TIMEOUT, healthcheck_after=POOL_HEALTHCHECK_AFTER,
+                 connect=get_connection):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size: min=%s max=%s" % (min_size, max_size))
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.healthcheck_after = healthcheck_after
+        self._connect = connect
+        self._idle = []  # list of (connection, returned_at)
+        self._size = 0  # idle + checked out
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = {"checkouts": 0, "timeouts": 0, "created": 0, "discarded": 0, "waits": 0}
+        for _ in range(min_size):
+            self._idle.append((self._new_connection(), time.monotonic()))
+            self._size += 1
+
+    def _new_connection(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.healthcheck_after:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._stats["discarded"] += 1
+            self._cond.notify()
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            # Reserve either an idle connection or a free slot under the lock,
+            # then do any network work (ping / connect) outside of it.
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolError("Connection pool is closed")
+                    if self._idle:
+                        conn, idle_since = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        conn, idle_since = None, None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            "Timed out after %.1fs waiting for a database connection" % self.timeout
+                        )
+                    self._stats["waits"] += 1
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    conn = self._new_connection()
+                except Exception:
+                    self._release_slot()
+                    raise
+            elif not self._is_healthy(conn, idle_since):
+                self._close_quietly(conn)
+                self._release_slot()
+                continue
+            with self._cond:
+                self._stats["checkouts"] += 1
+            return conn
+
+    def putconn(self, conn, discard=False):
+        if not (discard or conn.closed) and conn.status != psycopg2.extensions.STATUS_READY:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        if discard or conn.closed or self._closed:
+            self._close_quietly(conn)
+            self._release_slot()
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for the duration of the block. The transaction
+        is committed on success and rolled back if the block raises.
+        """
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            raise
+        finally:
+            self.putconn(conn, discard=broken or bool(conn.closed))
+
+    def stats(self):
+        with self._cond:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                **self._stats,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+def db_connection():
+    """Context manager yielding a pooled connection (commit on success)."""
+    return get_pool().connection()
+
+def pool_stats():
+    return get_pool().stats() if _pool is not None else {"size": 0, "idle": 0, "in_use": 0}
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+def _fetch(query, args=()):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(query, args)
+        return cur.fetchall()
+
+def _fetchone(query, args=()):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(query, args)
+        return cur.fetchone()
+
+def _keyset(filters, after_id, descending, conditions=()):
+    """psycopg2 twin of db_async._keyset: (WHERE/ORDER BY clause, args)."""
+    clauses, args = list(conditions), []
+    for column, value in filters.items():
+        if value is not None:
+            clauses.append("%s = %%s" % column)
+            args.append(value)
+    if after_id is not None:
+        clauses.append("id %s %%s" % ("<" if descending else ">"))
+        args.append(after_id)
+    where = "WHERE " + " AND ".join(clauses) if clauses else ""
+    return "%s ORDER BY id %s" % (where, "DESC" if descending else "ASC"), args
 
 # ----------- USERS -----------
 
-def fetch_user_prefs(user_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT time_pref, stress_base, work_pref, sleep_goal, sleep_pref
+# Preferences change rarely but are read on every schedule generation, so
+# they sit behind a read-through cache. Anything that writes the columns in
+# _prefs_from_row must call invalidate_user_prefs.
+PREFS_CACHE_TTL = float(os.environ.get("FIKA_PREFS_CACHE_TTL", "300"))
+PREFS_CACHE_SIZE = int(os.environ.get("FIKA_PREFS_CACHE_SIZE", "10000"))
+# Optional shared level: "" (in-process only), "local" (stand-in) or "redis"
+PREFS_CACHE_SHARED = os.environ.get("FIKA_PREFS_CACHE_SHARED", "")
+# With a shared level, the in-process copy is kept briefly so invalidations
+# made by other workers are picked up quickly
+PREFS_CACHE_LOCAL_TTL = float(os.environ.get("FIKA_PREFS_CACHE_LOCAL_TTL", "10"))
+REDIS_URL = os.environ.get("FIKA_REDIS_URL", "redis://localhost:6379/0")
+
+_prefs_cache = None
+_prefs_cache_lock = threading.Lock()
+
+def get_prefs_cache():
+    global _prefs_cache
+    if _prefs_cache is None:
+        with _prefs_cache_lock:
+            if _prefs_cache is None:
+                if PREFS_CACHE_SHARED == "redis":
+                    shared = RedisCache(REDIS_URL, PREFS_CACHE_TTL, prefix="fika:prefs:")
+                elif PREFS_CACHE_SHARED == "local":
+                    shared = LocalSharedCache(PREFS_CACHE_TTL, max_entries=PREFS_CACHE_SIZE)
+                elif PREFS_CACHE_SHARED:
+                    raise ValueError("Unknown FIKA_PREFS_CACHE_SHARED: %r" % PREFS_CACHE_SHARED)
+                else:
+                    shared = None
+                local_ttl = PREFS_CACHE_TTL if shared is None else min(PREFS_CACHE_LOCAL_TTL, PREFS_CACHE_TTL)
+                _prefs_cache = ReadThroughCache(TTLCache(local_ttl, max_entries=PREFS_CACHE_SIZE), shared)
+    return _prefs_cache
+
+def invalidate_user_prefs(user_id):
+    get_prefs_cache().invalidate(user_id)
+
+def prefs_cache_stats():
+    return get_prefs_cache().stats()
+
+def fetch_all_user_ids():
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM users ORDER BY id")
+        return [row["id"] for row in cur.fetchall()]
+
+def user_exists(user_id):
+    return _fetchone("SELECT id FROM users WHERE id = %s", (user_id,)) is not None
+
+def fetch_login_user(username_or_email):
+    return _fetchone("""
+        SELECT id, username, email, password
         FROM users
-        WHERE id = %s
-    """, (user_id,))
-    row = cur.fetchone()
-    conn.close()
+        WHERE username = %s OR email = %s
+    """, (username_or_email, username_or_email))
+
+def update_password(user_id, hashed_password):
+    with db_connection() as conn:
+        conn.cursor().execute("UPDATE users SET password = %s WHERE id = %s", (hashed_password, user_id))
+
+def fetch_user_prefs(user_id):
+    prefs = get_prefs_cache().get(user_id)
+    if prefs is not None:
+        return prefs
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT time_pref, stress_base, work_pref, sleep_goal, sleep_pref
+            FROM users
+            WHERE id = %s
+        """, (user_id,))
+        row = cur.fetchone()
+    if row is None:
+        return None  # unknown users are not cached
+    prefs = _prefs_from_row(row)
+    get_prefs_cache().set(user_id, prefs)
+    return prefs
+
+def fetch_user_prefs_bulk(user_ids):
+    """Preferences for many users keyed by user id; cache misses are loaded in one query."""
+    cache = get_prefs_cache()
+    prefs = {}
+    for user_id in user_ids:
+        cached = cache.get(user_id)
+        if cached is not None:
+            prefs[user_id] = cached
+    missing = [user_id for user_id in user_ids if user_id not in prefs]
+    if not missing:
+        return prefs
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, time_pref, stress_base, work_pref, sleep_goal, sleep_pref
+            FROM users
+            WHERE id = ANY(%s)
+        """, (missing,))
+        rows = cur.fetchall()
+    for row in rows:
+        prefs[row["id"]] = _prefs_from_row(row)
+        cache.set(row["id"], prefs[row["id"]])
+    return prefs
+
+# Columns a user row can be created with, and those handed back to clients
+USER_COLUMNS = (
+    "username", "password", "email", "name", "lname", "gender", "birthday", "time_pref",
+    "stress_base", "work_pref", "sleep_pref", "sleep_goal", "occupation",
+)
+PUBLIC_USER_COLUMNS = (
+    "id", "username", "email", "name", "lname", "gender", "time_pref", "stress_base",
+    "work_pref", "sleep_pref", "sleep_goal", "occupation", "birthday", "created_at",
+)
+# Columns of users read by _prefs_from_row, i.e. the ones that invalidate the cache
+USER_SETTINGS_COLUMNS = ("time_pref", "stress_base", "work_pref", "sleep_pref", "sleep_goal", "occupation")
+
+def find_user_conflict(email, username):
+    """"email" or "username" if either is already registered, else None."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT email FROM users WHERE email = %s OR username = %s", (email, username))
+        rows = cur.fetchall()
+    if any(row["email"] == email for row in rows):
+        return "email"
+    return "username" if rows else None
+
+def insert_user(values):
+    """Create a user from `values` (a subset of USER_COLUMNS); returns the public columns."""
+    columns = [c for c in USER_COLUMNS if c in values]
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO users (%s, created_at)
+            VALUES (%s, CURRENT_TIMESTAMP)
+            RETURNING %s
+        """ % (", ".join(columns), ", ".join(["%s"] * len(columns)), ", ".join(PUBLIC_USER_COLUMNS)),
+            [values[c] for c in columns])
+        return cur.fetchone()
+
+def update_user_settings(user_id, values):
+    """Update USER_SETTINGS_COLUMNS of a user; False if there is no such user."""
+    columns = [c for c in USER_SETTINGS_COLUMNS if c in values]
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE users SET %s WHERE id = %%s RETURNING id" % ", ".join("%s = %%s" % c for c in columns),
+            [values[c] for c in columns] + [user_id],
+        )
+        updated = cur.fetchone() is not None
+    invalidate_user_prefs(user_id)
+    return updated
+
+def save_user_preferences(values):
+    """Upsert a user_preferences row; returns it."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO user_preferences (
+                user_id, work_style, focus_period, stress_level,
+                break_preference, work_block_preference
+            ) VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET
+                work_style = EXCLUDED.work_style,
+                focus_period = EXCLUDED.focus_period,
+                stress_level = EXCLUDED.stress_level,
+                break_preference = EXCLUDED.break_preference,
+                work_block_preference = EXCLUDED.work_block_preference
+            RETURNING *
+        """, (
+            values["user_id"], values["work_style"], values["focus_period"],
+            values["stress_level"], values["break_preference"], values["work_block_preference"]
+        ))
+        preferences = cur.fetchone()
+    invalidate_user_prefs(preferences["user_id"])
+    return preferences
+
+def _prefs_from_row(row):
     return {
         "focus_period": row["time_pref"],
         "stress_level": row["stress_base"],
@@ -32,49 +438,428 @@ def fetch_user_prefs(user_id):
 
 # ----------- TASKS -----------
 
+TASK_COLUMNS = (
+    "name", "category", "estimated_time", "deadline", "fixed_time", "priority",
+    "start_time", "end_time", "description", "divided", "archived", "stress_entry",
+)
+
 def fetch_tasks(user_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, name, category, estimated_time, deadline, fixed_time,
+                   start_time, end_time, priority, description, stress_entry
+            FROM tasks
+            WHERE user_id = %s AND archived = false
+            ORDER BY fixed_time DESC, deadline ASC, priority DESC
+        """, (user_id,))
+        rows = cur.fetchall()
+    return rows  # list of dicts
+
+def fetch_tasks_page(user_id, after_id, limit):
+    """Up to `limit` active tasks of a user in id order, after id `after_id`."""
+    clause, args = _keyset({"user_id": user_id}, after_id, descending=False, conditions=["archived = false"])
+    return _fetch("""
         SELECT id, name, category, estimated_time, deadline, fixed_time,
                start_time, end_time, priority, description, stress_entry
         FROM tasks
-        WHERE user_id = %s AND archived = false
-        ORDER BY fixed_time DESC, deadline ASC, priority DESC
-    """, (user_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows  # list of dicts
+    """ + clause + " LIMIT %s", args + [limit])
+
+def fetch_task_export_page(user_id, after_id, limit):
+    """Up to `limit` tasks of a user, archived ones included, with id and every TASK_COLUMNS column."""
+    clause, args = _keyset({"user_id": user_id}, after_id, descending=False)
+    return _fetch("SELECT id, %s FROM tasks %s LIMIT %%s" % (", ".join(TASK_COLUMNS), clause), args + [limit])
+
+def fetch_task(task_id):
+    return _fetchone("SELECT * FROM tasks WHERE id = %s", (task_id,))
+
+def fetch_fixed_tasks(user_id):
+    """Active fixed tasks of a user, for calendar conflict checks."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, start_time, end_time, deadline
+            FROM tasks
+            WHERE user_id = %s AND archived = false AND fixed_time = true
+              AND start_time IS NOT NULL
+        """, (user_id,))
+        return cur.fetchall()
+
+def fetch_tasks_bulk(user_ids):
+    """Active tasks for many users in one query, keyed by user id (same order as fetch_tasks)."""
+    tasks = {user_id: [] for user_id in user_ids}
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT user_id, id, name, category, estimated_time, deadline, fixed_time,
+                   start_time, end_time, priority, description, stress_entry
+            FROM tasks
+            WHERE user_id = ANY(%s) AND archived = false
+            ORDER BY user_id, fixed_time DESC, deadline ASC, priority DESC
+        """, (list(user_ids),))
+        for row in cur.fetchall():
+            row = dict(row)
+            tasks[row.pop("user_id")].append(row)
+    return tasks
+
+def insert_task(user_id, values):
+    """Insert a task for `user_id`; `values` maps TASK_COLUMNS to values."""
+    return _fetchone("""
+        INSERT INTO tasks (%s, user_id)
+        VALUES (%s, %%s)
+        RETURNING *
+    """ % (", ".join(TASK_COLUMNS), ", ".join(["%s"] * len(TASK_COLUMNS))),
+        [values[c] for c in TASK_COLUMNS] + [user_id])
+
+def insert_tasks(user_id, rows):
+    """Insert many TASK_COLUMNS value dicts in one transaction; returns the number of rows."""
+    with db_connection() as conn:
+        execute_values(conn.cursor(), "INSERT INTO tasks (%s, user_id) VALUES %%s" % ", ".join(TASK_COLUMNS), [
+            [values[c] for c in TASK_COLUMNS] + [user_id] for values in rows
+        ], page_size=500)
+    return len(rows)
+
+def update_task(task_id, values):
+    return _fetchone(
+        "UPDATE tasks SET %s WHERE id = %%s RETURNING *" % ", ".join("%s = %%s" % c for c in TASK_COLUMNS),
+        [values[c] for c in TASK_COLUMNS] + [task_id],
+    )
+
+def delete_task(task_id):
+    return _fetchone("DELETE FROM tasks WHERE id = %s RETURNING *", (task_id,))
+
+def fetch_archived_count(user_id):
+    row = _fetchone("SELECT COUNT(*) AS count FROM tasks WHERE user_id = %s AND archived = TRUE", (user_id,))
+    return row["count"] if row else 0
 
 # ----------- SCHEDULED TASKS -----------
 
+# Namespace for per-user advisory locks taken while a schedule is replaced
+SCHEDULE_LOCK_NAMESPACE = 7301
+
+def replace_schedules(schedules, fingerprints=None, unscheduled_ids=None, solver=None, horizon_days=None):
+    """
+    replace_schedule for many users ({user_id: schedule}) in one transaction;
+    `fingerprints` and `unscheduled_ids` map user ids to what replace_schedule
+    takes, `solver` and `horizon_days` apply to every schedule. Locks are
+    taken in user id order so concurrent batches cannot deadlock.
+    """
+    user_ids = sorted(schedules)
+    if not user_ids:
+        return
+    rows = [row for user_id in user_ids for row in _schedule_rows(user_id, schedules[user_id])]
+    with db_connection() as conn:
+        cur = conn.cursor()
+        for user_id in user_ids:
+            cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (SCHEDULE_LOCK_NAMESPACE, user_id))
+        cur.execute("DELETE FROM scheduled_tasks WHERE user_id = ANY(%s)", (user_ids,))
+        if rows:
+            _insert_schedule_rows(cur, rows)
+        _record_schedule_writes(cur, [
+            (user_id, (fingerprints or {}).get(user_id), list((unscheduled_ids or {}).get(user_id, ())),
+             solver, horizon_days)
+            for user_id in user_ids
+        ])
+
+def _schedule_rows(user_id, schedule):
+    # Entries carry epoch minutes; psycopg2 adapts the datetimes natively
+    return [
+        (user_id, entry.task_id, from_minutes(entry.start), from_minutes(entry.end), entry.type)
+        for entry in schedule
+    ]
+
+def _insert_schedule_rows(cur, rows):
+    execute_values(cur, """
+        INSERT INTO scheduled_tasks (user_id, task_id, start_time, end_time, type)
+        VALUES %s
+    """, rows, page_size=500)
+
 def store_schedule(user_id, schedule):
+    """Append entries to a user's schedule in a single batched INSERT."""
+    rows = _schedule_rows(user_id, schedule)
+    if not rows:
+        return
+    with db_connection() as conn:
+        cur = conn.cursor()
+        _insert_schedule_rows(cur, rows)
+        _record_schedule_write(cur, [user_id])
+
+def replace_schedule(user_id, schedule, fingerprint=None, unscheduled_ids=(), solver=None, horizon_days=None):
+    """
+    Atomically swap a user's scheduled_tasks for `schedule`.
+
+    The delete and the batched insert share one transaction, so readers see
+    either the old or the new schedule, never an empty one. A transaction
+    scoped advisory lock serialises concurrent replacements for the same user.
+    `fingerprint` records which inputs produced the schedule (see
+    fetch_memoized_schedule), `solver` and `horizon_days` the options it
+    was planned with (see fetch_schedule_plan).
+    """
+    rows = _schedule_rows(user_id, schedule)
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (SCHEDULE_LOCK_NAMESPACE, user_id))
+        cur.execute("DELETE FROM scheduled_tasks WHERE user_id = %s", (user_id,))
+        if rows:
+            _insert_schedule_rows(cur, rows)
+        _record_schedule_write(cur, [user_id], fingerprint, unscheduled_ids, solver, horizon_days)
+
+def modify_schedule(user_id, patch):
+    """
+    Read-modify-write a user's schedule under the same lock as
+    replace_schedule. `patch` receives the current ScheduleEntry list
+    (ordered by start) and returns the new one.
+    If it raises, nothing is written.
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (SCHEDULE_LOCK_NAMESPACE, user_id))
+        cur.execute("""
+            SELECT task_id, start_time AS start, end_time AS "end", type
+            FROM scheduled_tasks
+            WHERE user_id = %s
+            ORDER BY start_time ASC
+        """, (user_id,))
+        schedule = patch([ScheduleEntry.from_row(row) for row in cur.fetchall()])
+        cur.execute("DELETE FROM scheduled_tasks WHERE user_id = %s", (user_id,))
+        rows = _schedule_rows(user_id, schedule)
+        if rows:
+            _insert_schedule_rows(cur, rows)
+        _record_schedule_write(cur, [user_id])
+    return schedule
+
+def _record_schedule_write(cur, user_ids, fingerprint=None, unscheduled_ids=(), solver=None, horizon_days=None):
+    """
+    Bump the users' rows in schedule_fingerprints (see migrations.py); every
+    write to scheduled_tasks does. Writes without a `solver` (patches) keep
+    the plan options of the last full plan.
+    """
+    _record_schedule_writes(cur, [
+        (user_id, fingerprint, list(unscheduled_ids), solver, horizon_days) for user_id in user_ids
+    ])
+
+def _record_schedule_writes(cur, rows):
+    """_record_schedule_write with a (user_id, fingerprint, unscheduled ids, solver, horizon_days) row per user."""
+    execute_values(cur, """
+        INSERT INTO schedule_fingerprints AS f (user_id, fingerprint, unscheduled, solver, horizon_days)
+        VALUES %s
+        ON CONFLICT (user_id) DO UPDATE SET
+            fingerprint = EXCLUDED.fingerprint,
+            unscheduled = EXCLUDED.unscheduled,
+            solver = COALESCE(EXCLUDED.solver, f.solver),
+            horizon_days = COALESCE(EXCLUDED.horizon_days, f.horizon_days),
+            version = f.version + 1,
+            updated_at = CURRENT_TIMESTAMP
+    """, rows, page_size=500)
+
+def fetch_memoized_schedule(user_id, fingerprint):
+    """
+    The stored schedule and unscheduled task ids if it was planned from
+    inputs with this `fingerprint`, else None. One statement, so the
+    fingerprint and the rows come from the same snapshot.
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT f.unscheduled, s.task_id, s.start_time AS start, s.end_time AS "end", s.type
+            FROM schedule_fingerprints f
+            LEFT JOIN scheduled_tasks s ON s.user_id = f.user_id
+            WHERE f.user_id = %s AND f.fingerprint = %s
+            ORDER BY s.start_time ASC
+        """, (user_id, fingerprint))
+        rows = cur.fetchall()
+    if not rows:
+        return None
+    schedule = [ScheduleEntry.from_row(row) for row in rows if row["start"] is not None]
+    return schedule, rows[0]["unscheduled"]
+
+def fetch_schedule_plan(user_id):
+    """(solver, horizon_days) the stored schedule was last fully planned with, or None."""
+    row = _fetchone("SELECT solver, horizon_days FROM schedule_fingerprints WHERE user_id = %s", (user_id,))
+    if row is None or row["solver"] is None:
+        return None
+    return row["solver"], row["horizon_days"]
+
+def fetch_schedule_version(user_id):
+    """Counter bumped by every write to the user's scheduled_tasks (0 if never written)."""
+    row = _fetchone("SELECT version FROM schedule_fingerprints WHERE user_id = %s", (user_id,))
+    return row["version"] if row else 0
+
+def fetch_schedule_with_version(user_id):
+    """(version, rows) read from one snapshot, so the pair is consistent."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        cur.execute("SELECT version FROM schedule_fingerprints WHERE user_id = %s", (user_id,))
+        row = cur.fetchone()
+        cur.execute("""
+            SELECT * FROM scheduled_tasks
+            WHERE user_id = %s
+            ORDER BY start_time ASC
+        """, (user_id,))
+        return row["version"] if row else 0, cur.fetchall()
+
+def stream_schedule_history(chunk_size=5000):
+    """
+    Every scheduled_tasks row in (user_id, start_time) order, in lists of
+    up to `chunk_size`, with the task's deadline and priority, its stress
+    (mean mood reading for the task, else tasks.stress_entry) and the mean
+    stress of that day from mood_rollups. Reads through a server-side
+    cursor on its own connection, so memory stays flat.
+    """
     conn = get_connection()
-    cur = conn.cursor()
-    for entry in schedule:
+    try:
+        cur = conn.cursor(name="schedule_history")
+        cur.itersize = chunk_size
         cur.execute("""
-            INSERT INTO scheduled_tasks (user_id, task_id, start_time, end_time, type)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (
-            user_id,
-            entry['task_id'],
-            entry['start'],
-            entry['end'],
-            entry['type']
-        ))
-    conn.commit()
-    conn.close()
+            SELECT s.user_id, s.task_id, s.start_time, s.end_time, s.type, t.deadline, t.priority,
+                   COALESCE(m.stress, t.stress_entry) AS task_stress, r.stress AS day_stress
+            FROM scheduled_tasks s
+            LEFT JOIN tasks t ON t.id = s.task_id
+            LEFT JOIN (
+                SELECT task_id, AVG(stress_level)::float AS stress
+                FROM mood_tracking
+                WHERE task_id IS NOT NULL
+                GROUP BY task_id
+            ) m ON m.task_id = s.task_id
+            LEFT JOIN (
+                SELECT user_id, day, SUM(stress_sum)::float / SUM(entries) AS stress
+                FROM mood_rollups
+                GROUP BY user_id, day
+            ) r ON r.user_id = s.user_id AND r.day = s.start_time::date
+            ORDER BY s.user_id, s.start_time
+        """)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        conn.rollback()
+        conn.close()
+
+# ----------- MOOD TRACKING -----------
+
+def insert_mood(user_id, task_id, stress_level, date):
+    """
+    Log a mood entry and fold it into mood_rollups in the same transaction.
+    Returns its id, or None when `task_id` does not exist.
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        category = None
+        if task_id:
+            cur.execute("SELECT category FROM tasks WHERE id = %s", (task_id,))
+            task = cur.fetchone()
+            if task is None:
+                return None
+            category = task["category"]
+        cur.execute("""
+            INSERT INTO mood_tracking (user_id, task_id, stress_level, date)
+            VALUES (%s, %s, %s, COALESCE(%s, CURRENT_DATE))
+            RETURNING id, date
+        """, (user_id, task_id, stress_level, date))
+        row = cur.fetchone()
+        record_stress(cur, user_id, row["date"], category, stress_level)
+        return row["id"]
+
+def fetch_moods_page(user_id, after_id, limit):
+    """Up to `limit` mood entries (of one user, or all when None) older than id `after_id`."""
+    clause, args = _keyset({"user_id": user_id}, after_id, descending=True)
+    return _fetch("SELECT * FROM mood_tracking " + clause + " LIMIT %s", args + [limit])
+
+def fetch_moods_for_task(task_id):
+    return _fetch("""
+        SELECT id, stress_level, date, timestamp
+        FROM mood_tracking
+        WHERE task_id = %s
+    """, (task_id,))
 
 # ----------- OPTIONAL: STRESS FEEDBACK INSERT -----------
 
 def log_stress_entry(task_id, stress_entry):
-    """Update a task with a reported stress entry (if tracked)."""
-    conn = get_connection()
-    cur = conn.cursor()
+    """Update a task with a reported stress entry (if tracked) and roll it up."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE tasks
+            SET stress_entry = %s
+            WHERE id = %s
+            RETURNING user_id, category
+        """, (stress_entry, task_id))
+        row = cur.fetchone()
+        if row is not None and stress_entry is not None:
+            record_stress(cur, row["user_id"], None, row["category"], stress_entry)
+
+# ----------- MOOD ROLLUPS -----------
+
+# mood_rollups (see migrations.py) is kept current on every stress write.
+
+# Days of readings averaged into the scheduler's `recent_stress`
+RECENT_STRESS_DAYS = int(os.environ.get("FIKA_RECENT_STRESS_DAYS", "7"))
+
+def record_stress(cur, user_id, day, category, stress_level):
+    """Fold one reading into its rollup row; `day` None means today."""
     cur.execute("""
-        UPDATE tasks
-        SET stress_entry = %s
-        WHERE id = %s
-    """, (stress_entry, task_id))
-    conn.commit()
-    conn.close()
\ No newline at end of file
+        INSERT INTO mood_rollups AS r (user_id, day, category, entries, stress_sum, stress_min, stress_max)
+        VALUES (%s, COALESCE(%s, CURRENT_DATE), COALESCE(%s, ''), 1, %s, %s, %s)
+        ON CONFLICT (user_id, day, category) DO UPDATE SET
+            entries = r.entries + 1,
+            stress_sum = r.stress_sum + EXCLUDED.stress_sum,
+            stress_min = LEAST(r.stress_min, EXCLUDED.stress_min),
+            stress_max = GREATEST(r.stress_max, EXCLUDED.stress_max)
+    """, (user_id, day, category, stress_level, stress_level, stress_level))
+
+def fetch_recent_stress_bulk(user_ids, days=RECENT_STRESS_DAYS):
+    """Mean stress reading over the last `days` days, keyed by user id (users without readings are absent)."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT user_id, SUM(stress_sum)::float / SUM(entries) AS mean
+            FROM mood_rollups
+            WHERE user_id = ANY(%s) AND day > CURRENT_DATE - %s
+            GROUP BY user_id
+        """, (list(user_ids), days))
+        return {row["user_id"]: row["mean"] for row in cur.fetchall()}
+
+def fetch_recent_stress(user_id, days=RECENT_STRESS_DAYS):
+    return fetch_recent_stress_bulk([user_id], days).get(user_id)
+
+def rebuild_mood_rollups():
+    """
+    Recompute every rollup from mood_tracking (backfill or repair). Readings
+    that only reached tasks.stress_entry carry no date and are not restored.
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("LOCK TABLE mood_rollups IN EXCLUSIVE MODE")
+        cur.execute("DELETE FROM mood_rollups")
+        cur.execute("""
+            INSERT INTO mood_rollups (user_id, day, category, entries, stress_sum, stress_min, stress_max)
+            SELECT m.user_id, m.date, COALESCE(t.category, ''), COUNT(*),
+                   SUM(m.stress_level), MIN(m.stress_level), MAX(m.stress_level)
+            FROM mood_tracking m
+            LEFT JOIN tasks t ON t.id = m.task_id
+            WHERE m.stress_level IS NOT NULL
+            GROUP BY m.user_id, m.date, COALESCE(t.category, '')
+        """)
+        return cur.rowcount
+
+def _fetch_rollups(group_by, user_id, since):
+    return _fetch("""
+        SELECT %s, SUM(entries) AS count,
+               SUM(stress_sum)::float / SUM(entries) AS mean,
+               MIN(stress_min) AS min, MAX(stress_max) AS max
+        FROM mood_rollups
+        WHERE user_id = %%s AND day >= %%s
+        GROUP BY %s
+        ORDER BY %s
+    """ % (group_by, group_by, group_by), (user_id, since))
+
+def fetch_daily_stress(user_id, since):
+    """Stress count/mean/min/max per day from `since` on, across categories."""
+    return _fetch_rollups("day", user_id, since)
+
+def fetch_category_stress(user_id, since):
+    """Stress count/mean/min/max per task category since `since` ('' = no task)."""
+    return _fetch_rollups("category", user_id, since)
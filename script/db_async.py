@@ -0,0 +1,343 @@
+import asyncio
+import time
+
+import asyncpg
+
+import metrics
+from db import DB_CONFIG, POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_TIMEOUT, PoolTimeout, TASK_COLUMNS
+
+# Async counterparts of the read/write helpers in db.py, on asyncpg with its
+# own pool. Used by the async routes so a request waiting on Postgres does
+# not hold a threadpool worker. Rows come back as plain dicts like
+# RealDictCursor rows, so responses keep the same shape.
+
+ASYNC_POOL_MIN_SIZE = POOL_MIN_SIZE
+ASYNC_POOL_MAX_SIZE = POOL_MAX_SIZE
+
+# ----------- CONNECTION POOL -----------
+
+_pool = None
+_pool_lock = None
+
+def _log_query(record):
+    metrics.record_query("postgres_async", record.elapsed)
+
+async def _init_connection(conn):
+    conn.add_query_logger(_log_query)
+
+async def get_async_pool():
+    global _pool, _pool_lock
+    if _pool is None:
+        if _pool_lock is None:
+            _pool_lock = asyncio.Lock()
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    database=DB_CONFIG["dbname"],
+                    user=DB_CONFIG["user"],
+                    password=DB_CONFIG["password"],
+                    host=DB_CONFIG["host"],
+                    min_size=ASYNC_POOL_MIN_SIZE,
+                    max_size=ASYNC_POOL_MAX_SIZE,
+                    init=_init_connection,
+                )
+    return _pool
+
+class _Acquire:
+    """`async with` wrapper around pool.acquire that maps timeouts to PoolTimeout."""
+
+    def __init__(self, transaction, isolation=None, readonly=False):
+        self._transaction = transaction
+        self._isolation = isolation
+        self._readonly = readonly
+        self._pool = None
+        self._conn = None
+        self._tx = None
+
+    async def __aenter__(self):
+        self._pool = await get_async_pool()
+        try:
+            self._conn = await self._pool.acquire(timeout=POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(
+                "Timed out after %.1fs waiting for a database connection" % POOL_TIMEOUT
+            ) from None
+        if self._transaction:
+            self._tx = self._conn.transaction(isolation=self._isolation, readonly=self._readonly)
+            await self._tx.start()
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if self._tx is not None:
+                if exc_type is None:
+                    await self._tx.commit()
+                else:
+                    await self._tx.rollback()
+        finally:
+            await self._pool.release(self._conn)
+
+def async_db_connection(transaction=True, isolation=None, readonly=False):
+    """Async context manager yielding a pooled connection (commit on success)."""
+    return _Acquire(transaction, isolation, readonly)
+
+def async_pool_stats():
+    if _pool is None:
+        return {"size": 0, "idle": 0, "in_use": 0}
+    size, idle = _pool.get_size(), _pool.get_idle_size()
+    return {
+        "min_size": _pool.get_min_size(),
+        "max_size": _pool.get_max_size(),
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle,
+    }
+
+async def close_async_pool():
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
+async def _fetch(query, *args):
+    async with async_db_connection(transaction=False) as conn:
+        return [dict(row) for row in await conn.fetch(query, *args)]
+
+async def _fetchrow(query, *args):
+    async with async_db_connection(transaction=False) as conn:
+        row = await conn.fetchrow(query, *args)
+    return None if row is None else dict(row)
+
+async def _stream(query, *args, prefetch=500):
+    """
+    Yield rows one by one from a server-side cursor, so memory stays flat
+    however many rows match. The connection is held until the generator
+    finishes or is closed.
+    """
+    async with async_db_connection() as conn:
+        async for row in conn.cursor(query, *args, prefetch=prefetch):
+            yield dict(row)
+
+def _keyset(filters, after_id, descending, conditions=()):
+    """
+    WHERE/ORDER BY for id-keyset pages; `filters` maps column -> value (None
+    skips it) and `conditions` are literal SQL predicates.
+    """
+    clauses, args = list(conditions), []
+    for column, value in filters.items():
+        if value is not None:
+            args.append(value)
+            clauses.append("%s = $%d" % (column, len(args)))
+    if after_id is not None:
+        args.append(after_id)
+        clauses.append("id %s $%d" % ("<" if descending else ">", len(args)))
+    where = "WHERE " + " AND ".join(clauses) if clauses else ""
+    return "%s ORDER BY id %s" % (where, "DESC" if descending else "ASC"), args
+
+# ----------- USERS -----------
+
+async def user_exists(user_id):
+    return await _fetchrow("SELECT id FROM users WHERE id = $1", user_id) is not None
+
+async def fetch_login_user(username_or_email):
+    return await _fetchrow("""
+        SELECT id, username, email, password
+        FROM users
+        WHERE username = $1 OR email = $1
+    """, username_or_email)
+
+async def update_password(user_id, hashed_password):
+    async with async_db_connection() as conn:
+        await conn.execute("UPDATE users SET password = $1 WHERE id = $2", hashed_password, user_id)
+
+# ----------- TASKS -----------
+
+async def fetch_tasks(user_id):
+    return await _fetch("""
+        SELECT id, name, category, estimated_time, deadline, fixed_time,
+               start_time, end_time, priority, description, stress_entry
+        FROM tasks
+        WHERE user_id = $1 AND archived = false
+        ORDER BY fixed_time DESC, deadline ASC, priority DESC
+    """, user_id)
+
+def _tasks_query(user_id, after_id):
+    # archived stays a literal so the partial index on active tasks applies
+    # to the generic plan of the prepared statement too
+    clause, args = _keyset({"user_id": user_id}, after_id, descending=False, conditions=["archived = false"])
+    return """
+        SELECT id, name, category, estimated_time, deadline, fixed_time,
+               start_time, end_time, priority, description, stress_entry
+        FROM tasks
+    """ + clause, args
+
+async def fetch_tasks_page(user_id, after_id, limit):
+    """Up to `limit` active tasks of a user in id order, after id `after_id`."""
+    query, args = _tasks_query(user_id, after_id)
+    return await _fetch(query + " LIMIT $%d" % (len(args) + 1), *args, limit)
+
+def stream_tasks(user_id, after_id=None, prefetch=500):
+    query, args = _tasks_query(user_id, after_id)
+    return _stream(query, *args, prefetch=prefetch)
+
+def stream_task_export(user_id, after_id=None, prefetch=500):
+    """Every task of a user, archived ones included, with id and every TASK_COLUMNS column."""
+    clause, args = _keyset({"user_id": user_id}, after_id, descending=False)
+    return _stream("SELECT id, %s FROM tasks %s" % (", ".join(TASK_COLUMNS), clause), *args, prefetch=prefetch)
+
+async def fetch_task(task_id):
+    return await _fetchrow("SELECT * FROM tasks WHERE id = $1", task_id)
+
+async def fetch_fixed_tasks(user_id):
+    return await _fetch("""
+        SELECT id, start_time, end_time, deadline
+        FROM tasks
+        WHERE user_id = $1 AND archived = false AND fixed_time = true
+          AND start_time IS NOT NULL
+    """, user_id)
+
+async def insert_task(user_id, values):
+    """Insert a task for `user_id`; `values` maps TASK_COLUMNS to values."""
+    return await _fetchrow("""
+        INSERT INTO tasks (
+            name, category, estimated_time, deadline, fixed_time, priority,
+            start_time, end_time, description, divided, archived, stress_entry, user_id
+        ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13)
+        RETURNING *
+    """, *(values[c] for c in TASK_COLUMNS), user_id)
+
+async def insert_tasks(user_id, chunks):
+    """
+    COPY every chunk (a list of TASK_COLUMNS value dicts) of an async
+    iterable into tasks, all in one transaction; returns the number of rows.
+    The connection is held while the chunks are produced, and an exception
+    raised by the iterable rolls back everything copied so far.
+    """
+    count = 0
+    async with async_db_connection() as conn:
+        async for chunk in chunks:
+            started = time.perf_counter()
+            await conn.copy_records_to_table(
+                "tasks",
+                columns=TASK_COLUMNS + ("user_id",),
+                records=[tuple(values[c] for c in TASK_COLUMNS) + (user_id,) for values in chunk],
+            )
+            # COPY bypasses the query logger
+            metrics.record_query("postgres_async", time.perf_counter() - started)
+            count += len(chunk)
+    return count
+
+async def update_task(task_id, values):
+    return await _fetchrow("""
+        UPDATE tasks SET
+            name = $1, category = $2, estimated_time = $3, deadline = $4,
+            fixed_time = $5, priority = $6, start_time = $7, end_time = $8,
+            description = $9, divided = $10, archived = $11, stress_entry = $12
+        WHERE id = $13
+        RETURNING *
+    """, *(values[c] for c in TASK_COLUMNS), task_id)
+
+async def delete_task(task_id):
+    return await _fetchrow("DELETE FROM tasks WHERE id = $1 RETURNING *", task_id)
+
+async def fetch_archived_count(user_id):
+    row = await _fetchrow(
+        "SELECT COUNT(*) AS count FROM tasks WHERE user_id = $1 AND archived = TRUE", user_id
+    )
+    return row["count"] if row else 0
+
+# ----------- SCHEDULED TASKS -----------
+
+async def fetch_schedule_version(user_id):
+    """Counter bumped by every write to the user's scheduled_tasks (0 if never written)."""
+    row = await _fetchrow("SELECT version FROM schedule_fingerprints WHERE user_id = $1", user_id)
+    return row["version"] if row else 0
+
+async def fetch_schedule_with_version(user_id):
+    """(version, rows) read from one snapshot, so the pair is consistent."""
+    async with async_db_connection(isolation="repeatable_read", readonly=True) as conn:
+        version = await conn.fetchval("SELECT version FROM schedule_fingerprints WHERE user_id = $1", user_id)
+        rows = await conn.fetch("""
+            SELECT * FROM scheduled_tasks
+            WHERE user_id = $1
+            ORDER BY start_time ASC
+        """, user_id)
+    return version or 0, [dict(row) for row in rows]
+
+# ----------- MOOD TRACKING -----------
+
+async def insert_mood(user_id, task_id, stress_level, date):
+    """
+    Log a mood entry and fold it into mood_rollups in the same transaction.
+    Returns its id, or None when `task_id` does not exist.
+    """
+    async with async_db_connection() as conn:
+        category = None
+        if task_id:
+            task = await conn.fetchrow("SELECT category FROM tasks WHERE id = $1", task_id)
+            if task is None:
+                return None
+            category = task["category"]
+        row = await conn.fetchrow("""
+            INSERT INTO mood_tracking (user_id, task_id, stress_level, date)
+            VALUES ($1, $2, $3, COALESCE($4, CURRENT_DATE))
+            RETURNING id, date
+        """, user_id, task_id, stress_level, date)
+        await _record_stress(conn, user_id, row["date"], category, stress_level)
+        return row["id"]
+
+def _moods_query(user_id, after_id):
+    # Newest first, so the first page holds the latest entries
+    clause, args = _keyset({"user_id": user_id}, after_id, descending=True)
+    return "SELECT * FROM mood_tracking " + clause, args
+
+async def fetch_moods_page(user_id, after_id, limit):
+    """Up to `limit` mood entries (of one user, or all when None) older than id `after_id`."""
+    query, args = _moods_query(user_id, after_id)
+    return await _fetch(query + " LIMIT $%d" % (len(args) + 1), *args, limit)
+
+def stream_moods(user_id=None, after_id=None, prefetch=500):
+    query, args = _moods_query(user_id, after_id)
+    return _stream(query, *args, prefetch=prefetch)
+
+async def fetch_moods_for_task(task_id):
+    return await _fetch("""
+        SELECT id, stress_level, date, timestamp
+        FROM mood_tracking
+        WHERE task_id = $1
+    """, task_id)
+
+# ----------- MOOD ROLLUPS -----------
+
+async def _record_stress(conn, user_id, day, category, stress_level):
+    """Async twin of db.record_stress."""
+    await conn.execute("""
+        INSERT INTO mood_rollups AS r (user_id, day, category, entries, stress_sum, stress_min, stress_max)
+        VALUES ($1, $2, COALESCE($3, ''), 1, $4, $4, $4)
+        ON CONFLICT (user_id, day, category) DO UPDATE SET
+            entries = r.entries + 1,
+            stress_sum = r.stress_sum + EXCLUDED.stress_sum,
+            stress_min = LEAST(r.stress_min, EXCLUDED.stress_min),
+            stress_max = GREATEST(r.stress_max, EXCLUDED.stress_max)
+    """, user_id, day, category, stress_level)
+
+async def _fetch_rollups(group_by, user_id, since):
+    async with async_db_connection(transaction=False) as conn:
+        rows = await conn.fetch("""
+            SELECT %s, SUM(entries) AS count,
+                   SUM(stress_sum)::float / SUM(entries) AS mean,
+                   MIN(stress_min) AS min, MAX(stress_max) AS max
+            FROM mood_rollups
+            WHERE user_id = $1 AND day >= $2
+            GROUP BY %s
+            ORDER BY %s
+        """ % (group_by, group_by, group_by), user_id, since)
+    return [dict(row) for row in rows]
+
+async def fetch_daily_stress(user_id, since):
+    """Stress count/mean/min/max per day from `since` on, across categories."""
+    return await _fetch_rollups("day", user_id, since)
+
+async def fetch_category_stress(user_id, since):
+    """Stress count/mean/min/max per task category since `since` ('' = no task)."""
+    return await _fetch_rollups("category", user_id, since)
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+# Times inside the scheduler are whole minutes since EPOCH. EPOCH is a
+# midnight, so the hour of day of a minute offset m is (m // 60) % 24.
+EPOCH = datetime(1970, 1, 1)
+MINUTE = timedelta(minutes=1)
+
+FIXED, FLEXIBLE, BREAK = 0, 1, 2
+TYPE_NAMES = ("Fixed", "Flexible", "Break")
+TYPE_CODES = {name: code for code, name in enumerate(TYPE_NAMES)}
+
+PRIORITY_SCORES = {"Low": 1, "Medium": 2, "High": 3, "Extra High": 4}
+
+TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+def to_minutes(value):
+    """Minutes since EPOCH for a naive datetime (seconds are truncated)."""
+    return (value - EPOCH) // MINUTE
+
+def from_minutes(minutes):
+    return EPOCH + timedelta(minutes=minutes)
+
+class ScheduleEntry:
+    """One scheduled block. start/end are epoch minutes, kind a type code."""
+
+    __slots__ = ("task_id", "task", "start", "end", "kind", "priority")
+
+    def __init__(self, task_id, task, start, end, kind, priority=1):
+        self.task_id = task_id
+        self.task = task
+        self.start = start
+        self.end = end
+        self.kind = kind
+        self.priority = priority
+
+    @classmethod
+    def from_row(cls, row):
+        """Build from a scheduled_tasks row (datetimes and a type name)."""
+        return cls(
+            row["task_id"], row.get("task"),
+            to_minutes(row["start"]), to_minutes(row["end"]),
+            TYPE_CODES[row["type"]],
+        )
+
+    @property
+    def type(self):
+        return TYPE_NAMES[self.kind]
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def moved_to(self, start):
+        return ScheduleEntry(self.task_id, self.task, start, start + self.duration, self.kind, self.priority)
+
+    def to_dict(self):
+        """The JSON shape the API has always returned."""
+        return {
+            "task_id": self.task_id,
+            "task": self.task,
+            "start": from_minutes(self.start).strftime(TIME_FORMAT),
+            "end": from_minutes(self.end).strftime(TIME_FORMAT),
+            "type": TYPE_NAMES[self.kind],
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, ScheduleEntry):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __hash__(self):
+        return hash((self.task_id, self.start, self.end, self.kind))
+
+    def __repr__(self):
+        return "ScheduleEntry(%r, %r, %s, %s, %s)" % (
+            self.task_id, self.task, from_minutes(self.start), from_minutes(self.end), self.type
+        )
+
+def schedule_to_json(schedule):
+    return [entry.to_dict() for entry in schedule]
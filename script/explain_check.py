@@ -0,0 +1,247 @@
+"""
+Query-plan check: the hot queries must be served by indexes.
+
+Each query is EXPLAINed against a seeded database and fails on a
+sequential scan of any table.
+
+    python explain_check.py                    # seed, explain, roll back
+    python explain_check.py --users 5000 --tasks-per-user 40
+    python explain_check.py --no-seed          # explain against existing data
+
+Seeding, ANALYZE and the EXPLAINs share one transaction that is rolled
+back, so the database (statistics included) is left as it was. Run
+migrations.py first. The exit status is 1 when any plan scans a table
+sequentially.
+"""
+import argparse
+import json
+import sys
+
+from db import get_connection
+
+# (name, query). Keep these in step with the queries in
+# db.py / db_async.py they stand for; asyncpg's $n become %(name)s here.
+HOT_QUERIES = [
+    ("db.fetch_tasks", """
+        SELECT id, name, category, estimated_time, deadline, fixed_time,
+               start_time, end_time, priority, description, stress_entry
+        FROM tasks
+        WHERE user_id = %(user_id)s AND archived = false
+        ORDER BY fixed_time DESC, deadline ASC, priority DESC
+    """),
+    ("db.fetch_tasks_bulk", """
+        SELECT user_id, id, name, category, estimated_time, deadline, fixed_time,
+               start_time, end_time, priority, description, stress_entry
+        FROM tasks
+        WHERE user_id = ANY(%(user_ids)s) AND archived = false
+        ORDER BY user_id, fixed_time DESC, deadline ASC, priority DESC
+    """),
+    ("db_async.fetch_tasks_page", """
+        SELECT id, name, category, estimated_time, deadline, fixed_time,
+               start_time, end_time, priority, description, stress_entry
+        FROM tasks
+        WHERE archived = false AND user_id = %(user_id)s AND id > %(after_id)s
+        ORDER BY id ASC
+        LIMIT 101
+    """),
+    ("db_async.fetch_fixed_tasks", """
+        SELECT id, start_time, end_time, deadline
+        FROM tasks
+        WHERE user_id = %(user_id)s AND archived = false AND fixed_time = true
+          AND start_time IS NOT NULL
+    """),
+    ("db_async.fetch_archived_count", """
+        SELECT COUNT(*) AS count FROM tasks WHERE user_id = %(user_id)s AND archived = TRUE
+    """),
+    ("db_async.fetch_schedule_with_version", """
+        SELECT * FROM scheduled_tasks
+        WHERE user_id = %(user_id)s
+        ORDER BY start_time ASC
+    """),
+    ("db.modify_schedule", """
+        SELECT task_id, start_time AS start, end_time AS "end", type
+        FROM scheduled_tasks
+        WHERE user_id = %(user_id)s
+        ORDER BY start_time ASC
+    """),
+    ("db.fetch_memoized_schedule", """
+        SELECT f.unscheduled, s.task_id, s.start_time AS start, s.end_time AS "end", s.type
+        FROM schedule_fingerprints f
+        LEFT JOIN scheduled_tasks s ON s.user_id = f.user_id
+        WHERE f.user_id = %(user_id)s AND f.fingerprint = 'seed'
+        ORDER BY s.start_time ASC
+    """),
+    ("db_async.fetch_moods_for_task", """
+        SELECT id, stress_level, date, timestamp
+        FROM mood_tracking
+        WHERE task_id = %(task_id)s
+    """),
+    ("db_async.fetch_moods_page", """
+        SELECT * FROM mood_tracking
+        WHERE user_id = %(user_id)s AND id < %(before_id)s
+        ORDER BY id DESC
+        LIMIT 101
+    """),
+    ("db_async.fetch_login_user", """
+        SELECT id, username, email, password
+        FROM users
+        WHERE username = %(username)s OR email = %(username)s
+    """),
+    ("db.fetch_user_prefs", """
+        SELECT time_pref, stress_base, work_pref, sleep_goal, sleep_pref
+        FROM users
+        WHERE id = %(user_id)s
+    """),
+    ("db.fetch_recent_stress_bulk", """
+        SELECT user_id, SUM(stress_sum)::float / SUM(entries) AS mean
+        FROM mood_rollups
+        WHERE user_id = ANY(%(user_ids)s) AND day > CURRENT_DATE - 7
+        GROUP BY user_id
+    """),
+    ("db_async.fetch_daily_stress", """
+        SELECT day, SUM(entries) AS count,
+               SUM(stress_sum)::float / SUM(entries) AS mean,
+               MIN(stress_min) AS min, MAX(stress_max) AS max
+        FROM mood_rollups
+        WHERE user_id = %(user_id)s AND day >= CURRENT_DATE - 30
+        GROUP BY day
+        ORDER BY day
+    """),
+    ("db_async.fetch_schedule_version", """
+        SELECT version FROM schedule_fingerprints WHERE user_id = %(user_id)s
+    """),
+]
+
+SEED_STATEMENTS = [
+    """
+    INSERT INTO users (username, password, email, name, lname, time_pref, stress_base,
+                       work_pref, sleep_pref, sleep_goal, occupation)
+    SELECT 'explain-seed-' || g, 'x', 'explain-seed-' || g || '@example.invalid', 'Seed', 'User',
+           g %% 3, 1 + g %% 10, 'Short Sprints', 8, '22:00', 'Student'
+    FROM generate_series(1, %(users)s) g
+    """,
+    """
+    INSERT INTO tasks (user_id, name, category, estimated_time, deadline, fixed_time,
+                       priority, start_time, end_time, archived)
+    SELECT u.id, 'task ' || g, (ARRAY['work', 'study', 'home'])[1 + g %% 3], 30 + g %% 4 * 15,
+           CURRENT_TIMESTAMP + g * INTERVAL '3 hours', g %% 5 = 0,
+           (ARRAY['Low', 'Medium', 'High'])[1 + g %% 3],
+           CASE WHEN g %% 5 = 0 THEN CURRENT_TIMESTAMP + g * INTERVAL '3 hours' END,
+           CASE WHEN g %% 5 = 0 THEN CURRENT_TIMESTAMP + g * INTERVAL '3 hours' + INTERVAL '1 hour' END,
+           g %% 4 = 0
+    FROM users u CROSS JOIN generate_series(1, %(tasks)s) g
+    WHERE u.username LIKE 'explain-seed-%%'
+    """,
+    """
+    INSERT INTO scheduled_tasks (user_id, task_id, start_time, end_time, type)
+    SELECT t.user_id, t.id, CURRENT_TIMESTAMP + t.id * INTERVAL '1 minute',
+           CURRENT_TIMESTAMP + t.id * INTERVAL '1 minute' + INTERVAL '30 minutes', 'Flexible'
+    FROM tasks t JOIN users u ON u.id = t.user_id
+    WHERE u.username LIKE 'explain-seed-%%' AND NOT t.archived
+    """,
+    """
+    INSERT INTO mood_tracking (user_id, task_id, stress_level, date)
+    SELECT t.user_id, t.id, 1 + t.id %% 10, CURRENT_DATE - t.id %% 60
+    FROM tasks t JOIN users u ON u.id = t.user_id
+    WHERE u.username LIKE 'explain-seed-%%'
+    """,
+    """
+    INSERT INTO mood_rollups (user_id, day, category, entries, stress_sum, stress_min, stress_max)
+    SELECT m.user_id, m.date, COALESCE(t.category, ''), COUNT(*),
+           SUM(m.stress_level), MIN(m.stress_level), MAX(m.stress_level)
+    FROM mood_tracking m
+    JOIN users u ON u.id = m.user_id
+    LEFT JOIN tasks t ON t.id = m.task_id
+    WHERE u.username LIKE 'explain-seed-%%'
+    GROUP BY m.user_id, m.date, COALESCE(t.category, '')
+    ON CONFLICT (user_id, day, category) DO NOTHING
+    """,
+    """
+    INSERT INTO schedule_fingerprints (user_id, fingerprint)
+    SELECT id, 'seed' FROM users WHERE username LIKE 'explain-seed-%%'
+    ON CONFLICT (user_id) DO NOTHING
+    """,
+]
+
+TABLES = ("users", "tasks", "scheduled_tasks", "mood_tracking", "mood_rollups", "schedule_fingerprints")
+
+def seed(cur, users, tasks_per_user):
+    for statement in SEED_STATEMENTS:
+        cur.execute(statement, {"users": users, "tasks": tasks_per_user})
+    for table in TABLES:
+        cur.execute("ANALYZE %s" % table)
+
+def sample_params(cur):
+    """Parameters pointing at a typical user: one with tasks, moods and a schedule."""
+    cur.execute("""
+        SELECT t.user_id, MIN(t.id) AS task_id
+        FROM tasks t
+        GROUP BY t.user_id
+        ORDER BY COUNT(*) DESC, t.user_id
+        LIMIT 1
+    """)
+    row = cur.fetchone()
+    if row is None:
+        raise SystemExit("No tasks to explain against; seed the database or drop --no-seed")
+    cur.execute("SELECT username FROM users WHERE id = %s", (row["user_id"],))
+    username = cur.fetchone()["username"]
+    cur.execute("SELECT array_agg(id) AS ids FROM (SELECT id FROM users ORDER BY id LIMIT 200) u")
+    return {
+        "user_id": row["user_id"],
+        "user_ids": cur.fetchone()["ids"],
+        "task_id": row["task_id"],
+        "after_id": row["task_id"],
+        "before_id": 2 ** 31 - 1,
+        "username": username,
+    }
+
+def plan_nodes(plan):
+    """Every node of an EXPLAIN (FORMAT JSON) plan tree, depth first."""
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from plan_nodes(child)
+
+def describe(node):
+    text = node["Node Type"]
+    if node.get("Index Name"):
+        text += " using %s" % node["Index Name"]
+    if node.get("Relation Name"):
+        text += " on %s" % node["Relation Name"]
+    return text
+
+def explain_all(cur, params):
+    """[(name, scanned nodes, sequential scans)] for HOT_QUERIES."""
+    results = []
+    for name, query in HOT_QUERIES:
+        cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+        raw = cur.fetchone()["QUERY PLAN"]
+        plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+        scans = [node for node in plan_nodes(plan) if "Relation Name" in node]
+        seq_scans = [node["Relation Name"] for node in scans if node["Node Type"] == "Seq Scan"]
+        results.append((name, [describe(node) for node in scans], seq_scans))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000, help="seeded users")
+    parser.add_argument("--tasks-per-user", type=int, default=25, help="seeded tasks per user")
+    parser.add_argument("--no-seed", action="store_true", help="explain against the data already there")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        if not args.no_seed:
+            seed(cur, args.users, args.tasks_per_user)
+        results = explain_all(cur, sample_params(cur))
+    finally:
+        conn.rollback()
+        conn.close()
+
+    failed = [name for name, _, seq_scans in results if seq_scans]
+    for name, scans, seq_scans in results:
+        print("%-4s %-36s %s" % ("SEQ" if seq_scans else "ok", name, "; ".join(scans)))
+    if failed:
+        print("\n%d of %d hot queries scan sequentially: %s" % (len(failed), len(results), ", ".join(failed)))
+        sys.exit(1)
+    print("\nAll %d hot queries use indexes" % len(results))
@@ -1,57 +1,103 @@
 from datetime import datetime
 
+import numpy as np
+
+from entries import EPOCH, BREAK, PRIORITY_SCORES, ScheduleEntry
+
+FOCUS_HOURS = {"morning": (8, 12), "afternoon": (10, 14), "evening": (12, 16)}
+
 def evaluate_schedule(schedule, user_prefs):
     """
     Compute a global reward for how well a schedule fits user preferences
     and minimizes projected stress.
     """
-    reward = 0
-    focus_start, focus_end = {"morning": (8, 12), "afternoon": (10, 14), "evening": (12, 16)}.get(
-        user_prefs["focus_period"], (8, 12)
-    )
-    
-    for entry in schedule:
-        if entry["type"] == "Break":
-            reward += 1  # encourage regular breaks
-        else:
-            start_time = datetime.strptime(entry["start"], "%Y-%m-%d %H:%M")
-            hour = start_time.hour
-            in_focus = focus_start <= hour < focus_end
-            reward += 2 if in_focus else -1  # focus hour bonus
-
-            # Bonus for scheduling high-priority tasks early
-            priority = entry.get("priority", "Low")
-            priority_score = {"Low": 1, "Medium": 2, "High": 3, "Extra High": 4}.get(priority, 1)
-            reward += priority_score * (24 - hour) / 24  # weight early hours higher
+    starts, ends, is_break, priorities = schedule_arrays(schedule)
+    return float(evaluate_schedule_batch(starts, ends, is_break, priorities, user_prefs)[0])
+
+def schedule_arrays(schedule):
+    """
+    Columns for evaluate_schedule_batch from schedule entries: start and end
+    as minute offsets from EPOCH, a break flag and the priority score.
+    ScheduleEntry lists are read directly; dict entries have each
+    "start"/"end" string parsed exactly once.
+    """
+    n = len(schedule)
+    if n and isinstance(schedule[0], ScheduleEntry):
+        starts = np.fromiter((e.start for e in schedule), dtype=float, count=n)
+        ends = np.fromiter((e.end for e in schedule), dtype=float, count=n)
+        kinds = np.fromiter((e.kind for e in schedule), dtype=np.int8, count=n)
+        priorities = np.fromiter((e.priority for e in schedule), dtype=float, count=n)
+        return starts, ends, kinds == BREAK, priorities
+    starts = np.empty(n)
+    ends = np.empty(n)
+    is_break = np.empty(n, dtype=bool)
+    priorities = np.empty(n)
+    for i, entry in enumerate(schedule):
+        starts[i] = _minutes(entry["start"])
+        ends[i] = _minutes(entry["end"])
+        is_break[i] = entry["type"] == "Break"
+        priorities[i] = PRIORITY_SCORES.get(entry.get("priority", "Low"), 1)
+    return starts, ends, is_break, priorities
+
+def schedules_to_batch(schedules):
+    """Pad several schedules into (batch, n) arrays plus a validity mask."""
+    width = max((len(s) for s in schedules), default=0)
+    shape = (len(schedules), width)
+    starts, ends = np.zeros(shape), np.zeros(shape)
+    is_break = np.zeros(shape, dtype=bool)
+    priorities = np.ones(shape)
+    valid = np.zeros(shape, dtype=bool)
+    for row, schedule in enumerate(schedules):
+        n = len(schedule)
+        starts[row, :n], ends[row, :n], is_break[row, :n], priorities[row, :n] = schedule_arrays(schedule)
+        valid[row, :n] = True
+    return starts, ends, is_break, priorities, valid
+
+def evaluate_schedule_batch(starts, ends, is_break, priorities, user_prefs, valid=None):
+    """
+    Vectorized evaluate_schedule. Inputs are arrays of shape (n,) for one
+    schedule or (batch, n) for many candidates; `valid` masks padding in
+    ragged batches. Returns one reward per schedule, bit-for-bit equal to
+    scoring each schedule on its own: terms are accumulated left to right
+    with cumsum rather than a pairwise sum.
+    """
+    starts = np.atleast_2d(np.asarray(starts, dtype=float))
+    ends = np.atleast_2d(np.asarray(ends, dtype=float))
+    is_break = np.atleast_2d(np.asarray(is_break, dtype=bool))
+    priorities = np.atleast_2d(np.asarray(priorities, dtype=float))
+    valid = np.ones(starts.shape, dtype=bool) if valid is None else np.atleast_2d(valid)
+    batch, n = starts.shape
+
+    focus_start, focus_end = FOCUS_HOURS.get(user_prefs["focus_period"], (8, 12))
+    hours = np.floor(starts / 60) % 24
+    in_focus = (focus_start <= hours) & (hours < focus_end)
+
+    # Breaks earn +1; other entries earn a focus-hour bonus/penalty plus a
+    # priority bonus weighted towards early hours
+    focus_terms = np.where(is_break, 1.0, np.where(in_focus, 2.0, -1.0))
+    priority_terms = np.where(is_break, 0.0, priorities * (24 - hours) / 24)
+    terms = np.zeros((batch, 2 * n))
+    terms[:, 0::2] = np.where(valid, focus_terms, 0.0)
+    terms[:, 1::2] = np.where(valid, priority_terms, 0.0)
+    reward = np.cumsum(terms, axis=1)[:, -1] if n else np.zeros(batch)
 
     # Align with preferred work style
-    long_chunks = user_prefs["work_style"] == "long_chunks"
-    avg_duration = _avg_task_duration(schedule)
-    if long_chunks and avg_duration >= 60:
-        reward += 3
-    elif not long_chunks and avg_duration < 45:
-        reward += 3
+    durations = np.where(valid, ends - starts, 0.0)
+    counts = valid.sum(axis=1)
+    total = np.cumsum(durations, axis=1)[:, -1] if n else np.zeros(batch)
+    avg_duration = np.where(counts > 0, total / np.maximum(counts, 1), 0.0)
+    if user_prefs["work_style"] == "long_chunks":
+        reward = reward + np.where(avg_duration >= 60, 3, -2)
     else:
-        reward -= 2
+        reward = reward + np.where(avg_duration < 45, 3, -2)
 
     # Penalty or bonus based on current stress level
     stress = user_prefs["stress_level"]
-    reward += (10 - stress) * 0.5  # lower stress = higher reward
-    
+    reward = reward + (10 - stress) * 0.5  # lower stress = higher reward
+
     return reward
 
-def _avg_task_duration(schedule):
-    durations = []
-    for entry in schedule:
-        start_val = entry["start"]
-        end_val = entry["end"]
-        if isinstance(start_val, datetime):
-            start = start_val
-        else:
-            start = datetime.strptime(start_val, "%Y-%m-%d %H:%M")
-        if isinstance(end_val, datetime):
-            end = end_val
-        else:
-            end = datetime.strptime(end_val, "%Y-%m-%d %H:%M")
-        durations.append((end - start).total_seconds() / 60)
-    return sum(durations) / len(durations) if durations else 0
+def _minutes(value):
+    if not isinstance(value, datetime):
+        value = datetime.strptime(value, "%Y-%m-%d %H:%M")
+    return (value - EPOCH).total_seconds() / 60
@@ -0,0 +1,86 @@
+import codecs
+import csv
+import json
+
+from fastapi import HTTPException
+
+# Incremental parsing of streamed NDJSON / CSV request bodies, so a bulk
+# upload is validated and written chunk by chunk instead of being read into
+# memory first.
+
+# Longest line (or quoted CSV record) accepted, in characters
+MAX_LINE_LENGTH = 1 << 20
+
+def _decode(decoder, chunk, final=False):
+    try:
+        return decoder.decode(chunk, final)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Body is not valid UTF-8") from None
+
+async def lines(body):
+    """
+    Yield (line number, text) for every line of an async iterable of UTF-8
+    byte chunks (e.g. request.stream()), without its line ending.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending, number = "", 0
+    async for chunk in body:
+        pending += _decode(decoder, chunk)
+        *complete, pending = pending.split("\n")
+        for line in complete:
+            number += 1
+            yield number, line.rstrip("\r")
+        if len(pending) > MAX_LINE_LENGTH:
+            raise HTTPException(status_code=413, detail="Line %d is too long" % (number + 1))
+    pending += _decode(decoder, b"", final=True)
+    if pending:
+        yield number + 1, pending.rstrip("\r")
+
+async def ndjson_records(body):
+    """Yield (line number, record, error): one JSON object per line; error is a message or None."""
+    async for number, line in lines(body):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, None, "Invalid JSON: %s" % e
+            continue
+        if not isinstance(record, dict):
+            yield number, None, "Expected a JSON object"
+            continue
+        yield number, record, None
+
+async def csv_records(body):
+    """
+    Yield (line number, record, error) for CSV with a header row. Empty
+    fields become None; a record with quoted newlines is numbered by its
+    first line.
+    """
+    header, record_lines, first = None, [], None
+    async for number, line in lines(body):
+        if not record_lines and not line.strip():
+            continue
+        record_lines.append(line)
+        first = first or number
+        joined = "\n".join(record_lines)
+        # Quotes are balanced at the end of a record ("" escapes count twice)
+        if joined.count('"') % 2:
+            if len(joined) > MAX_LINE_LENGTH:
+                raise HTTPException(status_code=413, detail="Record on line %d is too long" % first)
+            continue
+        record_lines, start, first = [], first, None
+        try:
+            fields = next(csv.reader([joined]))
+        except csv.Error as e:
+            yield start, None, "Invalid CSV: %s" % e
+            continue
+        if header is None:
+            header = [name.strip() for name in fields]
+            continue
+        if len(fields) != len(header):
+            yield start, None, "Expected %d fields, got %d" % (len(header), len(fields))
+            continue
+        yield start, {name: value if value != "" else None for name, value in zip(header, fields)}, None
+    if record_lines:
+        yield first, None, "Unterminated quoted field"
@@ -0,0 +1,208 @@
+import random
+
+class _Node:
+    __slots__ = ("start", "end", "seq", "key", "priority", "left", "right", "max_end")
+
+    def __init__(self, start, end, seq, key):
+        self.start = start
+        self.end = end
+        self.seq = seq
+        self.key = key
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.max_end = end
+
+def _update(node):
+    max_end = node.end
+    if node.left is not None and node.left.max_end > max_end:
+        max_end = node.left.max_end
+    if node.right is not None and node.right.max_end > max_end:
+        max_end = node.right.max_end
+    node.max_end = max_end
+
+def _split(node, start, seq):
+    """(nodes before (start, seq), nodes from (start, seq) on)."""
+    if node is None:
+        return None, None
+    if (node.start, node.seq) < (start, seq):
+        node.right, right = _split(node.right, start, seq)
+        _update(node)
+        return node, right
+    left, node.left = _split(node.left, start, seq)
+    _update(node)
+    return left, node
+
+def _merge(left, right):
+    """Join two treaps where every node of `left` sorts before `right`."""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+class IntervalIndex:
+    """
+    Half-open [start, end) intervals tagged with a hashable key (e.g. a task
+    id). Works with any ordered values (datetimes, epoch minutes, ...) as
+    long as they are used consistently.
+
+    The intervals live in a treap ordered by start, each node carrying the
+    largest end in its subtree. Inserts and removals are O(log n) expected,
+    is_free is O(log n), overlap and gap queries O(log n) per interval
+    reported, and next_fit O(log n) per too-short gap it steps over.
+    """
+
+    def __init__(self, intervals=()):
+        self._root = None
+        self._by_key = {}  # key -> node
+        self._seq = 0  # tie-breaker so keys never need to be comparable
+        intervals = list(intervals)
+        if intervals:
+            self._build(intervals)
+
+    def _build(self, intervals):
+        """Bulk load in O(n log n) for the sort and O(n) for the tree."""
+        nodes = {}
+        for start, end, key in intervals:
+            if not start < end:
+                raise ValueError("Interval must have start < end: %r, %r" % (start, end))
+            nodes[key] = _Node(start, end, self._seq, key)  # a repeated key keeps its last interval
+            self._seq += 1
+        self._by_key = nodes
+        # Cartesian tree over the sorted nodes: a node's parent is the
+        # nearest neighbour with a higher priority
+        spine = []
+        for node in sorted(nodes.values(), key=lambda n: (n.start, n.seq)):
+            last = None
+            while spine and spine[-1].priority < node.priority:
+                last = spine.pop()
+                _update(last)
+            node.left = last
+            if spine:
+                spine[-1].right = node
+            spine.append(node)
+        for node in reversed(spine):
+            _update(node)
+        self._root = spine[0]
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def __iter__(self):
+        stack, node = [], self._root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.start, node.end, node.key
+            node = node.right
+
+    def add(self, start, end, key):
+        if not start < end:
+            raise ValueError("Interval must have start < end: %r, %r" % (start, end))
+        if key in self._by_key:
+            self.remove(key)
+        node = _Node(start, end, self._seq, key)
+        self._seq += 1
+        left, right = _split(self._root, start, node.seq)
+        self._root = _merge(_merge(left, node), right)
+        self._by_key[key] = node
+
+    def remove(self, key):
+        node = self._by_key.pop(key)
+        left, rest = _split(self._root, node.start, node.seq)
+        _, right = _split(rest, node.start, node.seq + 1)
+        self._root = _merge(left, right)
+
+    def __contains__(self, key):
+        return key in self._by_key
+
+    def get(self, key):
+        node = self._by_key.get(key)
+        return None if node is None else (node.start, node.end)
+
+    def _overlapping_nodes(self, start, end):
+        """Nodes intersecting [start, end), in start order."""
+        stack, node = [], self._root
+        while stack or node is not None:
+            # Subtrees ending by `start` hold nothing that overlaps
+            while node is not None and node.max_end > start:
+                stack.append(node)
+                node = node.left
+            if not stack:
+                return
+            node = stack.pop()
+            if not node.start < end:
+                return  # it and everything after it start too late
+            if node.end > start:
+                yield node
+            node = node.right
+
+    def overlapping(self, start, end):
+        """Keys of the intervals that intersect [start, end), in start order."""
+        return [node.key for node in self._overlapping_nodes(start, end)]
+
+    def is_free(self, start, end):
+        node = self._root
+        while node is not None:
+            if node.start < end and node.end > start:
+                return False
+            # If the left subtree reaches past `start` but holds no overlap,
+            # its latest-ending interval starts at or after `end`, and so
+            # does everything to its right
+            if node.left is not None and node.left.max_end > start:
+                node = node.left
+            else:
+                node = node.right
+        return True
+
+    def _max_end_before(self, moment):
+        """Largest end among the intervals starting before `moment`, or None."""
+        best, node = None, self._root
+        while node is not None:
+            if node.start < moment:
+                if node.left is not None and (best is None or node.left.max_end > best):
+                    best = node.left.max_end
+                if best is None or node.end > best:
+                    best = node.end
+                node = node.right
+            else:
+                node = node.left
+        return best
+
+    def gaps(self, window_start, window_end):
+        """Free intervals inside [window_start, window_end), in order."""
+        gaps = []
+        cursor = window_start
+        for node in self._overlapping_nodes(window_start, window_end):
+            if node.end <= cursor:
+                continue
+            if cursor < node.start:
+                gaps.append((cursor, node.start))
+            cursor = node.end
+        if cursor < window_end:
+            gaps.append((cursor, window_end))
+        return gaps
+
+    def next_fit(self, duration, after, before=None):
+        """
+        Earliest start >= `after` of a free slot of length `duration` that
+        ends by `before` (unbounded when None), or None if there is none.
+        """
+        cursor = after
+        while before is None or cursor + duration <= before:
+            # Anything starting before the slot ends and ending after it
+            # starts blocks it; no slot fits until the latest of those ends
+            blocked_until = self._max_end_before(cursor + duration)
+            if blocked_until is None or blocked_until <= cursor:
+                return cursor
+            cursor = blocked_until
+        return None
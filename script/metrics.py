@@ -0,0 +1,243 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# In-process metrics in the Prometheus text exposition format, served by
+# GET /metrics. Recording is a lock and a few additions, so it stays on in
+# production. Each worker process exports its own series; helper processes
+# started by a worker (the rollout pool) hand theirs back with drain/merge.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+_registry = []
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError("%s expects labels %s, got %s" % (self.name, self.labelnames, sorted(labels)))
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.kind)]
+        with self._lock:
+            lines += self._samples()
+        return lines
+
+    def drain(self):
+        """The recorded series ({labels: value}), which are reset."""
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def merge(self, values):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+    def _samples(self):
+        return [
+            "%s%s %s" % (self.name, _format_labels(self.labelnames, key), _format_value(value))
+            for key, value in sorted(self._values.items())
+        ]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def merge(self, values):
+        with self._lock:
+            self._values.update(values)
+
+    _samples = Counter._samples
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+
+    def drain(self):
+        with self._lock:
+            series, self._series = self._series, {}
+        return series
+
+    def merge(self, series):
+        with self._lock:
+            for key, values in series.items():
+                mine = self._series.get(key)
+                if mine is None:
+                    self._series[key] = list(values)
+                else:
+                    self._series[key] = [a + b for a, b in zip(mine, values)]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        lines = []
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = bound if bound == "+Inf" else _format_value(bound)
+                lines.append("%s_bucket%s %d" % (
+                    self.name, _format_labels(self.labelnames, key, [("le", le)]), cumulative
+                ))
+            labels = _format_labels(self.labelnames, key)
+            lines.append("%s_sum%s %s" % (self.name, labels, repr(float(series[-1]))))
+            lines.append("%s_count%s %d" % (self.name, labels, cumulative))
+        return lines
+
+def render():
+    """Every registered metric in the text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+def drain():
+    """
+    Everything recorded in this process since the last drain, as picklable
+    data, and reset. Helper processes return it to the process that serves
+    /metrics, which adds it with merge().
+    """
+    return {metric.name: values for metric in _registry for values in [metric.drain()] if values}
+
+def merge(drained):
+    by_name = {metric.name: metric for metric in _registry}
+    for name, values in drained.items():
+        by_name[name].merge(values)
+
+# ----------- HTTP -----------
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "fika_http_request_duration_seconds", "Time until the response starts, per route.",
+    ("method", "route", "status"),
+)
+HTTP_REQUEST_DB_QUERIES = Histogram(
+    "fika_http_request_db_queries", "Database queries made while serving a request.",
+    ("method", "route"), buckets=COUNT_BUCKETS,
+)
+HTTP_REQUEST_DB_SECONDS = Histogram(
+    "fika_http_request_db_seconds", "Time spent in database queries while serving a request.",
+    ("method", "route"),
+)
+
+# ----------- DATABASE -----------
+
+DB_QUERY_SECONDS = Histogram(
+    "fika_db_query_duration_seconds", "Duration of single database statements.", ("backend",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+
+# [queries, seconds] of the request being served; the same list is shared
+# with the threads and tasks the request starts, which inherit the context
+_request_queries = ContextVar("fika_request_queries", default=None)
+
+def record_query(backend, seconds):
+    DB_QUERY_SECONDS.observe(seconds, backend=backend)
+    totals = _request_queries.get()
+    if totals is not None:
+        totals[0] += 1
+        totals[1] += seconds
+
+@contextmanager
+def track_request_queries():
+    """Collect record_query calls made in this context; yields [queries, seconds]."""
+    totals = [0, 0.0]
+    token = _request_queries.set(totals)
+    try:
+        yield totals
+    finally:
+        _request_queries.reset(token)
+
+# ----------- SCHEDULER -----------
+
+SCHEDULE_PHASE_SECONDS = Histogram(
+    "fika_schedule_phase_seconds",
+    "generate_schedule time per phase (fetch, gaps, solve, evaluate, store).",
+    ("phase", "solver"),
+)
+SCHEDULE_MEMO = Counter(
+    "fika_schedule_memo_total", "generate_schedule calls answered from the stored schedule or replanned.",
+    ("result",),
+)
+SCHEDULE_ROLLOUT_SECONDS = Histogram(
+    "fika_schedule_rollout_seconds", "Duration of single RL rollouts, pooled ones included.",
+)
+SCHEDULE_ROLLOUTS = Histogram(
+    "fika_schedule_rollouts", "RL rollouts finished within the time budget per plan.", (),
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+AGENT_Q_TABLE_STATES = Histogram(
+    "fika_agent_q_table_states", "Q-table size (visited states) after planning with the RL agent.", (),
+    buckets=(10, 50, 100, 500, 1000, 5000, 10000, 50000),
+)
+AGENT_EPSILON = Gauge("fika_agent_epsilon", "Exploration rate of the last agent that planned.")
+AGENT_FINAL_REWARD = Histogram(
+    "fika_agent_final_reward", "evaluate_schedule reward of planned schedules.", ("solver",),
+    buckets=(-10, 0, 5, 10, 20, 50, 100, 200, 500),
+)
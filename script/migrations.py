@@ -0,0 +1,260 @@
+"""
+Versioned Postgres schema for the API, the scheduler and the Q-table store.
+
+    python migrations.py              # apply pending migrations
+    python migrations.py --status     # list applied and pending versions
+
+Migrations run in order under a session advisory lock, so concurrent
+runners apply them exactly once. Each one is its own transaction, except
+index migrations: their indexes are built with CREATE INDEX CONCURRENTLY,
+which cannot run inside a transaction but leaves the table writable while
+it builds. Applied versions are recorded in schema_migrations. Never edit a
+released migration; append a new one.
+
+Run this as a deploy step. FIKA_AUTO_MIGRATE=1 also applies pending
+migrations when the API starts or a batch run begins, which is only meant
+for development databases: index builds on large tables should not hold up
+a web worker's boot.
+"""
+import argparse
+import os
+from collections import namedtuple
+
+from db import db_connection, get_connection
+
+# Apply pending migrations when the API starts or a batch run begins
+AUTO_MIGRATE = os.environ.get("FIKA_AUTO_MIGRATE", "0") == "1"
+
+# Namespace for the advisory lock held while migrating (see SCHEDULE_LOCK_NAMESPACE in db.py)
+MIGRATION_LOCK_NAMESPACE = 7302
+
+SCHEMA_MIGRATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# An index built with CREATE INDEX CONCURRENTLY; `definition` is everything
+# after ON. A migration is either all statements or all Index entries.
+Index = namedtuple("Index", "name definition")
+
+# (version, name, statements). IF NOT EXISTS throughout, so databases made
+# before migrations existed (tables created by hand or on first use) adopt
+# this history without changes.
+MIGRATIONS = [
+    (1, "base schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            email TEXT NOT NULL,
+            name TEXT,
+            lname TEXT,
+            gender TEXT,
+            birthday DATE,
+            time_pref INTEGER,
+            stress_base INTEGER,
+            work_pref TEXT,
+            sleep_pref INTEGER,
+            sleep_goal TIME,
+            occupation TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_preferences (
+            user_id INTEGER PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE,
+            work_style TEXT,
+            focus_period TEXT,
+            stress_level INTEGER,
+            break_preference TEXT,
+            work_block_preference TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            category TEXT,
+            estimated_time INTEGER,
+            deadline TIMESTAMP,
+            fixed_time BOOLEAN DEFAULT false,
+            priority TEXT,
+            start_time TIMESTAMP,
+            end_time TIMESTAMP,
+            description TEXT,
+            divided BOOLEAN DEFAULT false,
+            archived BOOLEAN NOT NULL DEFAULT false,
+            stress_entry INTEGER
+        )
+        """,
+        # task_id is not a foreign key: entries of a deleted task are removed
+        # by rescheduling, and mood history outlives its task
+        """
+        CREATE TABLE IF NOT EXISTS scheduled_tasks (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            task_id INTEGER,
+            start_time TIMESTAMP NOT NULL,
+            end_time TIMESTAMP NOT NULL,
+            type TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS mood_tracking (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            task_id INTEGER,
+            stress_level INTEGER,
+            date DATE NOT NULL DEFAULT CURRENT_DATE,
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (2, "tables formerly created on first use", [
+        """
+        CREATE TABLE IF NOT EXISTS agent_qtables (
+            user_id INTEGER PRIMARY KEY,
+            q_table BYTEA NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Per user, day and task category: how many stress readings were
+        # logged and their sum/min/max, kept current on every write so trends
+        # are read in O(days) instead of scanning mood_tracking. Readings
+        # without a task use the category ''.
+        """
+        CREATE TABLE IF NOT EXISTS mood_rollups (
+            user_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            category TEXT NOT NULL DEFAULT '',
+            entries INTEGER NOT NULL,
+            stress_sum BIGINT NOT NULL,
+            stress_min INTEGER NOT NULL,
+            stress_max INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day, category)
+        )
+        """,
+        # Every write to scheduled_tasks bumps the user's row here. `version`
+        # backs the ETag of GET /schedule; `fingerprint` identifies the
+        # planner inputs of the stored schedule and is cleared by writes that
+        # did not come from a full plan (batch runs, patches).
+        """
+        CREATE TABLE IF NOT EXISTS schedule_fingerprints (
+            user_id INTEGER PRIMARY KEY,
+            fingerprint TEXT,
+            unscheduled INTEGER[] NOT NULL DEFAULT '{}',
+            version BIGINT NOT NULL DEFAULT 1,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (3, "indexes for the hot queries", [
+        # db.fetch_tasks / fetch_tasks_bulk / fetch_fixed_tasks: active tasks
+        # of a user, already in planning order
+        Index("tasks_active_plan_order", """
+            tasks (user_id, fixed_time DESC, deadline ASC, priority DESC)
+            WHERE archived = false
+        """),
+        # db_async.fetch_tasks_page: keyset pages of active tasks
+        Index("tasks_active_by_id", "tasks (user_id, id) WHERE archived = false"),
+        # db_async.fetch_archived_count
+        Index("tasks_archived", "tasks (user_id) WHERE archived = true"),
+        # Reads and rewrites of a user's schedule, ordered by start; covering
+        # so the rows come straight from the index
+        Index("scheduled_tasks_user_start", "scheduled_tasks (user_id, start_time) INCLUDE (task_id, end_time, type)"),
+        # db_async.fetch_moods_for_task (covering)
+        Index("mood_tracking_task", "mood_tracking (task_id) INCLUDE (stress_level, date, timestamp)"),
+        # db_async.fetch_moods_page: a user's entries newest first
+        Index("mood_tracking_user_id", "mood_tracking (user_id, id)"),
+        # /login looks users up by username OR email (a BitmapOr of both).
+        # Not unique: the base schema never enforced it and older databases
+        # may hold duplicates.
+        Index("users_username", "users (username)"),
+        Index("users_email", "users (email)"),
+    ]),
+    (4, "plan options of the stored schedule", [
+        # Solver and horizon of the last full plan; patches keep them, so a
+        # patch that cannot be applied replans the way the user planned
+        "ALTER TABLE schedule_fingerprints ADD COLUMN IF NOT EXISTS solver TEXT",
+        "ALTER TABLE schedule_fingerprints ADD COLUMN IF NOT EXISTS horizon_days INTEGER",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def _applied(cur):
+    cur.execute(SCHEMA_MIGRATIONS_DDL)
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row["version"] for row in cur.fetchall()}
+
+def _build_index(cur, index):
+    # A failed concurrent build leaves an INVALID index that IF NOT EXISTS
+    # would keep; drop it so the build is retried
+    cur.execute("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid
+    """, (index.name,))
+    if cur.fetchone() is not None:
+        cur.execute("DROP INDEX CONCURRENTLY IF EXISTS %s" % index.name)
+    cur.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s" % (index.name, index.definition))
+
+def _apply(cur, version, name, statements):
+    if all(isinstance(statement, Index) for statement in statements):
+        for index in statements:
+            _build_index(cur, index)
+        cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        return
+    cur.execute("BEGIN")
+    try:
+        for statement in statements:
+            cur.execute(statement)
+        cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    cur.execute("COMMIT")
+
+def migrate(target=LATEST_VERSION):
+    """Apply every pending migration up to `target`; returns the versions applied."""
+    applied_now = []
+    # Its own autocommit connection: concurrent index builds need one, and
+    # the session lock must not outlive the run on a pooled connection
+    conn = get_connection()
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_lock(%s, 0)", (MIGRATION_LOCK_NAMESPACE,))
+        applied = _applied(cur)
+        for version, name, statements in MIGRATIONS:
+            if version in applied or version > target:
+                continue
+            _apply(cur, version, name, statements)
+            applied_now.append(version)
+    finally:
+        # Closing the session releases the advisory lock
+        conn.close()
+    return applied_now
+
+def status():
+    """[(version, name, applied)] for every known migration."""
+    with db_connection() as conn:
+        applied = _applied(conn.cursor())
+    return [(version, name, version in applied) for version, name, _ in MIGRATIONS]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--status", action="store_true", help="list migrations without applying them")
+    parser.add_argument("--target", type=int, default=LATEST_VERSION, help="apply up to this version")
+    args = parser.parse_args()
+
+    if args.status:
+        for version, name, applied in status():
+            print("%4d  %-8s %s" % (version, "applied" if applied else "pending", name))
+    else:
+        applied = migrate(args.target)
+        print("Applied %s" % ", ".join(map(str, applied)) if applied else "Schema is up to date")
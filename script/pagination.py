@@ -0,0 +1,64 @@
+import base64
+import binascii
+import csv
+import io
+import json
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Rows fetched per round trip by server-side cursors when streaming
+STREAM_PREFETCH = 500
+
+def encode_cursor(last_id):
+    """Opaque cursor pointing just past the row with id `last_id`."""
+    raw = json.dumps({"id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """The last id of the previous page, or None for the first page."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        last_id = json.loads(raw)["id"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(last_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return last_id
+
+def page(rows, limit):
+    """
+    Split the limit + 1 rows of a keyset query into (rows, next_cursor);
+    next_cursor is None on the last page.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1]["id"])
+
+def ndjson_response(rows):
+    """Stream an async iterable of rows as newline-delimited JSON."""
+    async def lines():
+        async for row in rows:
+            yield json.dumps(jsonable_encoder(row)) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def csv_response(rows, columns, filename=None):
+    """Stream an async iterable of rows as CSV with a header of `columns`; None becomes an empty field."""
+    def encode(values):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerow(values)
+        return buffer.getvalue()
+
+    async def lines():
+        yield encode(columns)
+        async for row in rows:
+            row = jsonable_encoder(row)
+            yield encode(["" if row.get(c) is None else row[c] for c in columns])
+    headers = {"Content-Disposition": 'attachment; filename="%s"' % filename} if filename else None
+    return StreamingResponse(lines(), media_type="text/csv", headers=headers)
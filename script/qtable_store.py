@@ -0,0 +1,223 @@
+import atexit
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from db import db_connection
+
+logger = logging.getLogger(__name__)
+
+QTABLE_BACKEND = os.environ.get("FIKA_QTABLE_BACKEND", "disk")  # "disk" or "postgres"
+QTABLE_DIR = os.environ.get(
+    "FIKA_QTABLE_DIR", os.path.join(os.path.expanduser("~"), ".fika", "qtables")
+)
+QTABLE_CACHE_BYTES = int(os.environ.get("FIKA_QTABLE_CACHE_BYTES", str(32 * 1024 * 1024)))
+# Q-table trained offline on every user's history (train_offline.py); users
+# without a table of their own start from it. The API only ever reads it.
+TRAINED_QTABLE_PATH = os.environ.get(
+    "FIKA_TRAINED_QTABLE", os.path.join(os.path.expanduser("~"), ".fika", "trained_qtable.npz")
+)
+
+def _write_atomic(path, blob):
+    """Write through a temp file in the same directory and an atomic rename."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+# ----------- BACKENDS -----------
+
+class DiskBackend:
+    """One file per user; writes go through a temp file and an atomic rename."""
+
+    def __init__(self, directory=QTABLE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, user_id):
+        return os.path.join(self.directory, "%s.npz" % user_id)
+
+    def load(self, user_id):
+        try:
+            with open(self._path(user_id), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def save(self, user_id, blob):
+        _write_atomic(self._path(user_id), blob)
+
+class PostgresBackend:
+    """Stores blobs in the agent_qtables table (see migrations.py)."""
+
+    def load(self, user_id):
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT q_table FROM agent_qtables WHERE user_id = %s", (user_id,))
+            row = cur.fetchone()
+        return bytes(row["q_table"]) if row else None
+
+    def save(self, user_id, blob):
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO agent_qtables (user_id, q_table, updated_at)
+                VALUES (%s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    q_table = EXCLUDED.q_table,
+                    updated_at = EXCLUDED.updated_at
+            """, (user_id, blob))
+
+# ----------- CACHED STORE -----------
+
+class QTableStore:
+    """
+    Per-user Q-table blobs behind an in-process LRU cache bounded by total
+    size in bytes. put() updates the cache immediately and hands the write to
+    a background thread, which coalesces repeated updates for the same user.
+    """
+
+    def __init__(self, backend, max_bytes=QTABLE_CACHE_BYTES):
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self._cache = OrderedDict()  # user_id -> blob, least recently used first
+        self._cache_bytes = 0
+        self._pending = {}  # user_id -> blob awaiting write-back
+        self._writing = 0
+        self._lock = threading.Condition()
+        self._closed = False
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "writes": 0, "write_errors": 0}
+        self._writer = threading.Thread(target=self._write_loop, name="qtable-writer", daemon=True)
+        self._writer.start()
+
+    def _cache_put(self, user_id, blob):
+        old = self._cache.pop(user_id, None)
+        if old is not None:
+            self._cache_bytes -= len(old)
+        if len(blob) > self.max_bytes:
+            return
+        self._cache[user_id] = blob
+        self._cache_bytes += len(blob)
+        while self._cache_bytes > self.max_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= len(evicted)
+            self._stats["evictions"] += 1
+
+    def get(self, user_id):
+        with self._lock:
+            blob = self._cache.get(user_id)
+            if blob is not None:
+                self._cache.move_to_end(user_id)
+                self._stats["hits"] += 1
+                return blob
+            # A pending write is newer than whatever the backend holds
+            blob = self._pending.get(user_id)
+            if blob is not None:
+                self._stats["hits"] += 1
+                return blob
+            self._stats["misses"] += 1
+        blob = self.backend.load(user_id)
+        if blob is not None:
+            with self._lock:
+                if user_id not in self._cache and user_id not in self._pending:
+                    self._cache_put(user_id, blob)
+        return blob
+
+    def put(self, user_id, blob):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Q-table store is closed")
+            self._cache_put(user_id, blob)
+            self._pending[user_id] = blob
+            self._lock.notify_all()
+
+    def _write_loop(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._lock.wait()
+                if not self._pending and self._closed:
+                    return
+                batch, self._pending = self._pending, {}
+                self._writing = len(batch)
+            for user_id, blob in batch.items():
+                try:
+                    self.backend.save(user_id, blob)
+                    ok = True
+                except Exception:
+                    logger.exception("Failed to persist Q-table for user %s", user_id)
+                    ok = False
+                with self._lock:
+                    self._stats["writes" if ok else "write_errors"] += 1
+            with self._lock:
+                self._writing = 0
+                self._lock.notify_all()
+
+    def flush(self, timeout=None):
+        """Block until every queued write has been attempted."""
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._pending and not self._writing, timeout)
+
+    def close(self, timeout=10):
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        self._writer.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached": len(self._cache),
+                "cache_bytes": self._cache_bytes,
+                "max_bytes": self.max_bytes,
+                "pending_writes": len(self._pending),
+                **self._stats,
+            }
+
+_store = None
+_store_lock = threading.Lock()
+
+def _make_backend():
+    if QTABLE_BACKEND == "postgres":
+        return PostgresBackend()
+    if QTABLE_BACKEND == "disk":
+        return DiskBackend()
+    raise ValueError("Unknown FIKA_QTABLE_BACKEND: %r" % QTABLE_BACKEND)
+
+def get_qtable_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = QTableStore(_make_backend())
+                atexit.register(_store.close)
+    return _store
+
+# ----------- TRAINED TABLE -----------
+
+_trained = (None, None, None)  # (path, mtime, blob)
+_trained_lock = threading.Lock()
+
+def get_trained_qtable(path=TRAINED_QTABLE_PATH):
+    """The offline-trained blob, or None when there is none; re-read only after the file changes."""
+    global _trained
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _trained_lock:
+        if _trained[:2] != (path, mtime):
+            with open(path, "rb") as f:
+                _trained = (path, mtime, f.read())
+        return _trained[2]
+
+def save_trained_qtable(blob, path=TRAINED_QTABLE_PATH):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write_atomic(path, blob)
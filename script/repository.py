@@ -0,0 +1,561 @@
+import abc
+import asyncio
+import os
+import threading
+
+# Storage behind the API and the scheduler: "postgres" (db.py / db_async.py)
+# or "sqlite" (sqlite_repository.py, embedded; FIKA_SQLITE_PATH=":memory:"
+# keeps everything in process).
+STORAGE_BACKEND = os.environ.get("FIKA_STORAGE_BACKEND", "postgres")
+SQLITE_PATH = os.environ.get("FIKA_SQLITE_PATH", ":memory:")
+
+class Repository(abc.ABC):
+    """
+    Data access for users, tasks, scheduled_tasks and mood_tracking.
+
+    Plain methods are blocking; the scheduler, batch jobs and sync routes use
+    them. Methods prefixed with `a` are coroutines for the async routes; by
+    default they run the blocking method in a worker thread, and backends
+    with a native async driver override them. Rows are dicts. Every
+    blocking method without a default is abstract, so a backend that misses
+    one fails when it is instantiated.
+    """
+
+    # ----------- USERS -----------
+
+    @abc.abstractmethod
+    def fetch_all_user_ids(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def user_exists(self, user_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def find_user_conflict(self, email, username):
+        """"email" or "username" if either is already registered, else None."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def insert_user(self, values):
+        """Create a user from a subset of db.USER_COLUMNS; returns db.PUBLIC_USER_COLUMNS."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update_user_settings(self, user_id, values):
+        """Update db.USER_SETTINGS_COLUMNS of a user; False if there is no such user."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def save_user_preferences(self, values):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_login_user(self, username_or_email):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update_password(self, user_id, hashed_password):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_user_prefs(self, user_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_user_prefs_bulk(self, user_ids):
+        raise NotImplementedError
+
+    def prefs_cache_stats(self):
+        return None
+
+    # ----------- TASKS -----------
+
+    @abc.abstractmethod
+    def fetch_tasks(self, user_id):
+        """Active tasks of a user in planning order."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_tasks_bulk(self, user_ids):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_tasks_page(self, user_id, after_id, limit):
+        """Up to `limit` active tasks of a user in id order, after id `after_id`."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_task(self, task_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_fixed_tasks(self, user_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def insert_task(self, user_id, values):
+        """`values` maps db_async.TASK_COLUMNS to values; returns the new row."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def insert_tasks(self, user_id, rows):
+        """Insert many insert_task value dicts in one transaction; returns the number inserted."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update_task(self, task_id, values):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_task(self, task_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_archived_count(self, user_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_task_export_page(self, user_id, after_id, limit):
+        """Like fetch_tasks_page, but archived tasks included and with every db_async.TASK_COLUMNS column."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def log_stress_entry(self, task_id, stress_entry):
+        raise NotImplementedError
+
+    # ----------- SCHEDULED TASKS -----------
+
+    @abc.abstractmethod
+    def replace_schedule(self, user_id, schedule, fingerprint=None, unscheduled_ids=(), solver=None,
+                         horizon_days=None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def replace_schedules(self, schedules, fingerprints=None, unscheduled_ids=None, solver=None,
+                          horizon_days=None):
+        """
+        replace_schedule for many users in one transaction; `fingerprints`
+        and `unscheduled_ids` map user ids to the matching replace_schedule
+        argument, `solver` and `horizon_days` apply to every schedule.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def store_schedule(self, user_id, schedule):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def modify_schedule(self, user_id, patch):
+        """Read-modify-write under the schedule lock; see db.modify_schedule."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_memoized_schedule(self, user_id, fingerprint):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_schedule_plan(self, user_id):
+        """(solver, horizon_days) of the last full plan of the stored schedule, or None."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_schedule_version(self, user_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_schedule_with_version(self, user_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def stream_schedule_history(self, chunk_size=5000):
+        """
+        Lists of up to `chunk_size` scheduled_tasks rows in (user_id,
+        start_time) order, each with the task's deadline, priority and
+        task_stress, and the user's mean day_stress that day (see db.py).
+        """
+        raise NotImplementedError
+
+    # ----------- MOOD TRACKING -----------
+
+    @abc.abstractmethod
+    def insert_mood(self, user_id, task_id, stress_level, date):
+        """Log a mood entry and roll it up; None when `task_id` does not exist."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_moods_page(self, user_id, after_id, limit):
+        """Up to `limit` entries, newest first, older than id `after_id`."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_moods_for_task(self, task_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_daily_stress(self, user_id, since):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_category_stress(self, user_id, since):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_recent_stress(self, user_id):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch_recent_stress_bulk(self, user_ids):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def rebuild_mood_rollups(self):
+        raise NotImplementedError
+
+    # ----------- ASYNC -----------
+
+    async def auser_exists(self, user_id):
+        return await asyncio.to_thread(self.user_exists, user_id)
+
+    async def afind_user_conflict(self, email, username):
+        return await asyncio.to_thread(self.find_user_conflict, email, username)
+
+    async def ainsert_user(self, values):
+        return await asyncio.to_thread(self.insert_user, values)
+
+    async def afetch_login_user(self, username_or_email):
+        return await asyncio.to_thread(self.fetch_login_user, username_or_email)
+
+    async def aupdate_password(self, user_id, hashed_password):
+        return await asyncio.to_thread(self.update_password, user_id, hashed_password)
+
+    async def afetch_tasks(self, user_id):
+        return await asyncio.to_thread(self.fetch_tasks, user_id)
+
+    async def afetch_tasks_page(self, user_id, after_id, limit):
+        return await asyncio.to_thread(self.fetch_tasks_page, user_id, after_id, limit)
+
+    async def astream_tasks(self, user_id, after_id=None, prefetch=500):
+        """Every active task after `after_id`, fetched `prefetch` rows at a time."""
+        while True:
+            rows = await self.afetch_tasks_page(user_id, after_id, prefetch)
+            for row in rows:
+                yield row
+            if len(rows) < prefetch:
+                return
+            after_id = rows[-1]["id"]
+
+    async def afetch_task(self, task_id):
+        return await asyncio.to_thread(self.fetch_task, task_id)
+
+    async def afetch_fixed_tasks(self, user_id):
+        return await asyncio.to_thread(self.fetch_fixed_tasks, user_id)
+
+    async def ainsert_task(self, user_id, values):
+        return await asyncio.to_thread(self.insert_task, user_id, values)
+
+    async def ainsert_tasks(self, user_id, chunks):
+        """
+        Insert the value dicts of an async iterable of chunks (lists) in one
+        transaction. This default collects every chunk before writing; an
+        exception raised by the iterable means nothing is written.
+        """
+        rows = []
+        async for chunk in chunks:
+            rows.extend(chunk)
+        return await asyncio.to_thread(self.insert_tasks, user_id, rows)
+
+    async def aupdate_task(self, task_id, values):
+        return await asyncio.to_thread(self.update_task, task_id, values)
+
+    async def adelete_task(self, task_id):
+        return await asyncio.to_thread(self.delete_task, task_id)
+
+    async def afetch_archived_count(self, user_id):
+        return await asyncio.to_thread(self.fetch_archived_count, user_id)
+
+    async def astream_task_export(self, user_id, after_id=None, prefetch=500):
+        """Every task after `after_id` (see fetch_task_export_page), fetched `prefetch` rows at a time."""
+        while True:
+            rows = await asyncio.to_thread(self.fetch_task_export_page, user_id, after_id, prefetch)
+            for row in rows:
+                yield row
+            if len(rows) < prefetch:
+                return
+            after_id = rows[-1]["id"]
+
+    async def afetch_schedule_version(self, user_id):
+        return await asyncio.to_thread(self.fetch_schedule_version, user_id)
+
+    async def afetch_schedule_with_version(self, user_id):
+        return await asyncio.to_thread(self.fetch_schedule_with_version, user_id)
+
+    async def ainsert_mood(self, user_id, task_id, stress_level, date):
+        return await asyncio.to_thread(self.insert_mood, user_id, task_id, stress_level, date)
+
+    async def afetch_moods_page(self, user_id, after_id, limit):
+        return await asyncio.to_thread(self.fetch_moods_page, user_id, after_id, limit)
+
+    async def astream_moods(self, user_id=None, after_id=None, prefetch=500):
+        """Every mood entry older than `after_id`, fetched `prefetch` rows at a time."""
+        while True:
+            rows = await self.afetch_moods_page(user_id, after_id, prefetch)
+            for row in rows:
+                yield row
+            if len(rows) < prefetch:
+                return
+            after_id = rows[-1]["id"]
+
+    async def afetch_moods_for_task(self, task_id):
+        return await asyncio.to_thread(self.fetch_moods_for_task, task_id)
+
+    async def afetch_daily_stress(self, user_id, since):
+        return await asyncio.to_thread(self.fetch_daily_stress, user_id, since)
+
+    async def afetch_category_stress(self, user_id, since):
+        return await asyncio.to_thread(self.fetch_category_stress, user_id, since)
+
+    # ----------- LIFECYCLE -----------
+
+    def migrate(self):
+        """Bring the schema up to date; returns the migration versions applied."""
+        return []
+
+    def stats(self):
+        return {}
+
+    async def aclose(self):
+        pass
+
+class PostgresRepository(Repository):
+    """
+    Postgres through db.py (psycopg2 pool) for the blocking methods and
+    db_async.py (asyncpg pool) for the coroutines; every method of the
+    interface is implemented both ways.
+    """
+
+    def __init__(self):
+        import db
+        import db_async
+
+        self._db = db
+        self._async = db_async
+
+    def fetch_all_user_ids(self):
+        return self._db.fetch_all_user_ids()
+
+    def user_exists(self, user_id):
+        return self._db.user_exists(user_id)
+
+    def find_user_conflict(self, email, username):
+        return self._db.find_user_conflict(email, username)
+
+    def insert_user(self, values):
+        return self._db.insert_user(values)
+
+    def update_user_settings(self, user_id, values):
+        return self._db.update_user_settings(user_id, values)
+
+    def save_user_preferences(self, values):
+        return self._db.save_user_preferences(values)
+
+    def fetch_login_user(self, username_or_email):
+        return self._db.fetch_login_user(username_or_email)
+
+    def update_password(self, user_id, hashed_password):
+        return self._db.update_password(user_id, hashed_password)
+
+    def fetch_user_prefs(self, user_id):
+        return self._db.fetch_user_prefs(user_id)
+
+    def fetch_user_prefs_bulk(self, user_ids):
+        return self._db.fetch_user_prefs_bulk(user_ids)
+
+    def prefs_cache_stats(self):
+        return self._db.prefs_cache_stats()
+
+    def fetch_tasks(self, user_id):
+        return self._db.fetch_tasks(user_id)
+
+    def fetch_tasks_bulk(self, user_ids):
+        return self._db.fetch_tasks_bulk(user_ids)
+
+    def fetch_tasks_page(self, user_id, after_id, limit):
+        return self._db.fetch_tasks_page(user_id, after_id, limit)
+
+    def fetch_task(self, task_id):
+        return self._db.fetch_task(task_id)
+
+    def fetch_fixed_tasks(self, user_id):
+        return self._db.fetch_fixed_tasks(user_id)
+
+    def insert_task(self, user_id, values):
+        return self._db.insert_task(user_id, values)
+
+    def insert_tasks(self, user_id, rows):
+        return self._db.insert_tasks(user_id, rows)
+
+    def update_task(self, task_id, values):
+        return self._db.update_task(task_id, values)
+
+    def delete_task(self, task_id):
+        return self._db.delete_task(task_id)
+
+    def fetch_archived_count(self, user_id):
+        return self._db.fetch_archived_count(user_id)
+
+    def fetch_task_export_page(self, user_id, after_id, limit):
+        return self._db.fetch_task_export_page(user_id, after_id, limit)
+
+    def log_stress_entry(self, task_id, stress_entry):
+        return self._db.log_stress_entry(task_id, stress_entry)
+
+    def replace_schedule(self, user_id, schedule, fingerprint=None, unscheduled_ids=(), solver=None,
+                         horizon_days=None):
+        return self._db.replace_schedule(user_id, schedule, fingerprint, unscheduled_ids, solver, horizon_days)
+
+    def replace_schedules(self, schedules, fingerprints=None, unscheduled_ids=None, solver=None,
+                          horizon_days=None):
+        return self._db.replace_schedules(schedules, fingerprints, unscheduled_ids, solver, horizon_days)
+
+    def store_schedule(self, user_id, schedule):
+        return self._db.store_schedule(user_id, schedule)
+
+    def modify_schedule(self, user_id, patch):
+        return self._db.modify_schedule(user_id, patch)
+
+    def fetch_memoized_schedule(self, user_id, fingerprint):
+        return self._db.fetch_memoized_schedule(user_id, fingerprint)
+
+    def fetch_schedule_plan(self, user_id):
+        return self._db.fetch_schedule_plan(user_id)
+
+    def fetch_schedule_version(self, user_id):
+        return self._db.fetch_schedule_version(user_id)
+
+    def fetch_schedule_with_version(self, user_id):
+        return self._db.fetch_schedule_with_version(user_id)
+
+    def stream_schedule_history(self, chunk_size=5000):
+        return self._db.stream_schedule_history(chunk_size)
+
+    def insert_mood(self, user_id, task_id, stress_level, date):
+        return self._db.insert_mood(user_id, task_id, stress_level, date)
+
+    def fetch_moods_page(self, user_id, after_id, limit):
+        return self._db.fetch_moods_page(user_id, after_id, limit)
+
+    def fetch_moods_for_task(self, task_id):
+        return self._db.fetch_moods_for_task(task_id)
+
+    def fetch_daily_stress(self, user_id, since):
+        return self._db.fetch_daily_stress(user_id, since)
+
+    def fetch_category_stress(self, user_id, since):
+        return self._db.fetch_category_stress(user_id, since)
+
+    def fetch_recent_stress(self, user_id):
+        return self._db.fetch_recent_stress(user_id)
+
+    def fetch_recent_stress_bulk(self, user_ids):
+        return self._db.fetch_recent_stress_bulk(user_ids)
+
+    def rebuild_mood_rollups(self):
+        return self._db.rebuild_mood_rollups()
+
+    async def auser_exists(self, user_id):
+        return await self._async.user_exists(user_id)
+
+    async def afetch_login_user(self, username_or_email):
+        return await self._async.fetch_login_user(username_or_email)
+
+    async def aupdate_password(self, user_id, hashed_password):
+        return await self._async.update_password(user_id, hashed_password)
+
+    async def afetch_tasks(self, user_id):
+        return await self._async.fetch_tasks(user_id)
+
+    async def afetch_tasks_page(self, user_id, after_id, limit):
+        return await self._async.fetch_tasks_page(user_id, after_id, limit)
+
+    def astream_tasks(self, user_id, after_id=None, prefetch=500):
+        # Server-side cursor rather than repeated pages
+        return self._async.stream_tasks(user_id, after_id, prefetch=prefetch)
+
+    async def afetch_task(self, task_id):
+        return await self._async.fetch_task(task_id)
+
+    async def afetch_fixed_tasks(self, user_id):
+        return await self._async.fetch_fixed_tasks(user_id)
+
+    async def ainsert_task(self, user_id, values):
+        return await self._async.insert_task(user_id, values)
+
+    async def ainsert_tasks(self, user_id, chunks):
+        # COPY chunk by chunk as they arrive
+        return await self._async.insert_tasks(user_id, chunks)
+
+    async def aupdate_task(self, task_id, values):
+        return await self._async.update_task(task_id, values)
+
+    async def adelete_task(self, task_id):
+        return await self._async.delete_task(task_id)
+
+    async def afetch_archived_count(self, user_id):
+        return await self._async.fetch_archived_count(user_id)
+
+    def astream_task_export(self, user_id, after_id=None, prefetch=500):
+        return self._async.stream_task_export(user_id, after_id, prefetch=prefetch)
+
+    async def afetch_schedule_version(self, user_id):
+        return await self._async.fetch_schedule_version(user_id)
+
+    async def afetch_schedule_with_version(self, user_id):
+        return await self._async.fetch_schedule_with_version(user_id)
+
+    async def ainsert_mood(self, user_id, task_id, stress_level, date):
+        return await self._async.insert_mood(user_id, task_id, stress_level, date)
+
+    async def afetch_moods_page(self, user_id, after_id, limit):
+        return await self._async.fetch_moods_page(user_id, after_id, limit)
+
+    def astream_moods(self, user_id=None, after_id=None, prefetch=500):
+        return self._async.stream_moods(user_id, after_id, prefetch=prefetch)
+
+    async def afetch_moods_for_task(self, task_id):
+        return await self._async.fetch_moods_for_task(task_id)
+
+    async def afetch_daily_stress(self, user_id, since):
+        return await self._async.fetch_daily_stress(user_id, since)
+
+    async def afetch_category_stress(self, user_id, since):
+        return await self._async.fetch_category_stress(user_id, since)
+
+    def migrate(self):
+        from migrations import migrate
+        return migrate()
+
+    def stats(self):
+        return {"pool": self._db.pool_stats(), "async_pool": self._async.async_pool_stats()}
+
+    async def aclose(self):
+        self._db.close_pool()
+        await self._async.close_async_pool()
+
+_repository = None
+_repository_lock = threading.Lock()
+
+def get_repository():
+    """The process-wide repository for STORAGE_BACKEND."""
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                if STORAGE_BACKEND == "postgres":
+                    _repository = PostgresRepository()
+                elif STORAGE_BACKEND == "sqlite":
+                    from sqlite_repository import SQLiteRepository
+                    _repository = SQLiteRepository(SQLITE_PATH)
+                else:
+                    raise ValueError("Unknown FIKA_STORAGE_BACKEND: %r" % STORAGE_BACKEND)
+    return _repository
@@ -0,0 +1,134 @@
+import datetime
+
+from repository import get_repository
+from entries import ScheduleEntry, FIXED, FLEXIBLE, BREAK, to_minutes, from_minutes
+from intervals import IntervalIndex
+from scheduler import (
+    generate_schedule, day_windows, fixed_task_interval, _with_task_names, MAX_HORIZON_DAYS,
+)
+
+class RescheduleInfeasible(Exception):
+    pass
+
+class _NothingToPatch(Exception):
+    pass
+
+def _busy_index(schedule):
+    return IntervalIndex((e.start, e.end, i) for i, e in enumerate(schedule))
+
+def _by_start(schedule):
+    return sorted(schedule, key=lambda e: e.start)
+
+def _horizon_days(schedule, now):
+    last = from_minutes(max(e.end for e in schedule)).date()
+    return min(max((last - now.date()).days + 1, 1), MAX_HORIZON_DAYS)
+
+def _window_end(windows, moment):
+    for window_start, window_end in windows:
+        if window_start <= moment < window_end:
+            return window_end
+    return moment
+
+def _place(busy, duration, windows, now):
+    for window_start, window_end in windows:
+        start = busy.next_fit(duration, max(window_start, now), window_end)
+        if start is not None:
+            return start
+    raise RescheduleInfeasible("No free %d-minute slot left in the planned horizon" % duration)
+
+def remove_task_entries(schedule, task_id, windows, now, compact=True):
+    """
+    Drop the entries of `task_id` together with the break that directly
+    followed each one. With `compact`, later flexible entries and breaks in
+    the same gap (up to the next fixed block or the end of the day) are
+    pulled forward into the freed time; past entries never move.
+    Times (windows, now) are epoch minutes like the entries.
+    """
+    result = list(schedule)
+    for removed in [e for e in schedule if e.task_id == task_id]:
+        i = result.index(removed)
+        del result[i]
+        if i < len(result) and result[i].kind == BREAK and result[i].start == removed.end:
+            del result[i]
+        if not compact:
+            continue
+        cursor = max(removed.start, now)
+        window_end = _window_end(windows, removed.start)
+        while i < len(result):
+            entry = result[i]
+            if entry.kind == FIXED or entry.start >= window_end:
+                break
+            if entry.start > cursor:
+                result[i] = entry.moved_to(cursor)
+            cursor = max(cursor, result[i].end)
+            i += 1
+    return result
+
+def insert_task_entries(schedule, task, windows, now):
+    """
+    Add `task` to the schedule. A flexible task takes the earliest free slot
+    from now on; a fixed task takes its own time and only the flexible
+    entries it overlaps are moved (breaks it overlaps are dropped).
+    """
+    if not task.get("fixed_time"):
+        duration = task.get("estimated_time") or 30
+        start = _place(_busy_index(schedule), duration, windows, now)
+        entry = ScheduleEntry(task["id"], task["name"], start, start + duration, FLEXIBLE)
+        return _by_start(schedule + [entry])
+
+    if task.get("start_time") is None:
+        raise RescheduleInfeasible("Fixed task has no start time")
+    start, end = (to_minutes(t) for t in fixed_task_interval(task))
+    if end <= windows[0][0] or start >= windows[-1][1]:
+        return schedule  # outside the planned horizon
+    overlapping = [e for e in schedule if e.start < end and e.end > start]
+    if any(e.kind == FIXED for e in overlapping):
+        raise RescheduleInfeasible("Fixed task overlaps another fixed block")
+    kept = [e for e in schedule if e not in overlapping]
+    kept.append(ScheduleEntry(task["id"], task["name"], start, end, FIXED))
+    busy = _busy_index(kept)
+    for entry in overlapping:
+        if entry.kind != FLEXIBLE:
+            continue
+        moved = entry.moved_to(_place(busy, entry.duration, windows, now))
+        busy.add(moved.start, moved.end, len(kept))
+        kept.append(moved)
+    return _by_start(kept)
+
+def reschedule_task_change(user_id, task_id, task=None, now=None):
+    """
+    Patch the stored schedule after `task_id` was created or updated (`task`
+    is the new row) or deleted (`task` is None). Falls back to a full
+    regeneration with the solver and horizon of the user's last full plan
+    when the patch cannot be applied.
+
+    Returns (mode, ScheduleEntry list) with mode "patched", "regenerated" or "skipped"
+    (the user has no stored schedule to patch).
+    """
+    now = now or datetime.datetime.now()
+    now_minutes = to_minutes(now)
+    repo = get_repository()
+    user_prefs = repo.fetch_user_prefs(user_id)
+
+    def patch(schedule):
+        if not schedule:
+            raise _NothingToPatch()
+        horizon_days = _horizon_days(schedule, now)
+        windows = [
+            (to_minutes(start), to_minutes(end))
+            for start, end in day_windows(user_prefs, now.date(), horizon_days)
+        ]
+        if task is None or task.get("archived"):
+            return remove_task_entries(schedule, task_id, windows, now_minutes, compact=True)
+        schedule = remove_task_entries(schedule, task_id, windows, now_minutes, compact=False)
+        return insert_task_entries(schedule, task, windows, now_minutes)
+
+    try:
+        schedule = repo.modify_schedule(user_id, patch)
+    except _NothingToPatch:
+        return "skipped", []
+    except RescheduleInfeasible:
+        solver, horizon_days = repo.fetch_schedule_plan(user_id) or ("rl", 1)
+        schedule, _ = generate_schedule(user_id, horizon_days=horizon_days, solver=solver)
+        return "regenerated", schedule
+    return "patched", _with_task_names(schedule, repo.fetch_tasks(user_id))
@@ -1,9 +1,59 @@
+import ast
+import io
+import logging
+
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
+# Version tag stored alongside serialized Q-tables
+Q_TABLE_FORMAT = 2
+
+# State encoding: (remaining_tasks, hour, stress, style) packed into one int.
+# remaining_tasks is the outermost factor so it needs no upper bound.
+HOURS = 24
+STRESS_LEVELS = 12  # 0-10, plus 11 for "unknown"
+STYLES = 2
+UNKNOWN_STRESS = STRESS_LEVELS - 1
+
+BREAK_COLUMN = 0  # task action i lives in column i + 1
+
+def encode_state(state):
+    stress = state["stress"]
+    stress = UNKNOWN_STRESS if stress is None else min(max(int(round(stress)), 0), 10)
+    return ((state["remaining_tasks"] * HOURS + state["hour"]) * STRESS_LEVELS + stress) * STYLES + state["style"]
+
+def decode_state(code):
+    code, style = divmod(int(code), STYLES)
+    code, stress = divmod(code, STRESS_LEVELS)
+    remaining_tasks, hour = divmod(code, HOURS)
+    return {
+        "hour": hour,
+        "remaining_tasks": remaining_tasks,
+        "stress": None if stress == UNKNOWN_STRESS else stress,
+        "style": style,
+    }
+
+def _max_values(values):
+    """Row-wise max of 2-D Q-values ignoring NaN; 0 for rows with no value (terminal or unseen states)."""
+    unset = np.isnan(values)
+    return np.where(unset.all(axis=1), 0.0, np.where(unset, -np.inf, values).max(axis=1))
+
+def action_column(action):
+    if action == "break":
+        return BREAK_COLUMN
+    return int(action) + 1
+
 class SchedulerAgent:
     def __init__(self, action_space):
-        self.q_table = {}  # for basic Q-learning
+        # Q-values live in a 2-D array: one row per visited state, one column
+        # per action. NaN marks an action never initialised for that state.
         self.action_space = action_space
+        self._action_cols = np.array([action_column(a) for a in action_space], dtype=np.intp)
+        self._row_of = {}  # encoded state -> row
+        self._states = np.empty(0, dtype=np.int64)
+        self._q = np.full((0, int(self._action_cols.max(initial=0)) + 1), np.nan)
+        self._n_rows = 0
         self.learning_rate = 0.1
         self.discount_factor = 0.95
         self.epsilon = 0.1
@@ -11,42 +61,169 @@ class SchedulerAgent:
         # Track overall performance for logging (optional)
         self.schedule_rewards = []
 
+    def set_action_space(self, action_space):
+        """Narrow or widen the actions considered from now on (e.g. as tasks are placed)."""
+        self.action_space = action_space
+        self._action_cols = np.array([action_column(a) for a in action_space], dtype=np.intp)
+        self._ensure_columns(int(self._action_cols.max(initial=0)) + 1)
+
+    @property
+    def num_states(self):
+        return self._n_rows
+
     def get_state_key(self, state):
-        return str(state)
+        return encode_state(state)
+
+    def _ensure_columns(self, n_cols):
+        if n_cols > self._q.shape[1]:
+            pad = np.full((self._q.shape[0], n_cols - self._q.shape[1]), np.nan)
+            self._q = np.hstack([self._q, pad])
+
+    def _grow(self, n_rows):
+        if n_rows <= self._q.shape[0]:
+            return
+        capacity = max(n_rows, 2 * self._q.shape[0], 64)
+        q = np.full((capacity, self._q.shape[1]), np.nan)
+        q[:self._n_rows] = self._q[:self._n_rows]
+        states = np.empty(capacity, dtype=np.int64)
+        states[:self._n_rows] = self._states[:self._n_rows]
+        self._q, self._states = q, states
+
+    def _row(self, key):
+        row = self._row_of.get(key)
+        if row is None:
+            row = self._n_rows
+            self._grow(row + 1)
+            self._q[row, self._action_cols] = 0.0
+            self._states[row] = key
+            self._row_of[key] = row
+            self._n_rows += 1
+        return row
+
+    def _rows(self, keys):
+        return np.fromiter((self._row(int(k)) for k in keys), dtype=np.intp, count=len(keys))
 
     def select_action(self, state):
-        key = self.get_state_key(state)
-        if key not in self.q_table or np.random.rand() < self.epsilon:
+        row = self._row_of.get(self.get_state_key(state))
+        if row is None or np.random.rand() < self.epsilon:
+            return np.random.choice(self.action_space)
+        # A persisted table may hold actions from a larger action space than
+        # this episode's, so only consider the ones that are valid now.
+        values = self._q[row, self._action_cols]
+        if np.isnan(values).all():
             return np.random.choice(self.action_space)
-        return max(self.q_table[key], key=self.q_table[key].get)
+        return self.action_space[int(np.nanargmax(values))]
+
+    def best_actions(self, states):
+        """
+        Greedy action index (into action_space) for each encoded state, or -1
+        where the state has never been seen.
+        """
+        rows = np.array([self._row_of.get(int(k), -1) for k in states], dtype=np.intp)
+        best = np.full(len(rows), -1, dtype=np.intp)
+        known = rows >= 0
+        if known.any():
+            values = self._q[rows[known][:, None], self._action_cols]
+            values = np.where(np.isnan(values), -np.inf, values)
+            found = np.isfinite(values).any(axis=1)
+            idx = np.flatnonzero(known)[found]
+            best[idx] = values[found].argmax(axis=1)
+        return best
 
     def update(self, state, action, reward, next_state):
         if state is None and action is None:
             # Final full-schedule reward
             self.schedule_rewards.append(reward)
-            print(f"[Final Schedule Reward]: {reward:.2f}")
+            logger.debug("Final schedule reward: %.2f", reward)
             return
 
-        key = self.get_state_key(state)
-        next_key = self.get_state_key(next_state)
+        # Initialize Q-table rows if they don't exist
+        row = self._row(self.get_state_key(state))
+        next_row = self._row(self.get_state_key(next_state))
+
+        col = action_column(action)
+        self._ensure_columns(col + 1)
+        old_value = self._q[row, col]
+        if np.isnan(old_value):
+            old_value = 0.0
+        next_max = float(_max_values(self._q[next_row:next_row + 1])[0])
+
+        new_value = (1 - self.learning_rate) * float(old_value) + self.learning_rate * (
+            reward + self.discount_factor * next_max
+        )
+        self._q[row, col] = new_value
 
-        # Initialize Q-table entries if they don't exist
-        if key not in self.q_table:
-            self.q_table[key] = {str(a): 0.0 for a in self.action_space}
-        if next_key not in self.q_table:
-            self.q_table[next_key] = {str(a): 0.0 for a in self.action_space}
+    def batch_update(self, states, actions, rewards, next_states):
+        """
+        Apply many Q-learning updates at once from encoded states, action
+        columns (see action_column), rewards and encoded next states.
 
-        # Convert action to string to ensure consistent key type
-        action_key = str(action)
-        
-        # Ensure the action exists in the Q-table
-        if action_key not in self.q_table[key]:
-            self.q_table[key][action_key] = 0.0
+        Repeated updates of one (state, action) cell are folded in batch
+        order, exactly as calling update() for each would. Unlike sequential
+        update() calls, every next-state value is read from the table as it
+        was before the batch, so an update does not see earlier ones in the
+        same batch through next_max; batches where no next state is also an
+        updated state learn exactly what sequential updates would.
+        """
+        cols = np.asarray(actions, dtype=np.intp)
+        rewards = np.asarray(rewards, dtype=float)
+        if cols.size == 0:
+            return
+        rows = self._rows(states)
+        next_rows = self._rows(next_states)
+        self._ensure_columns(int(cols.max()) + 1)
+        targets = rewards + self.discount_factor * _max_values(self._q[next_rows])
 
-        old_value = self.q_table[key][action_key]
-        next_max = max(self.q_table[next_key].values())
+        # Group the updates by cell, keeping batch order within each group.
+        # Folding v <- (1 - a) v + a t over a group's targets t_0..t_n-1 gives
+        # (1 - a)^n v + sum_k a (1 - a)^(n - 1 - k) t_k
+        flat = rows * self._q.shape[1] + cols
+        order = np.argsort(flat, kind="stable")
+        cells, starts, counts = np.unique(flat[order], return_index=True, return_counts=True)
+        remaining = np.repeat(starts + counts, counts) - 1 - np.arange(len(order))
+        keep = 1 - self.learning_rate
+        folded = np.add.reduceat(self.learning_rate * keep ** remaining * targets[order], starts)
+        cell_rows, cell_cols = np.divmod(cells, self._q.shape[1])
+        old_values = np.nan_to_num(self._q[cell_rows, cell_cols], nan=0.0)
+        self._q[cell_rows, cell_cols] = keep ** counts * old_values + folded
 
-        new_value = (1 - self.learning_rate) * old_value + self.learning_rate * (
-            reward + self.discount_factor * next_max
+    def dump_q_table(self):
+        """Serialize the Q-table into a compact, compressed binary blob."""
+        buf = io.BytesIO()
+        np.savez_compressed(
+            buf,
+            version=np.array(Q_TABLE_FORMAT),
+            states=self._states[:self._n_rows],
+            values=self._q[:self._n_rows],
         )
-        self.q_table[key][action_key] = new_value
+        return buf.getvalue()
+
+    def load_q_table(self, blob):
+        """Replace the Q-table with one produced by dump_q_table (no-op for None)."""
+        if not blob:
+            return
+        with np.load(io.BytesIO(blob), allow_pickle=False) as data:
+            version = int(data["version"])
+            if version == 1:
+                states, values = _convert_v1(data)
+            elif version == Q_TABLE_FORMAT:
+                states, values = data["states"].astype(np.int64), data["values"]
+            else:
+                raise ValueError("Unsupported Q-table format: %s" % version)
+        self._q = np.full((0, max(values.shape[1], self._q.shape[1])), np.nan)
+        self._states = np.empty(0, dtype=np.int64)
+        self._n_rows = 0
+        self._grow(len(states))
+        self._q[:len(states), :values.shape[1]] = values
+        self._states[:len(states)] = states
+        self._n_rows = len(states)
+        self._row_of = {int(k): i for i, k in enumerate(states)}
+
+def _convert_v1(data):
+    """Format 1 keyed states by str(state) and actions by str(action)."""
+    cols = [action_column(a) for a in data["actions"]]
+    values = np.full((len(data["states"]), max(cols, default=0) + 1), np.nan)
+    if cols:
+        values[:, cols] = data["values"]
+    states = np.array([encode_state(ast.literal_eval(str(k))) for k in data["states"]], dtype=np.int64)
+    return states, values
@@ -1,23 +1,250 @@
-from datetime import datetime, timedelta
-import pandas as pd
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
 import datetime
 
-from helpers import evaluate_schedule
+from entries import ScheduleEntry, FIXED, FLEXIBLE, BREAK, PRIORITY_SCORES, to_minutes, schedule_to_json
+from intervals import IntervalIndex
 
-from rl_agent import SchedulerAgent
-from db import fetch_user_prefs, fetch_tasks, store_schedule
+import metrics
+from metrics import (
+    SCHEDULE_PHASE_SECONDS, SCHEDULE_MEMO, SCHEDULE_ROLLOUT_SECONDS, SCHEDULE_ROLLOUTS, AGENT_Q_TABLE_STATES,
+    AGENT_EPSILON, AGENT_FINAL_REWARD,
+)
+from repository import get_repository
+from qtable_store import get_qtable_store, get_trained_qtable
+
+MAX_HORIZON_DAYS = 14
+# Wall-clock budget for placing flexible tasks; anything left is unscheduled
+PLAN_TIME_BUDGET = float(os.environ.get("FIKA_PLAN_TIME_BUDGET", "2.0"))
+
+# RL rollouts per plan: the best-scoring one within PLAN_TIME_BUDGET is kept
+PLAN_ROLLOUTS = int(os.environ.get("FIKA_PLAN_ROLLOUTS", "1"))
+MAX_ROLLOUTS = 64
+# Processes running rollouts side by side; 0 runs them one after another in
+# the planning thread (rollouts are pure Python, so threads would not help).
+# Workers are spawned, so scripts that plan need an `if __name__ == "__main__"` guard
+ROLLOUT_WORKERS = int(os.environ.get("FIKA_ROLLOUT_WORKERS", "0"))
+
+DEFAULT_DAY_START = datetime.time(hour=8, minute=0)
+DEFAULT_DAY_END = datetime.time(hour=22, minute=0)
+
+SOLVERS = ("rl", "heuristic")
+
+# Bump when planner behaviour changes so stored fingerprints stop matching
+FINGERPRINT_VERSION = 2
+
+MINUTES_PER_DAY = 24 * 60
 
 def build_state(current_time, tasks, user_prefs):
+    """
+    `current_time` is in epoch minutes (see entries.to_minutes). Stress is
+    the user's recent logged mean when there is one, else their baseline.
+    """
+    stress = user_prefs.get("recent_stress")
     return {
-        "hour": current_time.hour,
+        "hour": (current_time // 60) % 24,
         "remaining_tasks": len(tasks),
-        "stress": user_prefs["stress_level"],
+        "stress": user_prefs["stress_level"] if stress is None else stress,
         "style": 0 if user_prefs["work_style"] == "long_chunks" else 1
     }
 
-def generate_schedule(user_id):
-    user_prefs = fetch_user_prefs(user_id)
-    tasks = fetch_tasks(user_id)
+def schedule_fingerprint(user_prefs, tasks, start_date, horizon_days, solver, rollouts=1):
+    """Content hash of everything plan_schedule reads."""
+    payload = json.dumps(
+        [FINGERPRINT_VERSION, user_prefs, tasks, start_date, horizon_days, solver, rollouts],
+        sort_keys=True, default=str, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class ScheduleIO:
+    """
+    Where generate_schedule reads its inputs and writes its results. The
+    default talks to the configured repository and the Q-table store; benchmarks and tools
+    pass an object with the same methods to run without a database.
+    """
+
+    def fetch_prefs(self, user_id):
+        repo = get_repository()
+        return dict(repo.fetch_user_prefs(user_id), recent_stress=repo.fetch_recent_stress(user_id))
+
+    def fetch_tasks(self, user_id):
+        return get_repository().fetch_tasks(user_id)
+
+    def fetch_memoized(self, user_id, fingerprint):
+        return get_repository().fetch_memoized_schedule(user_id, fingerprint)
+
+    def store(self, user_id, schedule, fingerprint, unscheduled_ids, solver, horizon_days):
+        get_repository().replace_schedule(user_id, schedule, fingerprint, unscheduled_ids, solver, horizon_days)
+
+    def load_q_table(self, user_id):
+        # Users who never planned start from the offline-trained table
+        return get_qtable_store().get(user_id) or get_trained_qtable()
+
+    def store_q_table(self, user_id, blob):
+        get_qtable_store().put(user_id, blob)
+
+def generate_schedule(user_id, horizon_days=1, start_date=None, solver="rl", force=False, io=None,
+                      rollouts=PLAN_ROLLOUTS):
+    """
+    Plan and store a user's schedule. Returns (ScheduleEntry list,
+    unscheduled task rows); use entries.schedule_to_json for the API shape.
+    `rollouts` is passed on to plan_schedule.
+
+    When the tasks, preferences, date and options match those of the stored
+    schedule, that schedule is returned without replanning (and without
+    updating the Q-table) unless `force` is set. `io` replaces the database
+    access (see ScheduleIO).
+    """
+    io = io or ScheduleIO()
+    with SCHEDULE_PHASE_SECONDS.time(phase="fetch", solver=solver):
+        user_prefs = io.fetch_prefs(user_id)
+        tasks = io.fetch_tasks(user_id)
+        start_date = start_date or datetime.date.today()
+        fingerprint = schedule_fingerprint(user_prefs, tasks, start_date, horizon_days, solver, rollouts)
+        memoized = None if force else io.fetch_memoized(user_id, fingerprint)
+    if memoized is not None:
+        SCHEDULE_MEMO.inc(result="hit")
+        return _with_task_names(memoized[0], tasks), [t for t in tasks if t["id"] in memoized[1]]
+    SCHEDULE_MEMO.inc(result="forced" if force else "miss")
+
+    schedule, agent, unscheduled = plan_schedule(
+        user_prefs, tasks, io.load_q_table(user_id),
+        start_date=start_date, horizon_days=horizon_days, solver=solver, rollouts=rollouts,
+    )
+
+    with SCHEDULE_PHASE_SECONDS.time(phase="store", solver=solver):
+        io.store(user_id, schedule, fingerprint, [t["id"] for t in unscheduled], solver, horizon_days)
+        if solver == "rl":
+            io.store_q_table(user_id, agent.dump_q_table())
+    return schedule, unscheduled
+
+def _with_task_names(schedule, tasks):
+    """scheduled_tasks rows carry no names; restore them from the task rows."""
+    names = {t["id"]: t["name"] for t in tasks}
+    for entry in schedule:
+        entry.task = "Break" if entry.kind == BREAK else names.get(entry.task_id)
+    return schedule
+
+def _to_datetime(value):
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    return value
+
+def _bedtime(sleep_goal):
+    """sleep_goal is stored as a TIME, but older rows and clients send "HH:MM" or an hour."""
+    if isinstance(sleep_goal, datetime.time):
+        return sleep_goal
+    if isinstance(sleep_goal, str) and ":" in sleep_goal:
+        hour, minute = sleep_goal.split(":")[:2]
+        return datetime.time(int(hour) % 24, int(minute))
+    if isinstance(sleep_goal, int):
+        return datetime.time(sleep_goal % 24)
+    return None
+
+def day_windows(user_prefs, start_date, horizon_days):
+    """
+    Waking window for each day of the horizon: from bedtime + sleep hours
+    until bedtime (which may fall after midnight). Falls back to
+    DEFAULT_DAY_START..DEFAULT_DAY_END when the user has no sleep settings.
+    """
+    bedtime = _bedtime(user_prefs.get("sleep_goal"))
+    sleep_hours = user_prefs.get("sleep_pref")
+    if bedtime is None or not sleep_hours or not 0 < sleep_hours < 24:
+        wake, bedtime = DEFAULT_DAY_START, DEFAULT_DAY_END
+    else:
+        bed = datetime.datetime.combine(start_date, bedtime)
+        wake = (bed + timedelta(hours=sleep_hours)).time()
+
+    windows = []
+    for offset in range(horizon_days):
+        day = start_date + timedelta(days=offset)
+        window_start = datetime.datetime.combine(day, wake)
+        window_end = datetime.datetime.combine(day, bedtime)
+        if window_end <= window_start:
+            window_end += timedelta(days=1)
+        windows.append((window_start, window_end))
+    return windows
+
+def find_gaps(windows, fixed_blocks):
+    """
+    Free intervals inside the sorted `windows` not covered by `fixed_blocks`.
+    The nights between windows go into the index as busy time, so the whole
+    horizon is one gaps() query: a single in-order pass over the blocks.
+    Windows must not touch (day_windows always leaves a night between).
+    """
+    if not windows:
+        return []
+    busy = fixed_block_index(fixed_blocks)
+    for night, ((_, night_start), (night_end, _)) in enumerate(zip(windows, windows[1:])):
+        if night_start < night_end:
+            busy.add(night_start, night_end, ("night", night))
+    return busy.gaps(windows[0][0], windows[-1][1])
+
+def fixed_block_index(fixed_blocks):
+    return IntervalIndex((start, end, t['id']) for start, end, t in fixed_blocks if start < end)
+
+def fixed_task_interval(t):
+    """(start, end) of a fixed task; end falls back to the deadline, then to one hour."""
+    fixed_start = _to_datetime(t['start_time'])
+    fixed_end = t.get('end_time')
+    if fixed_end is None:
+        deadline = t.get("deadline")
+        if deadline:
+            if isinstance(deadline, str):
+                try:
+                    fixed_end = datetime.datetime.fromisoformat(deadline)
+                except Exception:
+                    fixed_end = fixed_start + timedelta(hours=1)
+            else:
+                fixed_end = deadline
+        else:
+            fixed_end = fixed_start + timedelta(hours=1)
+    else:
+        fixed_end = _to_datetime(fixed_end)
+    return fixed_start, fixed_end
+
+def _deadline_key(task):
+    deadline = _to_datetime(task.get("deadline"))
+    return (
+        deadline is None,
+        deadline or datetime.datetime.max,
+        -PRIORITY_SCORES.get(task.get("priority"), 1),
+    )
+
+def plan_schedule(user_prefs, tasks, q_table=None, start_date=None, horizon_days=1, solver="rl",
+                  rollouts=1, time_budget=None):
+    """
+    Build a schedule from already-fetched preferences and task rows without
+    touching the database. `q_table` is a blob from SchedulerAgent.dump_q_table
+    used to warm-start the agent. The plan covers `horizon_days` days starting
+    at `start_date` (today by default). `solver` is "rl" for the learning
+    agent or "heuristic" for deterministic deadline-first packing.
+
+    With `rollouts` above 1 the RL solver runs that many independent
+    episodes and keeps the one evaluate_schedule scores highest (see
+    _search_rl). Everything shares `time_budget` seconds (PLAN_TIME_BUDGET
+    by default), so fewer rollouts may finish.
+
+    Returns (schedule, agent, unscheduled): a list of ScheduleEntry, the
+    agent, and the flexible task rows that could not be placed.
+    """
+    if not 1 <= horizon_days <= MAX_HORIZON_DAYS:
+        raise ValueError("horizon_days must be between 1 and %d" % MAX_HORIZON_DAYS)
+    if solver not in SOLVERS:
+        raise ValueError("Unknown solver %r; expected one of %s" % (solver, ", ".join(SOLVERS)))
+    if not 1 <= rollouts <= MAX_ROLLOUTS:
+        raise ValueError("rollouts must be between 1 and %d" % MAX_ROLLOUTS)
+    # NumPy-backed; imported on first plan so importing this module (and
+    # booting the API) stays cheap
+    from helpers import evaluate_schedule
+    from rl_agent import SchedulerAgent
+    started = time.perf_counter()
 
     focus_mapping = {"morning": (8, 12), "afternoon": (10, 14), "evening": (12, 16)}
     work_slots = [focus_mapping.get(user_prefs['focus_period'], (8, 12)), (13, 17)]
@@ -27,77 +254,188 @@ def generate_schedule(user_id):
         break_time += 10
 
     schedule = []
-    today = datetime.datetime.now().date()
-    day_start = datetime.datetime.combine(today, datetime.time(hour=8, minute=0))
-    day_end = datetime.datetime.combine(today, datetime.time(hour=22, minute=0))
+    start_date = start_date or datetime.datetime.now().date()
+    windows = [
+        (to_minutes(window_start), to_minutes(window_end))
+        for window_start, window_end in day_windows(user_prefs, start_date, horizon_days)
+    ]
+    horizon_start = to_minutes(datetime.datetime.combine(start_date, datetime.time()))
+    horizon_end = max(horizon_start + horizon_days * MINUTES_PER_DAY, windows[-1][1])
 
-    # Separate fixed and flexible tasks
-    fixed_tasks = [t for t in tasks if t['fixed_time']]
-    flexible_tasks = [t for t in tasks if not t['fixed_time']]
+    # Separate fixed and flexible tasks; flexible ones are offered to the
+    # agent in deadline order so work carries over to later days sensibly
+    fixed_tasks = [t for t in tasks if t['fixed_time'] and t.get('start_time')]
+    flexible_tasks = sorted((t for t in tasks if not t['fixed_time']), key=_deadline_key)
 
-    # Schedule all fixed tasks first, sorted by start time
+    # Schedule fixed tasks inside the horizon first, sorted by start time
     fixed_blocks = []
     for t in fixed_tasks:
-        fixed_start = t['start_time']
-        fixed_end = t.get('end_time')
-        if isinstance(fixed_start, str):
-            fixed_start = datetime.datetime.fromisoformat(fixed_start)
-        if fixed_end is None:
-            deadline = t.get("deadline")
-            if deadline:
-                if isinstance(deadline, str):
-                    try:
-                        fixed_end = datetime.datetime.fromisoformat(deadline)
-                    except Exception:
-                        fixed_end = fixed_start + timedelta(hours=1)
-                else:
-                    fixed_end = deadline
-            else:
-                fixed_end = fixed_start + timedelta(hours=1)
-        elif isinstance(fixed_end, str):
-            fixed_end = datetime.datetime.fromisoformat(fixed_end)
+        fixed_start, fixed_end = map(to_minutes, fixed_task_interval(t))
+        if fixed_end <= horizon_start or fixed_start >= horizon_end:
+            continue
         fixed_blocks.append((fixed_start, fixed_end, t))
     fixed_blocks.sort(key=lambda x: x[0])
     for start, end, t in fixed_blocks:
-        schedule.append({
-            "task_id": t['id'],
-            "task": t['name'],
-            "start": start.strftime("%Y-%m-%d %H:%M"),
-            "end": end.strftime("%Y-%m-%d %H:%M"),
-            "type": "Fixed"
-        })
-
-    # Find all gaps between fixed tasks
-    gaps = []
-    prev_end = day_start
-    for start, end, _ in fixed_blocks:
-        if prev_end < start:
-            gaps.append((prev_end, start))
-        prev_end = max(prev_end, end)
-    if prev_end < day_end:
-        gaps.append((prev_end, day_end))
-
-    # Create the RL agent for flexible tasks
-    action_space = list(range(len(flexible_tasks))) + ["break"]
-    agent = SchedulerAgent(action_space)
+        schedule.append(ScheduleEntry(t['id'], t['name'], start, end, FIXED))
+
+    # Find all gaps between fixed tasks across the whole horizon
+    gaps = find_gaps(windows, fixed_blocks)
+    SCHEDULE_PHASE_SECONDS.observe(time.perf_counter() - started, phase="gaps", solver=solver)
+
+    # Both solvers leave the tasks they could not place in flexible_tasks,
+    # so they are reported as unscheduled instead of vanishing
+    with SCHEDULE_PHASE_SECONDS.time(phase="solve", solver=solver):
+        if solver == "rl":
+            placed, agent, flexible_tasks = _search_rl(
+                schedule, gaps, flexible_tasks, q_table, user_prefs, break_time, work_block,
+                rollouts, budget_end=started + (PLAN_TIME_BUDGET if time_budget is None else time_budget),
+            )
+            schedule += placed
+        else:
+            agent = SchedulerAgent(list(range(len(flexible_tasks))) + ["break"])
+            agent.load_q_table(q_table)
+            schedule += _fill_gaps_heuristic(gaps, flexible_tasks, user_prefs, break_time, work_block)
+
+    with SCHEDULE_PHASE_SECONDS.time(phase="evaluate", solver=solver):
+        final_reward = evaluate_schedule(schedule, user_prefs)
+    AGENT_FINAL_REWARD.observe(final_reward, solver=solver)
+    if solver == "rl":
+        agent.update(None, None, final_reward, None)
+        AGENT_Q_TABLE_STATES.observe(agent.num_states)
+        AGENT_EPSILON.set(agent.epsilon)
+    return schedule, agent, flexible_tasks
+
+def _rollout(gaps, flexible_tasks, q_table, user_prefs, break_time, work_block, budget_end):
+    """
+    One RL episode with its own agent, warm-started from `q_table` (what it
+    learned on the user's previous schedules). Returns (placed entries,
+    agent, tasks left over); `flexible_tasks` itself is not modified.
+    """
+    from rl_agent import SchedulerAgent
+    with SCHEDULE_ROLLOUT_SECONDS.time():
+        flexible_tasks = list(flexible_tasks)
+        agent = SchedulerAgent(list(range(len(flexible_tasks))) + ["break"])
+        agent.load_q_table(q_table)
+        placed = _fill_gaps_rl(gaps, flexible_tasks, agent, user_prefs, break_time, work_block, budget_end)
+    return placed, agent, flexible_tasks
+
+def _rollouts(gaps, flexible_tasks, q_table, user_prefs, break_time, work_block, rollouts, budget_end):
+    """Up to `rollouts` rollouts one after another; the first always runs, later ones before `budget_end`."""
+    results = []
+    for _ in range(rollouts):
+        if results and time.perf_counter() >= budget_end:
+            break
+        results.append(_rollout(gaps, flexible_tasks, q_table, user_prefs, break_time, work_block, budget_end))
+    return results
+
+def _score(fixed_entries, results, user_prefs):
+    """evaluate_schedule_batch rewards of the rollout results' full schedules."""
+    from helpers import schedules_to_batch, evaluate_schedule_batch
+    starts, ends, is_break, priorities, valid = schedules_to_batch(
+        [fixed_entries + placed for placed, _, _ in results]
+    )
+    return evaluate_schedule_batch(starts, ends, is_break, priorities, user_prefs, valid)
 
+def _remote_rollouts(fixed_entries, gaps, flexible_tasks, q_table, user_prefs, break_time, work_block,
+                     rollouts, deadline):
+    """
+    Rollout pool entry point: a share of a search's rollouts, so the Q-table
+    is sent once per worker rather than once per rollout. perf_counter
+    values do not carry across processes, so the budget arrives as a
+    time.time() deadline. Returns (metrics.drain(), best) where best is
+    (rollouts run, reward, placed entries, Q-table blob, ids left over) of
+    the highest-scoring one, or None when the deadline passed while queued.
+    """
+    remaining = deadline - time.time()
+    best = None
+    if remaining > 0:
+        results = _rollouts(
+            gaps, flexible_tasks, q_table, user_prefs, break_time, work_block, rollouts,
+            time.perf_counter() + remaining,
+        )
+        rewards = _score(fixed_entries, results, user_prefs)
+        placed, agent, left = results[int(rewards.argmax())]
+        best = len(results), float(rewards.max()), placed, agent.dump_q_table(), [t["id"] for t in left]
+    return metrics.drain(), best
+
+_rollout_pool = None
+_rollout_pool_lock = threading.Lock()
+
+def _get_rollout_pool():
+    global _rollout_pool
+    if _rollout_pool is None:
+        with _rollout_pool_lock:
+            if _rollout_pool is None:
+                # Spawned, not forked: the pool starts lazily inside a
+                # threaded API process, whose locks a fork would copy mid-use.
+                # Fresh interpreters also seed their own random state.
+                _rollout_pool = ProcessPoolExecutor(
+                    max_workers=ROLLOUT_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _rollout_pool
+
+def _search_rl(fixed_entries, gaps, flexible_tasks, q_table, user_prefs, break_time, work_block,
+               rollouts, budget_end):
+    """
+    Run up to `rollouts` independent RL episodes over the same gaps and
+    return (placed entries, agent, tasks left over) of the one whose full
+    schedule (with `fixed_entries`) scores highest. Candidates are scored
+    together with evaluate_schedule_batch. The first rollout always runs;
+    later ones only start before `budget_end`. With ROLLOUT_WORKERS, the
+    rollouts are split across that many processes, each bounded by the
+    same budget, and each process sends back only its best candidate.
+    """
+    from rl_agent import SchedulerAgent
+    if rollouts > 1 and ROLLOUT_WORKERS > 0:
+        deadline = time.time() + (budget_end - time.perf_counter())
+        workers = min(rollouts, ROLLOUT_WORKERS)
+        futures = [
+            _get_rollout_pool().submit(
+                _remote_rollouts, fixed_entries, gaps, flexible_tasks, q_table, user_prefs, break_time,
+                work_block, rollouts // workers + (i < rollouts % workers), deadline,
+            )
+            for i in range(workers)
+        ]
+        best, finished = None, 0
+        for future in futures:
+            drained, result = future.result()
+            metrics.merge(drained)
+            if result is None:
+                continue
+            finished += result[0]
+            if best is None or result[1] > best[1]:
+                best = result
+        if best is not None:
+            SCHEDULE_ROLLOUTS.observe(finished)
+            _, _, placed, blob, left_ids = best
+            agent = SchedulerAgent(list(range(len(left_ids))) + ["break"])
+            agent.load_q_table(blob)
+            left_ids = set(left_ids)
+            return placed, agent, [t for t in flexible_tasks if t["id"] in left_ids]
+        # Every pooled share was still queued at the deadline
+        rollouts = 1
+    results = _rollouts(gaps, flexible_tasks, q_table, user_prefs, break_time, work_block, rollouts, budget_end)
+    SCHEDULE_ROLLOUTS.observe(len(results))
+    if len(results) == 1:
+        return results[0]
+    return results[int(_score(fixed_entries, results, user_prefs).argmax())]
+
+def _fill_gaps_rl(gaps, flexible_tasks, agent, user_prefs, break_time, work_block, budget_end):
+    """Let the agent pick tasks and breaks gap by gap, learning as it goes."""
+    schedule = []
     # Schedule flexible tasks and breaks in the gaps
     for gap_start, gap_end in gaps:
+        if not flexible_tasks or time.perf_counter() > budget_end:
+            break
         current_time = gap_start
         while current_time < gap_end and flexible_tasks:
             state = build_state(current_time, flexible_tasks, user_prefs)
             action = agent.select_action(state)
             if action == "break":
-                break_end = current_time + timedelta(minutes=break_time)
+                break_end = current_time + break_time
                 if break_end > gap_end:
                     break  # Don't overflow the gap
-                schedule.append({
-                    "task_id": None,
-                    "task": "Break",
-                    "start": current_time.strftime("%Y-%m-%d %H:%M"),
-                    "end": break_end.strftime("%Y-%m-%d %H:%M"),
-                    "type": "Break"
-                })
+                schedule.append(ScheduleEntry(None, "Break", current_time, break_end, BREAK))
                 reward = 0.05
                 next_state = build_state(break_end, flexible_tasks, user_prefs)
                 agent.update(state, action, reward, next_state)
@@ -107,48 +445,103 @@ def generate_schedule(user_id):
                     action_idx = int(action)
                     if not (0 <= action_idx < len(flexible_tasks)):
                         continue  # skip invalid action
-                    task = flexible_tasks.pop(action_idx)
+                    task = flexible_tasks[action_idx]
                     task_duration = task.get('estimated_time', 30)
-                    task_end_time = current_time + timedelta(minutes=task_duration)
+                    task_end_time = current_time + task_duration
                     if task_end_time > gap_end:
-                        break  # Don't overflow the gap
-                    schedule.append({
-                        "task_id": task['id'],
-                        "task": task['name'],
-                        "start": current_time.strftime("%Y-%m-%d %H:%M"),
-                        "end": task_end_time.strftime("%Y-%m-%d %H:%M"),
-                        "type": "Flexible"
-                    })
+                        break  # Doesn't fit; keep the task for a later gap
+                    flexible_tasks.pop(action_idx)
+                    agent.set_action_space(list(range(len(flexible_tasks))) + ["break"])
+                    schedule.append(ScheduleEntry(task['id'], task['name'], current_time, task_end_time, FLEXIBLE))
                     reward = 1.0
                     next_state = build_state(task_end_time, flexible_tasks, user_prefs)
                     agent.update(state, action, reward, next_state)
                     current_time = task_end_time
                     if user_prefs['work_style'] == "short_sprints" or (
-                        user_prefs['work_style'] == "long_chunks" and current_time.minute % work_block == 0
+                        user_prefs['work_style'] == "long_chunks" and (current_time % 60) % work_block == 0
                     ):
-                        break_end = current_time + timedelta(minutes=break_time)
+                        break_end = current_time + break_time
                         if break_end > gap_end:
                             break
-                        schedule.append({
-                            "task_id": None,
-                            "task": "Break",
-                            "start": current_time.strftime("%Y-%m-%d %H:%M"),
-                            "end": break_end.strftime("%Y-%m-%d %H:%M"),
-                            "type": "Break"
-                        })
+                        schedule.append(ScheduleEntry(None, "Break", current_time, break_end, BREAK))
                         current_time = break_end
                 except ValueError:
                     continue  # skip invalid action
-
-    store_schedule(user_id, schedule)
-    final_reward = evaluate_schedule(schedule, user_prefs)
-    agent.update(None, None, final_reward, None)
     return schedule
 
+class _GapTree:
+    """Max segment tree over remaining gap capacities for O(log n) first-fit."""
+
+    def __init__(self, capacities):
+        self.size = 1
+        while self.size < len(capacities):
+            self.size *= 2
+        self.tree = [-1] * (2 * self.size)
+        self.tree[self.size:self.size + len(capacities)] = capacities
+        for i in range(self.size - 1, 0, -1):
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+
+    def first_fit(self, need):
+        """Index of the earliest gap with at least `need` capacity, or -1."""
+        if self.tree[1] < need:
+            return -1
+        i = 1
+        while i < self.size:
+            i = 2 * i if self.tree[2 * i] >= need else 2 * i + 1
+        return i - self.size
+
+    def capacity(self, index):
+        return self.tree[self.size + index]
+
+    def consume(self, index, amount):
+        i = index + self.size
+        self.tree[i] -= amount
+        i //= 2
+        while i:
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+            i //= 2
+
+def _fill_gaps_heuristic(gaps, flexible_tasks, user_prefs, break_time, work_block):
+    """
+    Deterministic earliest-deadline-first packing: tasks are taken in
+    deadline/priority order (flexible_tasks is already sorted that way) and
+    each goes into the earliest gap that still has room, in O(n log n).
+    Breaks follow every task for short sprints and every `work_block`
+    minutes of continuous work for long chunks, when the gap has room.
+    """
+    cursors = [start for start, _ in gaps]
+    worked = [0] * len(gaps)  # minutes of work since the last break, per gap
+    tree = _GapTree([end - start for start, end in gaps])
+    placed = []
+    unplaced = []
+    for task in flexible_tasks:
+        duration = task.get('estimated_time') or 30
+        i = tree.first_fit(duration)
+        if i < 0:
+            unplaced.append(task)
+            continue
+        start = cursors[i]
+        end = start + duration
+        placed.append(ScheduleEntry(task['id'], task['name'], start, end, FLEXIBLE))
+        tree.consume(i, duration)
+        cursors[i] = end
+        worked[i] += duration
+        wants_break = user_prefs['work_style'] == "short_sprints" or worked[i] >= work_block
+        if wants_break and tree.capacity(i) >= break_time:
+            placed.append(ScheduleEntry(None, "Break", end, end + break_time, BREAK))
+            tree.consume(i, break_time)
+            cursors[i] = end + break_time
+            worked[i] = 0
+    flexible_tasks[:] = unplaced
+    placed.sort(key=lambda e: e.start)
+    return placed
+
 # Example usage:
 if __name__ == "__main__":
+    import pandas as pd
+
     user_id = 2
-    schedule = generate_schedule(user_id)
+    schedule, _ = generate_schedule(user_id)
 
-    df = pd.DataFrame(schedule)
+    df = pd.DataFrame(schedule_to_json(schedule))
     print(df)
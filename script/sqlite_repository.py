@@ -0,0 +1,603 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+from entries import ScheduleEntry, from_minutes
+from repository import Repository
+from db import USER_COLUMNS, PUBLIC_USER_COLUMNS, USER_SETTINGS_COLUMNS, TASK_COLUMNS, RECENT_STRESS_DAYS
+
+# Embedded storage for local development, tests and single-process
+# deployments: the same tables as the Postgres schema in one SQLite file (or
+# in memory). Timestamps, dates and times are stored as ISO strings and
+# converted back through the declared column types.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        password TEXT NOT NULL,
+        email TEXT NOT NULL UNIQUE,
+        name TEXT,
+        lname TEXT,
+        gender,
+        birthday DATE,
+        time_pref INTEGER,
+        stress_base INTEGER,
+        work_pref TEXT,
+        sleep_pref INTEGER,
+        sleep_goal TIME,
+        occupation TEXT,
+        created_at TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS user_preferences (
+        user_id INTEGER PRIMARY KEY,
+        work_style TEXT,
+        focus_period TEXT,
+        stress_level INTEGER,
+        break_preference TEXT,
+        work_block_preference TEXT
+    );
+    CREATE TABLE IF NOT EXISTS tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        category TEXT,
+        estimated_time INTEGER,
+        deadline TIMESTAMP,
+        fixed_time BOOLEAN NOT NULL DEFAULT 0,
+        priority TEXT,
+        start_time TIMESTAMP,
+        end_time TIMESTAMP,
+        description TEXT,
+        divided BOOLEAN NOT NULL DEFAULT 0,
+        archived BOOLEAN NOT NULL DEFAULT 0,
+        stress_entry INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS tasks_user_id ON tasks (user_id, archived);
+    CREATE TABLE IF NOT EXISTS scheduled_tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        task_id INTEGER,
+        start_time TIMESTAMP NOT NULL,
+        end_time TIMESTAMP NOT NULL,
+        type TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS scheduled_tasks_user_id ON scheduled_tasks (user_id, start_time);
+    CREATE TABLE IF NOT EXISTS mood_tracking (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        task_id INTEGER,
+        stress_level INTEGER,
+        date DATE NOT NULL,
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS mood_tracking_user_id ON mood_tracking (user_id, id);
+    CREATE INDEX IF NOT EXISTS mood_tracking_task_id ON mood_tracking (task_id);
+    CREATE TABLE IF NOT EXISTS mood_rollups (
+        user_id INTEGER NOT NULL,
+        day DATE NOT NULL,
+        category TEXT NOT NULL DEFAULT '',
+        entries INTEGER NOT NULL,
+        stress_sum INTEGER NOT NULL,
+        stress_min INTEGER NOT NULL,
+        stress_max INTEGER NOT NULL,
+        PRIMARY KEY (user_id, day, category)
+    );
+    CREATE TABLE IF NOT EXISTS schedule_fingerprints (
+        user_id INTEGER PRIMARY KEY,
+        fingerprint TEXT,
+        unscheduled TEXT NOT NULL DEFAULT '[]',
+        solver TEXT,
+        horizon_days INTEGER,
+        version INTEGER NOT NULL DEFAULT 1,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+TASK_FIELDS = """
+    id, name, category, estimated_time, deadline, fixed_time,
+    start_time, end_time, priority, description, stress_entry
+"""
+
+def _time(raw):
+    # sleep_goal holds a TIME, but some clients send a bare hour
+    value = raw.decode()
+    return datetime.time.fromisoformat(value) if ":" in value else int(value)
+
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(" "))
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime.time, lambda value: value.isoformat())
+sqlite3.register_converter("TIMESTAMP", lambda raw: datetime.datetime.fromisoformat(raw.decode()))
+sqlite3.register_converter("DATE", lambda raw: datetime.date.fromisoformat(raw.decode()))
+sqlite3.register_converter("TIME", _time)
+sqlite3.register_converter("BOOLEAN", lambda raw: raw not in (b"0", b""))
+
+class _TimedCursor(sqlite3.Cursor):
+    """Cursor that reports every statement to metrics.record_query."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.record_query("sqlite", time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.record_query("sqlite", time.perf_counter() - started)
+
+def _dict_row(cur, row):
+    return {column[0]: value for column, value in zip(cur.description, row)}
+
+def _placeholders(values):
+    return ", ".join("?" * len(values))
+
+def _keyset(filters, after_id, descending):
+    """WHERE/ORDER BY for id-keyset pages; `filters` maps column -> value (None skips it)."""
+    clauses, args = [], []
+    for column, value in filters.items():
+        if value is not None:
+            clauses.append("%s = ?" % column)
+            args.append(value)
+    if after_id is not None:
+        clauses.append("id %s ?" % ("<" if descending else ">"))
+        args.append(after_id)
+    where = "WHERE " + " AND ".join(clauses) if clauses else ""
+    return "%s ORDER BY id %s" % (where, "DESC" if descending else "ASC"), args
+
+class SQLiteRepository(Repository):
+    """
+    Repository on one SQLite connection. Calls are serialised by a lock and
+    writes run in BEGIN IMMEDIATE transactions, so the read-modify-write
+    guarantees of the Postgres advisory locks hold here as well.
+    """
+
+    def __init__(self, path=":memory:"):
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+        )
+        self._conn.row_factory = _dict_row
+        self._lock = threading.RLock()
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+            self._add_missing_columns()
+
+    def _add_missing_columns(self):
+        # Files created before the plan options were stored (migration 4 on Postgres)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(schedule_fingerprints)")}
+        for column, sql_type in (("solver", "TEXT"), ("horizon_days", "INTEGER")):
+            if column not in columns:
+                self._conn.execute("ALTER TABLE schedule_fingerprints ADD COLUMN %s %s" % (column, sql_type))
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._cursor()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+
+    def _cursor(self):
+        return self._conn.cursor(_TimedCursor)
+
+    def _fetch(self, query, args=()):
+        with self._lock:
+            return self._cursor().execute(query, args).fetchall()
+
+    def _fetchrow(self, query, args=()):
+        with self._lock:
+            return self._cursor().execute(query, args).fetchone()
+
+    # ----------- USERS -----------
+
+    def fetch_all_user_ids(self):
+        return [row["id"] for row in self._fetch("SELECT id FROM users ORDER BY id")]
+
+    def user_exists(self, user_id):
+        return self._fetchrow("SELECT id FROM users WHERE id = ?", (user_id,)) is not None
+
+    def find_user_conflict(self, email, username):
+        rows = self._fetch("SELECT email FROM users WHERE email = ? OR username = ?", (email, username))
+        if any(row["email"] == email for row in rows):
+            return "email"
+        return "username" if rows else None
+
+    def insert_user(self, values):
+        columns = [c for c in USER_COLUMNS if c in values]
+        with self._transaction() as cur:
+            cur.execute("INSERT INTO users (%s, created_at) VALUES (%s, ?)" % (
+                ", ".join(columns), _placeholders(columns)
+            ), [values[c] for c in columns] + [datetime.datetime.now()])
+            cur.execute("SELECT %s FROM users WHERE id = ?" % ", ".join(PUBLIC_USER_COLUMNS), (cur.lastrowid,))
+            return cur.fetchone()
+
+    def update_user_settings(self, user_id, values):
+        columns = [c for c in USER_SETTINGS_COLUMNS if c in values]
+        with self._transaction() as cur:
+            cur.execute(
+                "UPDATE users SET %s WHERE id = ?" % ", ".join("%s = ?" % c for c in columns),
+                [values[c] for c in columns] + [user_id],
+            )
+            return cur.rowcount > 0
+
+    def save_user_preferences(self, values):
+        with self._transaction() as cur:
+            cur.execute("""
+                INSERT INTO user_preferences (
+                    user_id, work_style, focus_period, stress_level,
+                    break_preference, work_block_preference
+                ) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    work_style = excluded.work_style,
+                    focus_period = excluded.focus_period,
+                    stress_level = excluded.stress_level,
+                    break_preference = excluded.break_preference,
+                    work_block_preference = excluded.work_block_preference
+            """, (
+                values["user_id"], values["work_style"], values["focus_period"],
+                values["stress_level"], values["break_preference"], values["work_block_preference"]
+            ))
+            cur.execute("SELECT * FROM user_preferences WHERE user_id = ?", (values["user_id"],))
+            return cur.fetchone()
+
+    def fetch_login_user(self, username_or_email):
+        return self._fetchrow("""
+            SELECT id, username, email, password
+            FROM users
+            WHERE username = ? OR email = ?
+        """, (username_or_email, username_or_email))
+
+    def update_password(self, user_id, hashed_password):
+        with self._transaction() as cur:
+            cur.execute("UPDATE users SET password = ? WHERE id = ?", (hashed_password, user_id))
+
+    def fetch_user_prefs(self, user_id):
+        return self.fetch_user_prefs_bulk([user_id]).get(user_id)
+
+    def fetch_user_prefs_bulk(self, user_ids):
+        user_ids = list(user_ids)
+        rows = self._fetch("""
+            SELECT id, time_pref, stress_base, work_pref, sleep_goal, sleep_pref
+            FROM users
+            WHERE id IN (%s)
+        """ % _placeholders(user_ids), user_ids)
+        return {
+            row["id"]: {
+                "focus_period": row["time_pref"],
+                "stress_level": row["stress_base"],
+                "work_style": row["work_pref"],
+                "sleep_goal": row["sleep_goal"],
+                "sleep_pref": row["sleep_pref"]
+            }
+            for row in rows
+        }
+
+    # ----------- TASKS -----------
+
+    # Postgres sorts NULL deadlines last; SQLite needs to be told
+    TASK_ORDER = "ORDER BY fixed_time DESC, deadline IS NULL, deadline ASC, priority DESC"
+
+    def fetch_tasks(self, user_id):
+        return self._fetch("SELECT %s FROM tasks WHERE user_id = ? AND archived = 0 %s" % (
+            TASK_FIELDS, self.TASK_ORDER
+        ), (user_id,))
+
+    def fetch_tasks_bulk(self, user_ids):
+        user_ids = list(user_ids)
+        tasks = {user_id: [] for user_id in user_ids}
+        rows = self._fetch("SELECT user_id, %s FROM tasks WHERE user_id IN (%s) AND archived = 0 %s" % (
+            TASK_FIELDS, _placeholders(user_ids), self.TASK_ORDER.replace("ORDER BY", "ORDER BY user_id,")
+        ), user_ids)
+        for row in rows:
+            tasks[row.pop("user_id")].append(row)
+        return tasks
+
+    def fetch_tasks_page(self, user_id, after_id, limit):
+        clause, args = _keyset({"user_id": user_id, "archived": False}, after_id, descending=False)
+        return self._fetch("SELECT %s FROM tasks %s LIMIT ?" % (TASK_FIELDS, clause), args + [limit])
+
+    def fetch_task(self, task_id):
+        return self._fetchrow("SELECT * FROM tasks WHERE id = ?", (task_id,))
+
+    def fetch_fixed_tasks(self, user_id):
+        return self._fetch("""
+            SELECT id, start_time, end_time, deadline
+            FROM tasks
+            WHERE user_id = ? AND archived = 0 AND fixed_time = 1
+              AND start_time IS NOT NULL
+        """, (user_id,))
+
+    def insert_task(self, user_id, values):
+        with self._transaction() as cur:
+            cur.execute("INSERT INTO tasks (%s, user_id) VALUES (%s, ?)" % (
+                ", ".join(TASK_COLUMNS), _placeholders(TASK_COLUMNS)
+            ), [values[c] for c in TASK_COLUMNS] + [user_id])
+            cur.execute("SELECT * FROM tasks WHERE id = ?", (cur.lastrowid,))
+            return cur.fetchone()
+
+    def insert_tasks(self, user_id, rows):
+        with self._transaction() as cur:
+            cur.executemany("INSERT INTO tasks (%s, user_id) VALUES (%s, ?)" % (
+                ", ".join(TASK_COLUMNS), _placeholders(TASK_COLUMNS)
+            ), ([values[c] for c in TASK_COLUMNS] + [user_id] for values in rows))
+        return len(rows)
+
+    def update_task(self, task_id, values):
+        with self._transaction() as cur:
+            cur.execute(
+                "UPDATE tasks SET %s WHERE id = ?" % ", ".join("%s = ?" % c for c in TASK_COLUMNS),
+                [values[c] for c in TASK_COLUMNS] + [task_id],
+            )
+            cur.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
+            return cur.fetchone()
+
+    def delete_task(self, task_id):
+        with self._transaction() as cur:
+            cur.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
+            task = cur.fetchone()
+            cur.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+            return task
+
+    def fetch_archived_count(self, user_id):
+        row = self._fetchrow("SELECT COUNT(*) AS count FROM tasks WHERE user_id = ? AND archived = 1", (user_id,))
+        return row["count"]
+
+    def fetch_task_export_page(self, user_id, after_id, limit):
+        clause, args = _keyset({"user_id": user_id}, after_id, descending=False)
+        return self._fetch("SELECT id, %s FROM tasks %s LIMIT ?" % (", ".join(TASK_COLUMNS), clause), args + [limit])
+
+    def log_stress_entry(self, task_id, stress_entry):
+        with self._transaction() as cur:
+            cur.execute("SELECT user_id, category FROM tasks WHERE id = ?", (task_id,))
+            task = cur.fetchone()
+            cur.execute("UPDATE tasks SET stress_entry = ? WHERE id = ?", (stress_entry, task_id))
+            if task is not None and stress_entry is not None:
+                self._record_stress(cur, task["user_id"], datetime.date.today(), task["category"], stress_entry)
+
+    # ----------- SCHEDULED TASKS -----------
+
+    def _write_schedule(self, cur, user_id, schedule):
+        cur.execute("DELETE FROM scheduled_tasks WHERE user_id = ?", (user_id,))
+        self._insert_schedule(cur, user_id, schedule)
+
+    def _insert_schedule(self, cur, user_id, schedule):
+        cur.executemany("""
+            INSERT INTO scheduled_tasks (user_id, task_id, start_time, end_time, type)
+            VALUES (?, ?, ?, ?, ?)
+        """, [
+            (user_id, entry.task_id, from_minutes(entry.start), from_minutes(entry.end), entry.type)
+            for entry in schedule
+        ])
+
+    def _record_schedule_write(self, cur, user_ids, fingerprint=None, unscheduled_ids=(), solver=None,
+                               horizon_days=None):
+        self._record_schedule_writes(cur, [
+            (user_id, fingerprint, unscheduled_ids, solver, horizon_days) for user_id in user_ids
+        ])
+
+    def _record_schedule_writes(self, cur, rows):
+        cur.executemany("""
+            INSERT INTO schedule_fingerprints (user_id, fingerprint, unscheduled, solver, horizon_days)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                fingerprint = excluded.fingerprint,
+                unscheduled = excluded.unscheduled,
+                solver = COALESCE(excluded.solver, solver),
+                horizon_days = COALESCE(excluded.horizon_days, horizon_days),
+                version = version + 1,
+                updated_at = CURRENT_TIMESTAMP
+        """, [
+            (user_id, fingerprint, json.dumps(list(unscheduled_ids)), solver, horizon_days)
+            for user_id, fingerprint, unscheduled_ids, solver, horizon_days in rows
+        ])
+
+    def replace_schedule(self, user_id, schedule, fingerprint=None, unscheduled_ids=(), solver=None,
+                         horizon_days=None):
+        with self._transaction() as cur:
+            self._write_schedule(cur, user_id, schedule)
+            self._record_schedule_write(cur, [user_id], fingerprint, unscheduled_ids, solver, horizon_days)
+
+    def replace_schedules(self, schedules, fingerprints=None, unscheduled_ids=None, solver=None,
+                          horizon_days=None):
+        if not schedules:
+            return
+        with self._transaction() as cur:
+            for user_id in sorted(schedules):
+                self._write_schedule(cur, user_id, schedules[user_id])
+            self._record_schedule_writes(cur, [
+                (user_id, (fingerprints or {}).get(user_id), (unscheduled_ids or {}).get(user_id, ()),
+                 solver, horizon_days)
+                for user_id in sorted(schedules)
+            ])
+
+    def store_schedule(self, user_id, schedule):
+        if not schedule:
+            return
+        with self._transaction() as cur:
+            self._insert_schedule(cur, user_id, schedule)
+            self._record_schedule_write(cur, [user_id])
+
+    def modify_schedule(self, user_id, patch):
+        with self._transaction() as cur:
+            cur.execute("""
+                SELECT task_id, start_time AS start, end_time AS "end", type
+                FROM scheduled_tasks
+                WHERE user_id = ?
+                ORDER BY start_time ASC
+            """, (user_id,))
+            schedule = patch([ScheduleEntry.from_row(row) for row in cur.fetchall()])
+            self._write_schedule(cur, user_id, schedule)
+            self._record_schedule_write(cur, [user_id])
+        return schedule
+
+    def fetch_memoized_schedule(self, user_id, fingerprint):
+        rows = self._fetch("""
+            SELECT f.unscheduled, s.task_id, s.start_time AS start, s.end_time AS "end", s.type
+            FROM schedule_fingerprints f
+            LEFT JOIN scheduled_tasks s ON s.user_id = f.user_id
+            WHERE f.user_id = ? AND f.fingerprint = ?
+            ORDER BY s.start_time ASC
+        """, (user_id, fingerprint))
+        if not rows:
+            return None
+        schedule = [ScheduleEntry.from_row(row) for row in rows if row["start"] is not None]
+        return schedule, json.loads(rows[0]["unscheduled"])
+
+    def fetch_schedule_plan(self, user_id):
+        row = self._fetchrow("SELECT solver, horizon_days FROM schedule_fingerprints WHERE user_id = ?", (user_id,))
+        if row is None or row["solver"] is None:
+            return None
+        return row["solver"], row["horizon_days"]
+
+    def fetch_schedule_version(self, user_id):
+        row = self._fetchrow("SELECT version FROM schedule_fingerprints WHERE user_id = ?", (user_id,))
+        return row["version"] if row else 0
+
+    def fetch_schedule_with_version(self, user_id):
+        # The lock keeps writers out between the two reads
+        with self._lock:
+            version = self.fetch_schedule_version(user_id)
+            rows = self._fetch("""
+                SELECT * FROM scheduled_tasks
+                WHERE user_id = ?
+                ORDER BY start_time ASC
+            """, (user_id,))
+        return version, rows
+
+    def stream_schedule_history(self, chunk_size=5000):
+        with self._lock:
+            cur = self._cursor().execute("""
+                SELECT s.user_id, s.task_id, s.start_time, s.end_time, s.type, t.deadline, t.priority,
+                       COALESCE(m.stress, t.stress_entry) AS task_stress, r.stress AS day_stress
+                FROM scheduled_tasks s
+                LEFT JOIN tasks t ON t.id = s.task_id
+                LEFT JOIN (
+                    SELECT task_id, AVG(stress_level) AS stress
+                    FROM mood_tracking
+                    WHERE task_id IS NOT NULL
+                    GROUP BY task_id
+                ) m ON m.task_id = s.task_id
+                LEFT JOIN (
+                    SELECT user_id, day, CAST(SUM(stress_sum) AS REAL) / SUM(entries) AS stress
+                    FROM mood_rollups
+                    GROUP BY user_id, day
+                ) r ON r.user_id = s.user_id AND r.day = date(s.start_time)
+                ORDER BY s.user_id, s.start_time
+            """)
+        while True:
+            with self._lock:
+                rows = cur.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+
+    # ----------- MOOD TRACKING -----------
+
+    def _record_stress(self, cur, user_id, day, category, stress_level):
+        cur.execute("""
+            INSERT INTO mood_rollups (user_id, day, category, entries, stress_sum, stress_min, stress_max)
+            VALUES (?, ?, COALESCE(?, ''), 1, ?, ?, ?)
+            ON CONFLICT (user_id, day, category) DO UPDATE SET
+                entries = entries + 1,
+                stress_sum = stress_sum + excluded.stress_sum,
+                stress_min = MIN(stress_min, excluded.stress_min),
+                stress_max = MAX(stress_max, excluded.stress_max)
+        """, (user_id, day, category, stress_level, stress_level, stress_level))
+
+    def insert_mood(self, user_id, task_id, stress_level, date):
+        date = date or datetime.date.today()
+        with self._transaction() as cur:
+            category = None
+            if task_id:
+                cur.execute("SELECT category FROM tasks WHERE id = ?", (task_id,))
+                task = cur.fetchone()
+                if task is None:
+                    return None
+                category = task["category"]
+            cur.execute("""
+                INSERT INTO mood_tracking (user_id, task_id, stress_level, date)
+                VALUES (?, ?, ?, ?)
+            """, (user_id, task_id, stress_level, date))
+            mood_id = cur.lastrowid
+            self._record_stress(cur, user_id, date, category, stress_level)
+            return mood_id
+
+    def fetch_moods_page(self, user_id, after_id, limit):
+        clause, args = _keyset({"user_id": user_id}, after_id, descending=True)
+        return self._fetch("SELECT * FROM mood_tracking %s LIMIT ?" % clause, args + [limit])
+
+    def fetch_moods_for_task(self, task_id):
+        return self._fetch("""
+            SELECT id, stress_level, date, timestamp
+            FROM mood_tracking
+            WHERE task_id = ?
+        """, (task_id,))
+
+    def _fetch_rollups(self, group_by, user_id, since):
+        return self._fetch("""
+            SELECT %s, SUM(entries) AS count,
+                   CAST(SUM(stress_sum) AS REAL) / SUM(entries) AS mean,
+                   MIN(stress_min) AS min, MAX(stress_max) AS max
+            FROM mood_rollups
+            WHERE user_id = ? AND day >= ?
+            GROUP BY %s
+            ORDER BY %s
+        """ % (group_by, group_by, group_by), (user_id, since))
+
+    def fetch_daily_stress(self, user_id, since):
+        return self._fetch_rollups("day", user_id, since)
+
+    def fetch_category_stress(self, user_id, since):
+        return self._fetch_rollups("category", user_id, since)
+
+    def fetch_recent_stress_bulk(self, user_ids, days=RECENT_STRESS_DAYS):
+        user_ids = list(user_ids)
+        rows = self._fetch("""
+            SELECT user_id, CAST(SUM(stress_sum) AS REAL) / SUM(entries) AS mean
+            FROM mood_rollups
+            WHERE user_id IN (%s) AND day > ?
+            GROUP BY user_id
+        """ % _placeholders(user_ids), user_ids + [datetime.date.today() - datetime.timedelta(days=days)])
+        return {row["user_id"]: row["mean"] for row in rows}
+
+    def fetch_recent_stress(self, user_id):
+        return self.fetch_recent_stress_bulk([user_id]).get(user_id)
+
+    def rebuild_mood_rollups(self):
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM mood_rollups")
+            cur.execute("""
+                INSERT INTO mood_rollups (user_id, day, category, entries, stress_sum, stress_min, stress_max)
+                SELECT m.user_id, m.date, COALESCE(t.category, ''), COUNT(*),
+                       SUM(m.stress_level), MIN(m.stress_level), MAX(m.stress_level)
+                FROM mood_tracking m
+                LEFT JOIN tasks t ON t.id = m.task_id
+                WHERE m.stress_level IS NOT NULL
+                GROUP BY m.user_id, m.date, COALESCE(t.category, '')
+            """)
+            return cur.rowcount
+
+    # ----------- LIFECYCLE -----------
+
+    # The schema is created with the connection; migrate() stays a no-op
+
+    def stats(self):
+        return {"storage": {"backend": "sqlite", "path": self.path}}
+
+    async def aclose(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,93 @@
+"""
+Cold-start profile: import time per module for a fresh interpreter.
+
+    python startup_profile.py                       # profile `import app`
+    python startup_profile.py --module scheduler --top 30
+    python startup_profile.py --budget-ms 800       # exit 1 when over budget
+
+Each run imports the module in a new process with -X importtime, which
+times every module's import including the initialisation code it runs at
+module level. The reported total is the median over --runs. The exit
+status is 1 when that median exceeds --budget-ms or when any module listed
+with --forbid (by default the heavy ones kept off the startup path) was
+imported.
+"""
+import argparse
+import json
+import subprocess
+import sys
+from collections import defaultdict
+
+# Loaded on first use only; importing any of them at startup is a regression
+HEAVY_MODULES = ("pandas", "numpy", "passlib")
+
+_PROBE = """
+import sys, time, json
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+def profile_once(module, cwd=None):
+    """(wall seconds, loaded module names, [(name, depth, self_us, cumulative_us)])."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module)],
+        capture_output=True, text=True, check=True, cwd=cwd,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    return probe["seconds"], probe["modules"], rows
+
+def by_package(rows):
+    """Self time summed per top-level package, in microseconds."""
+    totals = defaultdict(int)
+    for name, _, self_us, _ in rows:
+        totals[name.split(".")[0]] += self_us
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="app", help="module to import (default: app)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="rows per table")
+    parser.add_argument("--budget-ms", type=float, help="fail when the median import time is above this")
+    parser.add_argument("--forbid", action="append",
+                        help="fail when this module gets imported (repeatable; default: %s)" % ", ".join(HEAVY_MODULES))
+    args = parser.parse_args()
+
+    runs = [profile_once(args.module) for _ in range(args.runs)]
+    seconds = sorted(run[0] for run in runs)
+    median_ms = seconds[len(seconds) // 2] * 1000
+    _, loaded, rows = runs[len(runs) // 2]
+
+    print("import %s: median %.1f ms, min %.1f ms, max %.1f ms over %d runs; %d modules loaded" % (
+        args.module, median_ms, seconds[0] * 1000, seconds[-1] * 1000, len(runs), len(loaded)))
+
+    print("\n%-48s %10s %10s" % ("module (cumulative)", "self ms", "total ms"))
+    for name, depth, self_us, cumulative_us in sorted(rows, key=lambda row: -row[3])[:args.top]:
+        print("%-48s %10.1f %10.1f" % ("  " * min(depth, 4) + name, self_us / 1000, cumulative_us / 1000))
+
+    print("\n%-48s %10s" % ("package (self time)", "ms"))
+    for package, self_us in by_package(rows)[:args.top]:
+        print("%-48s %10.1f" % (package, self_us / 1000))
+
+    failed = False
+    forbidden = [m for m in (args.forbid or HEAVY_MODULES) if m in loaded]
+    if forbidden:
+        print("\nFORBIDDEN modules imported at startup: %s" % ", ".join(forbidden))
+        failed = True
+    if args.budget_ms is not None:
+        if median_ms > args.budget_ms:
+            print("\nOVER BUDGET: %.1f ms > %.1f ms" % (median_ms, args.budget_ms))
+            failed = True
+        else:
+            print("\nWithin budget: %.1f ms <= %.1f ms" % (median_ms, args.budget_ms))
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,24 @@
+"""
+Cold-start regression test for the API: `import app` in fresh interpreters,
+measured the same way as startup_profile.py.
+
+    python -m pytest script/test_startup.py
+"""
+import os
+
+from startup_profile import HEAVY_MODULES, profile_once
+
+# Median wall time of `import app`, with headroom over the ~550-800 ms it
+# takes today; pulling pandas or NumPy back onto the startup path alone
+# costs several hundred milliseconds more
+IMPORT_BUDGET_MS = 1200
+RUNS = 3
+
+def test_import_app_stays_cold():
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = [profile_once("app", cwd=here) for _ in range(RUNS)]
+    median_ms = sorted(seconds for seconds, _, _ in runs)[RUNS // 2] * 1000
+    loaded = set(runs[0][1])
+
+    assert not loaded & set(HEAVY_MODULES), "imported at startup: %s" % sorted(loaded & set(HEAVY_MODULES))
+    assert median_ms <= IMPORT_BUDGET_MS, "import app took %.0f ms (budget %d ms)" % (median_ms, IMPORT_BUDGET_MS)
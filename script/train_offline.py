@@ -0,0 +1,181 @@
+"""
+Offline Q-learning: train one Q-table on every user's stored schedules and
+logged stress, for the planner to start from.
+
+    python train_offline.py                          # train and export
+    python train_offline.py --epochs 5 --chunk-size 20000
+    python train_offline.py --out /tmp/trained.npz --dry-run
+
+Rows are streamed from scheduled_tasks in (user, start) order. That table
+holds each user's latest plan, so one episode per user covers the same
+multi-day horizon plan_schedule planned it over. Each episode is replayed as
+the agent would have played it: every Flexible block is a task action (its
+index among the remaining tasks in deadline order) and every Break a break
+action, with states from scheduler.build_state. As online, remaining_tasks
+counts everything not yet placed across the horizon, including the user's
+active flexible tasks the plan left out. Rewards follow the online ones, with
+task rewards scaled by the stress logged for the task against the user's
+baseline. Each chunk is applied with one SchedulerAgent.batch_update.
+Progress goes to stderr and a JSON report to stdout; the table is exported
+to FIKA_TRAINED_QTABLE (or --out), which the API loads read-only.
+"""
+import argparse
+import json
+import sys
+import time
+
+from entries import to_minutes
+from qtable_store import TRAINED_QTABLE_PATH, get_trained_qtable, save_trained_qtable
+from repository import get_repository
+from rl_agent import SchedulerAgent, BREAK_COLUMN, action_column, encode_state
+from scheduler import build_state, _deadline_key
+
+# Rows per chunk streamed from the database and applied as one batch update
+TRAIN_CHUNK_SIZE = 5000
+
+# Online rewards (see scheduler._fill_gaps_rl); a task's reward moves by up
+# to STRESS_WEIGHT with its logged stress relative to the user's baseline
+TASK_REWARD = 1.0
+BREAK_REWARD = 0.05
+STRESS_WEIGHT = 0.5
+
+def task_reward(task_stress, baseline):
+    if task_stress is None or baseline is None:
+        return TASK_REWARD
+    return TASK_REWARD + STRESS_WEIGHT * (baseline - task_stress) / 10
+
+def episodes(chunks):
+    """
+    Yield (user_id, rows) per user from chunks of history rows in
+    (user_id, start_time) order; an episode cut by a chunk boundary is held
+    back until it is complete.
+    """
+    user_id, rows = None, []
+    for chunk in chunks:
+        for row in chunk:
+            if row["user_id"] != user_id and rows:
+                yield user_id, rows
+                rows = []
+            user_id = row["user_id"]
+            rows.append(row)
+    if rows:
+        yield user_id, rows
+
+def episode_experiences(rows, user_prefs, tasks=()):
+    """
+    (states, action columns, rewards, next states) of one episode, states
+    encoded. `tasks` are the user's active task rows; the flexible ones the
+    plan did not place stay in remaining_tasks throughout.
+    """
+    # One stress reading per plan, like recent_stress online: the first day's
+    day_stress = next((row["day_stress"] for row in rows if row["day_stress"] is not None), None)
+    prefs = dict(user_prefs, recent_stress=day_stress)
+    placed = [row for row in rows if row["type"] == "Flexible" and row["task_id"] is not None]
+    placed_ids = {row["task_id"] for row in placed}
+    unplaced = [task for task in tasks if not task["fixed_time"] and task["id"] not in placed_ids]
+    remaining = sorted(placed + unplaced, key=_deadline_key)
+    states, actions, rewards, next_states = [], [], [], []
+    for row in rows:
+        if row["type"] == "Break":
+            action, reward = BREAK_COLUMN, BREAK_REWARD
+            state = build_state(to_minutes(row["start_time"]), remaining, prefs)
+        elif row["type"] == "Flexible" and row["task_id"] is not None:
+            state = build_state(to_minutes(row["start_time"]), remaining, prefs)
+            index = next(i for i, task in enumerate(remaining) if task is row)
+            remaining.pop(index)
+            action, reward = action_column(index), task_reward(row["task_stress"], prefs["stress_level"])
+        else:
+            continue  # Fixed blocks are not the agent's choice
+        states.append(encode_state(state))
+        actions.append(action)
+        rewards.append(reward)
+        next_states.append(encode_state(build_state(to_minutes(row["end_time"]), remaining, prefs)))
+    return states, actions, rewards, next_states
+
+def train(agent, repo, chunk_size=TRAIN_CHUNK_SIZE, progress=None):
+    """
+    One pass over the history. Each chunk's experiences go through a single
+    batch_update; `progress` is called with the running totals after each.
+    """
+    totals = {"rows": 0, "episodes": 0, "experiences": 0, "skipped_episodes": 0}
+    prefs = {}
+    tasks = {}  # active tasks of the users whose episodes are still open
+    batch = ([], [], [], [])
+
+    def flush():
+        agent.batch_update(*batch)
+        totals["experiences"] += len(batch[0])
+        for column in batch:
+            column.clear()
+
+    def counted(chunks):
+        for chunk in chunks:
+            users = {row["user_id"] for row in chunk}
+            missing = users - prefs.keys()
+            if missing:
+                prefs.update(repo.fetch_user_prefs_bulk(list(missing)))
+            missing = users - tasks.keys()
+            if missing:
+                tasks.update(repo.fetch_tasks_bulk(list(missing)))
+            totals["rows"] += len(chunk)
+            yield chunk
+            # Episodes completed by this chunk are in the batch by now
+            flush()
+            if progress:
+                progress(totals, agent)
+
+    for user_id, rows in episodes(counted(repo.stream_schedule_history(chunk_size))):
+        user_prefs = prefs.get(user_id)
+        user_tasks = tasks.pop(user_id, [])
+        if user_prefs is None:
+            # Schedule rows of a deleted user
+            totals["skipped_episodes"] += 1
+            continue
+        totals["episodes"] += 1
+        for column, values in zip(batch, episode_experiences(rows, user_prefs, user_tasks)):
+            column.extend(values)
+    flush()
+    return totals
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--epochs", type=int, default=3, help="passes over the history")
+    parser.add_argument("--chunk-size", type=int, default=TRAIN_CHUNK_SIZE)
+    parser.add_argument("--learning-rate", type=float, default=0.1)
+    parser.add_argument("--out", default=TRAINED_QTABLE_PATH, help="where to export the Q-table")
+    parser.add_argument("--warm-start", action="store_true", help="continue from the table already at --out")
+    parser.add_argument("--dry-run", action="store_true", help="train and report without exporting")
+    args = parser.parse_args()
+
+    agent = SchedulerAgent([])
+    agent.learning_rate = args.learning_rate
+    if args.warm_start:
+        agent.load_q_table(get_trained_qtable(args.out))
+    repo = get_repository()
+    started = time.perf_counter()
+    epochs = []
+    for epoch in range(1, args.epochs + 1):
+        epoch_started = time.perf_counter()
+
+        def progress(totals, agent, epoch=epoch, epoch_started=epoch_started):
+            elapsed = time.perf_counter() - epoch_started
+            print("epoch %d: %d rows, %d episodes, %d experiences, %d states, %.0f rows/s" % (
+                epoch, totals["rows"], totals["episodes"], totals["experiences"], agent.num_states,
+                totals["rows"] / elapsed if elapsed > 0 else 0,
+            ), file=sys.stderr)
+
+        totals = train(agent, repo, args.chunk_size, progress)
+        elapsed = time.perf_counter() - epoch_started
+        epochs.append(dict(totals, epoch=epoch, seconds=round(elapsed, 3),
+                           rows_per_second=round(totals["rows"] / elapsed, 1) if elapsed > 0 else None))
+
+    blob = agent.dump_q_table()
+    if not args.dry_run:
+        save_trained_qtable(blob, args.out)
+    print(json.dumps({
+        "epochs": epochs,
+        "states": agent.num_states,
+        "q_table_bytes": len(blob),
+        "exported_to": None if args.dry_run else args.out,
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
+    }, indent=2))